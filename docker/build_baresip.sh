@@ -13,7 +13,8 @@ apt-get -qq install -y \
     wget \
     build-essential \
     pkgconf \
-    cmake
+    cmake \
+    libjack-jackd2-dev
 
 apt-get -qq build-dep -y baresip
     
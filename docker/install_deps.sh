@@ -52,6 +52,8 @@ apt-get -qq install --no-install-recommends --no-install-suggests -y \
     libsoup2.4-1 \
     pulseaudio \
     pulseaudio-utils \
+    jackd2 \
+    gstreamer1.0-jack \
     libopus0 ca-certificates openssl libasound2 libmosquitto1 libspandsp2 libpulse0 pulseaudio libopenaptx0 libportaudio2 \
     gir1.2-gst-rtsp-server-1.0 \
     gir1.2-gstreamer-1.0 \
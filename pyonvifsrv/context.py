@@ -1,7 +1,18 @@
 import logging
+from urllib.parse import urlparse
 
 logger = logging.getLogger(__name__)
 
+class MediaProfile:
+
+    def __init__(self, token, width, height, fps, bitrate, streamUri):
+        self.token = token
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.bitrate = bitrate
+        self.streamUri = streamUri
+
 class Context:
     
     def __init__(self, config):
@@ -35,8 +46,35 @@ class Context:
         self.cameraBitrate = self.config.onvif.camera.bitrate
 
         self.snapshotUri = self.config.onvif.camera.snapshotUri
+        if self.config.rtsp_server.snapshot.enabled:
+            # Served by sip2rtsp on our own HTTP port
+            self.snapshotUri = self.hostUrl + "/api/snapshot"
         self.streamUri = self.config.onvif.camera.streamUri
 
+        self.profiles = self.createProfiles()
+
+        # Audio output (backchannel) level, 0-100, see setAudioOutputControl()
+        self.audioOutputLevel = 100
+        self.audioOutputLevelSetter = None
+        self.audioOutputLevelGetter = None
+
+    def createProfiles(self):
+        # One profile per RTSP stream, their URIs share scheme, host and port with the configured streamUri
+        streams = self.config.rtsp_server.streams
+        if not streams:
+            return [MediaProfile("main", self.cameraWidth, self.cameraHeight, self.cameraFps, self.cameraBitrate, self.streamUri)]
+
+        baseUri = urlparse(self.streamUri)
+        return [
+            MediaProfile(stream.name, stream.width, stream.height, stream.fps, stream.bitrate, baseUri._replace(path=stream.mount_point).geturl())
+            for stream in streams
+        ]
+
+    def getProfile(self, token):
+        for profile in self.profiles:
+            if profile.token == token:
+                return profile
+        return self.profiles[0]
 
     def getService(self, serviceName):
         for service in self.services:
@@ -52,3 +90,18 @@ class Context:
 
     def setFirmwareVersion(self, firmwareVersion):
         self.firmwareVersion = firmwareVersion
+
+    def setAudioOutputControl(self, getLevel, setLevel):
+        self.audioOutputLevelGetter = getLevel
+        self.audioOutputLevelSetter = setLevel
+
+    def getAudioOutputLevel(self):
+        if self.audioOutputLevelGetter:
+            return self.audioOutputLevelGetter()
+        return self.audioOutputLevel
+
+    def setAudioOutputLevel(self, level):
+        logger.info("Setting audio output level to {level}".format(level=level))
+        self.audioOutputLevel = level
+        if self.audioOutputLevelSetter:
+            self.audioOutputLevelSetter(level)
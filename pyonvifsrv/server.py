@@ -24,10 +24,15 @@ class OnvifServer:
             PtzService(self.context),
         ]
         self.context.services = self.services
+        self.extraHandlers = []
 
     def getContext(self) -> Context:
         return self.context
 
+    def addRequestHandlers(self, handlers):
+        """Serve additional tornado handlers next to the ONVIF services"""
+        self.extraHandlers += handlers
+
     class _MainHandler(RequestHandler):
         def get(self):
             logger.info(self.request)
@@ -37,7 +42,7 @@ class OnvifServer:
     async def start_server(self):
         logger.info("ONVIF server starting...")
 
-        handlers = [(r"/", self._MainHandler)]
+        handlers = [(r"/", self._MainHandler)] + self.extraHandlers
 
         default_handler_class = None
         for service in self.services:
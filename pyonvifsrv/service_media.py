@@ -22,7 +22,13 @@ class MediaService(ServiceBase):
 			</trt:GetSnapshotUriResponse>
         '''.format(snapshotUri=self.context.snapshotUri)
 
+    def _requestedProfile(self, data, methodName):
+        request = data["body"].get(methodName)
+        token = request.get("ProfileToken") if isinstance(request, dict) else None
+        return self.context.getProfile(token)
+
     def getStreamUri(self, data):
+        profile = self._requestedProfile(data, "GetStreamUri")
         return '''
             <trt:GetStreamUriResponse>
                 <trt:MediaUri>
@@ -32,7 +38,7 @@ class MediaService(ServiceBase):
                     <tt:Timeout>PT0S</tt:Timeout>
                 </trt:MediaUri>
             </trt:GetStreamUriResponse>
-        '''.format(streamUri=self.context.streamUri)
+        '''.format(streamUri=profile.streamUri)
 
     def getVideoSources(self, data):
         videoSrcName = "vidsrc0"
@@ -131,32 +137,39 @@ class MediaService(ServiceBase):
         '''
 
     def getProfiles(self, data):
+        profiles = "".join(self._profileXml(profile) for profile in self.context.profiles)
         return '''
             <trt:GetProfilesResponse>
-                <trt:Profiles fixed="true" token="main">
-                    <tt:Name>main</tt:Name>
+                {profiles}
+            </trt:GetProfilesResponse>
+        '''.format(profiles=profiles)
+
+    def _profileXml(self, profile):
+        return '''
+                <trt:Profiles fixed="true" token="{token}">
+                    <tt:Name>{token}</tt:Name>
                     <tt:VideoSourceConfiguration token="vscfg0">
                         <tt:Name>vscfg0</tt:Name>
-                        <tt:UseCount>1</tt:UseCount>
+                        <tt:UseCount>{profileCount}</tt:UseCount>
                         <tt:SourceToken>vidsrc0</tt:SourceToken>
-                        <tt:Bounds height="1080" width="1920" y="0" x="0"></tt:Bounds>
+                        <tt:Bounds height="{sourceHeight}" width="{sourceWidth}" y="0" x="0"></tt:Bounds>
                     </tt:VideoSourceConfiguration>
-                    <tt:VideoEncoderConfiguration token="main">
-                        <tt:Name>Main stream encoder</tt:Name>
+                    <tt:VideoEncoderConfiguration token="{token}">
+                        <tt:Name>{token} stream encoder</tt:Name>
                         <tt:UseCount>1</tt:UseCount>
                         <tt:Encoding>H264</tt:Encoding>
                         <tt:Resolution>
-                            <tt:Width>1920</tt:Width>
-                            <tt:Height>1080</tt:Height>
+                            <tt:Width>{width}</tt:Width>
+                            <tt:Height>{height}</tt:Height>
                         </tt:Resolution>
                         <tt:Quality>8</tt:Quality>
                         <tt:RateControl>
-                            <tt:FrameRateLimit>5</tt:FrameRateLimit>
+                            <tt:FrameRateLimit>{fps}</tt:FrameRateLimit>
                             <tt:EncodingInterval>1</tt:EncodingInterval>
-                            <tt:BitrateLimit>1000</tt:BitrateLimit>
+                            <tt:BitrateLimit>{bitrate}</tt:BitrateLimit>
                         </tt:RateControl>
                         <tt:H264>
-                            <tt:GovLength>30</tt:GovLength>
+                            <tt:GovLength>{govLength}</tt:GovLength>
                             <tt:H264Profile>High</tt:H264Profile>
                         </tt:H264>
                         <tt:Multicast>
@@ -172,7 +185,7 @@ class MediaService(ServiceBase):
                     </tt:VideoEncoderConfiguration>
                     <tt:PTZConfiguration token="default">
                         <tt:Name>default</tt:Name>
-                        <tt:UseCount>1</tt:UseCount>
+                        <tt:UseCount>{profileCount}</tt:UseCount>
                         <tt:NodeToken>default</tt:NodeToken>
                         <tt:DefaultAbsolutePantTiltPositionSpace>http://www.onvif.org/ver10/tptz/PanTiltSpaces/PositionGenericSpace</tt:DefaultAbsolutePantTiltPositionSpace>
                         <tt:DefaultAbsoluteZoomPositionSpace>http://www.onvif.org/ver10/tptz/ZoomSpaces/PositionGenericSpace</tt:DefaultAbsoluteZoomPositionSpace>
@@ -187,13 +200,23 @@ class MediaService(ServiceBase):
                         <tt:DefaultPTZTimeout>PT1093754.348S</tt:DefaultPTZTimeout>
                     </tt:PTZConfiguration>
                 </trt:Profiles>
-            </trt:GetProfilesResponse>
-        '''
+        '''.format(
+            token=profile.token,
+            profileCount=len(self.context.profiles),
+            sourceWidth=self.context.cameraWidth,
+            sourceHeight=self.context.cameraHeight,
+            width=profile.width,
+            height=profile.height,
+            fps=profile.fps,
+            bitrate=profile.bitrate,
+            govLength=profile.fps * 2,
+        )
 
     def getProfile(self, data):
+        profile = self._requestedProfile(data, "GetProfile")
         return '''
             <trt:GetProfileResponse>
-                <trt:Profile token="main">
+                <trt:Profile token="{token}">
                     <tt:Name>ProfileName</tt:Name>
                     <tt:VideoSourceConfiguration token="video-source-config-token">
                         <tt:Name>VideoSourceConfigName</tt:Name>
@@ -210,8 +233,8 @@ class MediaService(ServiceBase):
                         <tt:UseCount>1</tt:UseCount>
                         <tt:Encoding>H264</tt:Encoding>
                         <tt:Resolution>
-                            <tt:Width>1920</tt:Width>
-                            <tt:Height>1080</tt:Height>
+                            <tt:Width>{width}</tt:Width>
+                            <tt:Height>{height}</tt:Height>
                         </tt:Resolution>
                         <tt:Quality>1</tt:Quality>
                     </tt:VideoEncoderConfiguration>
@@ -233,7 +256,7 @@ class MediaService(ServiceBase):
                     </tt:MetadataConfiguration>
                 </trt:Profile>
             </trt:GetProfileResponse>
-        '''
+        '''.format(token=profile.token, width=profile.width, height=profile.height)
 
     def setVideoEncoderConfiguration(self, data):
         return '''
@@ -247,3 +270,63 @@ class MediaService(ServiceBase):
                 </trt:AudioSources>
             </trt:GetAudioSourcesResponse>
         '''
+
+    def getAudioOutputs(self, data):
+        return '''
+            <trt:GetAudioOutputsResponse>
+                <trt:AudioOutputs token="aout0">
+                </trt:AudioOutputs>
+            </trt:GetAudioOutputsResponse>
+        '''
+
+    def _audioOutputConfigurationXml(self, tag):
+        return '''
+                <trt:{tag} token="aoutcfg0">
+                    <tt:Name>aoutcfg0</tt:Name>
+                    <tt:UseCount>{profileCount}</tt:UseCount>
+                    <tt:OutputToken>aout0</tt:OutputToken>
+                    <tt:SendPrimacy>www.onvif.org/ver20/HalfDuplex/Auto</tt:SendPrimacy>
+                    <tt:OutputLevel>{outputLevel}</tt:OutputLevel>
+                </trt:{tag}>
+        '''.format(tag=tag, profileCount=len(self.context.profiles), outputLevel=self.context.getAudioOutputLevel())
+
+    def getAudioOutputConfigurations(self, data):
+        return '''
+            <trt:GetAudioOutputConfigurationsResponse>
+                {configuration}
+            </trt:GetAudioOutputConfigurationsResponse>
+        '''.format(configuration=self._audioOutputConfigurationXml("Configurations"))
+
+    def getAudioOutputConfiguration(self, data):
+        return '''
+            <trt:GetAudioOutputConfigurationResponse>
+                {configuration}
+            </trt:GetAudioOutputConfigurationResponse>
+        '''.format(configuration=self._audioOutputConfigurationXml("Configuration"))
+
+    def getAudioOutputConfigurationOptions(self, data):
+        return '''
+            <trt:GetAudioOutputConfigurationOptionsResponse>
+                <trt:Options>
+                    <tt:OutputTokensAvailable>aout0</tt:OutputTokensAvailable>
+                    <tt:SendPrimacyOptions>www.onvif.org/ver20/HalfDuplex/Auto</tt:SendPrimacyOptions>
+                    <tt:OutputLevelRange>
+                        <tt:Min>0</tt:Min>
+                        <tt:Max>100</tt:Max>
+                    </tt:OutputLevelRange>
+                </trt:Options>
+            </trt:GetAudioOutputConfigurationOptionsResponse>
+        '''
+
+    def setAudioOutputConfiguration(self, data):
+        # An output level of 0 mutes the backchannel, e.g. for push-to-talk
+        configuration = data["body"]["SetAudioOutputConfiguration"].get("Configuration") or {}
+        level = configuration.get("OutputLevel") if isinstance(configuration, dict) else None
+        if level is not None:
+            try:
+                self.context.setAudioOutputLevel(int(level))
+            except ValueError:
+                logger.error("Invalid audio output level {level}".format(level=level))
+        return '''
+            <trt:SetAudioOutputConfigurationResponse></trt:SetAudioOutputConfigurationResponse>
+        '''
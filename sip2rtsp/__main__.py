@@ -3,6 +3,7 @@ import faulthandler
 faulthandler.enable()
 
 from sip2rtsp.gi import GLib  # noqa: F401
+from sip2rtsp.glib_loop import new_event_loop
 
 import threading
 import signal
@@ -18,12 +19,19 @@ sys.path.append("../pyonvifsrv")
 from sip2rtsp.version import VERSION
 from sip2rtsp.app import Sip2RtspApp
 from sip2rtsp.config import Sip2RtspConfig
-from sip2rtsp.config import BaresipConfig
+from sip2rtsp.config import AudioBridgeEnum, BaresipConfig
+from sip2rtsp.discovery import discover_source
+from sip2rtsp.const import STARTUP_MAX_PARALLEL_COMMANDS
+from sip2rtsp.metrics import StageTimer
+from sip2rtsp.rtsp_router import RtspRouter
+from sip2rtsp.workers import WorkerReporter, WorkerSupervisor, init_worker, load_worker
 
 from pyonvifsrv.server import OnvifServer
+from tornado.web import Application
 
 from sip2rtsp.s6gen import S6Generator
 from sip2rtsp.pactl import create_pa_devices
+from sip2rtsp.jack import start_jackd
 
 threading.current_thread().name = "sip2rtsp"
 
@@ -73,7 +81,7 @@ def init_config() -> Sip2RtspConfig:
     return user_config.runtime_config
 
 
-async def shutdown(signal, loop, glib_loop, glib_thread):
+async def shutdown(signal, loop):
 
     logger.info(f"Received exit signal {signal.name}...")
 
@@ -84,17 +92,172 @@ async def shutdown(signal, loop, glib_loop, glib_thread):
     logger.debug(f"Cancelling {len(tasks)} outstanding tasks")
     await asyncio.gather(*tasks, return_exceptions=True)
     loop.stop()
+    logger.debug(f"Done.")
+
+
+async def provision(loop, glib_context, name, named_config, environment_vars, limiter, router):
+    """Set up one connection: baresip config, audio devices, s6 service, app.
+
+    The external commands of all connections run concurrently, at most
+    STARTUP_MAX_PARALLEL_COMMANDS at a time.
+    """
+    timer = StageTimer()
+    logger.debug(f"Provisioning connection {name}: {named_config}")
+
+    with timer.stage("baresip_config"):
+        baresip_config = BaresipConfig(name, named_config)
+        baresip_config.write_config(f"/etc/baresip/config-{name}/config")
+
+    with timer.stage("audio_devices"):
+        if named_config.sip.audio_bridge == AudioBridgeEnum.pulse:
+            await create_pa_devices(
+                limiter, named_config.sip.audio_device, named_config.sip.audio_source
+            )
+
+    with timer.stage("supervisor"):
+        s6 = S6Generator(name, "baresip", f"/etc/baresip/config-{name}/config")
+        s6.generate_files()
+        await s6.start_supervisor(limiter)
+
+    with timer.stage("discovery"):
+        source = None
+        rtsp_config = named_config.rtsp_server
+        if rtsp_config.source_uri and not (rtsp_config.launch_string or rtsp_config.streams):
+            # Off the loop, the app builds its launch string from the result
+            source = await discover_source(rtsp_config)
+
+    with timer.stage("app"):
+        sip2rtsp_app = Sip2RtspApp(
+            loop, glib_context, named_config, environment_vars, router=router, source=source
+        )
+        onvifServer = OnvifServer(loop, named_config)
+        onvifServer.getContext().setFirmwareVersion(VERSION)
+        onvifServer.addRequestHandlers(sip2rtsp_app.get_request_handlers())
+        onvifServer.getContext().setAudioOutputControl(
+            sip2rtsp_app.audio_control.get_output_level,
+            sip2rtsp_app.audio_control.set_output_level,
+        )
+
+        def onRinging(_peerUri: str):
+            onvifServer.getContext().triggerDoorbellEvent()
+
+        sip2rtsp_app.set_RingingCallback(onRinging)
+
+    logger.info(f"Provisioned connection {name} in {timer}")
+    return sip2rtsp_app, onvifServer
+
+
+async def provision_all(loop, glib_context, config, limiter):
+    timer = StageTimer()
+
+    # One JACK server for all connections bridging audio over JACK
+    with timer.stage("jackd"):
+        if any(c.sip.audio_bridge == AudioBridgeEnum.jack for c in config.connections.values()):
+            await start_jackd()
+
+    # One RTSP server for all connections, each on its own mount points
+    router = None
+    if config.shared_rtsp_server.enabled:
+        router = RtspRouter(glib_context, config.shared_rtsp_server.port)
+
+    with timer.stage("connections"):
+        connections = await asyncio.gather(
+            *(
+                provision(
+                    loop, glib_context, name, named_config, config.environment_vars, limiter, router
+                )
+                for name, named_config in config.connections.items()
+            )
+        )
+
+    logger.info(f"Provisioned {len(connections)} connection(s) in {timer}")
+    return connections
+
+
+def run_connections(config, worker=None):
+    # All connections share the default GLib main context, dispatched by the asyncio loop
+    glib_context = GLib.MainContext.default()
+    loop = new_event_loop(glib_context)
+    asyncio.set_event_loop(loop)
+    loop.set_debug(False)
+
+    limiter = asyncio.Semaphore(STARTUP_MAX_PARALLEL_COMMANDS)
+    connections = loop.run_until_complete(
+        provision_all(loop, glib_context, config, limiter)
+    )
+    if worker is not None:
+        # Health and metrics for the supervisor
+        reporter = WorkerReporter(
+            worker,
+            dict(zip(config.connections, (app for app, _ in connections))),
+            config.workers.report_interval,
+        )
+
+    async def graceful_shutdown(s, loop):
+        await asyncio.gather(
+            *(app.stop() for app, _ in connections), return_exceptions=True
+        )
+        await shutdown(s, loop)
+
+    signals = (signal.SIGHUP, signal.SIGTERM, signal.SIGINT)
+    for s in signals:
+        loop.add_signal_handler(
+            s,
+            lambda s=s: asyncio.create_task(graceful_shutdown(s, loop)),
+        )
+
+    tasks = []
+    for sip2rtsp_app, onvifServer in connections:
+        tasks.append(loop.create_task(sip2rtsp_app.start()))
+        tasks.append(loop.create_task(onvifServer.start_server()))
+    if worker is not None:
+        tasks.append(loop.create_task(reporter.run()))
+
+    try:
+        logger.debug(f"Entering loop.run_forever()...")
+        loop.run_forever()
+        logger.debug(f"Left loop.run_forever()...")
+    except KeyboardInterrupt:  # pragma: no branch
+        logger.debug(f"Received KeyboardInterrupt")
+    finally:
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    logger.debug(f"main() exit...")
+
 
-    if glib_thread and glib_loop:
-        # Now handle the GLib main loop
-        logger.debug(f"Quitting glib main loop...")
-        glib_loop.quit()
-        logger.debug(f"Done.")
-        logger.debug(f"Joining glib main loop thread...")
-        glib_thread.join()
-        logger.debug(f"Done.")
-        glib_loop = None
-        glib_thread = None
+def run_supervisor(config):
+    loop = asyncio.get_event_loop()
+    supervisor = WorkerSupervisor(config)
+
+    async def start():
+        # One JACK server, shared by the workers' connections
+        if any(c.sip.audio_bridge == AudioBridgeEnum.jack for c in config.connections.values()):
+            await start_jackd()
+        supervisor.start()
+        Application(supervisor.get_request_handlers()).listen(config.workers.status_port)
+        logger.info(
+            f"Supervising {len(supervisor.workers)} workers, "
+            f"health and metrics on port {config.workers.status_port}"
+        )
+
+    async def graceful_shutdown(s):
+        logger.info(f"Received exit signal {s.name}, stopping workers...")
+        await supervisor.stop()
+        loop.stop()
+
+    for s in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(
+            s, lambda s=s: asyncio.create_task(graceful_shutdown(s))
+        )
+
+    try:
+        loop.run_until_complete(start())
+        loop.run_forever()
+    finally:
+        loop.close()
+    logger.debug(f"Supervisor exit...")
 
 
 if __name__ == "__main__":
@@ -127,64 +290,15 @@ if __name__ == "__main__":
 
     set_log_levels(config)
 
-    loop = asyncio.get_event_loop()
-    loop.set_debug(False)
-
-    main_task = {}
-    onvif_task = {}
-    glib_loop_h = {}
-    glib_thread_h = {}
-    for (name, named_config) in config.connections.items():
-      glib_loop_h[name] = glib_loop = GLib.MainLoop()
-      glib_thread_h[name] = glib_thread = threading.Thread(target=glib_loop.run)
-      glib_thread.start()
-
-      print(named_config)
-      baresip_config = BaresipConfig(name, named_config)
-      baresip_config.write_config(f"/etc/baresip/config-{name}/config")
-
-      create_pa_devices(named_config.sip.audio_device, named_config.sip.audio_source)
-      s6 = S6Generator(name, "baresip", f"/etc/baresip/config-{name}/config")
-      s6.generate_files()
-      s6.start_supervisor()
-
-      sip2rtsp_app = Sip2RtspApp(loop, glib_loop, named_config, config.environment_vars)
-      onvifServer = OnvifServer(loop, named_config)
-      onvifServer.getContext().setFirmwareVersion(VERSION)
-
-      def onRinging(_peerUri: str):
-          onvifServer.getContext().triggerDoorbellEvent()
-
-      sip2rtsp_app.set_RingingCallback(onRinging)
-
-      async def graceful_shutdown(s, loop, glib_loop, glib_thread):
-          await sip2rtsp_app.stop()
-          await shutdown(s, loop, glib_loop, glib_thread)
-
-      signals = (signal.SIGHUP, signal.SIGTERM, signal.SIGINT)
-      for s in signals:
-          loop.add_signal_handler(
-              s,
-              lambda s=s: asyncio.create_task(
-                  graceful_shutdown(s, loop, glib_loop, glib_thread)
-              ),
-          )
-
-      main_task[name] = loop.create_task(sip2rtsp_app.start())
-      onvif_task[name] = loop.create_task(onvifServer.start_server())
-
-    for (name, named_config) in config.connections.items():
-      try:
-          asyncio.set_event_loop(loop)
-          logger.debug(f"Entering loop.run_forever()...")
-          loop.run_forever()
-          logger.debug(f"Left loop.run_forever()...")
-      except KeyboardInterrupt:  # pragma: no branch
-          logger.debug(f"Received KeyboardInterrupt")
-      finally:
-          loop.run_until_complete(main_task[name])
-          loop.run_until_complete(onvif_task[name])
-          loop.close()
-          asyncio.set_event_loop(None)
-
-    logger.debug(f"main() exit...")
+    worker = load_worker()
+    if worker is not None:
+        init_worker(worker)
+        config.connections = {
+            name: config.connections[name] for name in worker["connections"]
+        }
+        threading.current_thread().name = f"sip2rtsp-worker-{worker['index']}"
+    elif config.workers.count > 1:
+        run_supervisor(config)
+        sys.exit(0)
+
+    run_connections(config, worker)
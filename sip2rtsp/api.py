@@ -0,0 +1,88 @@
+import json
+import logging
+
+from tornado.web import HTTPError, RequestHandler
+
+logger = logging.getLogger(__name__)
+
+
+class StatsHandler(RequestHandler):
+    """Serve the dict returned by get_stats() as JSON"""
+
+    def initialize(self, get_stats):
+        self.get_stats = get_stats
+
+    def get(self):
+        self.set_header("Cache-Control", "no-store")
+        self.write(self.get_stats())
+
+
+class HealthHandler(RequestHandler):
+    """Serve the dict returned by get_health() as JSON, with status 503 unless its "healthy" is true"""
+
+    def initialize(self, get_health):
+        self.get_health = get_health
+
+    def get(self):
+        health = self.get_health()
+        self.set_header("Cache-Control", "no-store")
+        if not health.get("healthy"):
+            self.set_status(503)
+        self.write(health)
+
+
+class SnapshotHandler(RequestHandler):
+    """Serve the JPEG returned by await get_jpeg(key), 503 (404 for an unknown key) if there is none"""
+
+    def initialize(self, get_jpeg):
+        self.get_jpeg = get_jpeg
+
+    async def get(self):
+        key = self.get_query_argument("id", None)
+        jpeg = await self.get_jpeg(key)
+        if jpeg is None:
+            self.send_error(404 if key else 503)
+            return
+        self.set_header("Content-Type", "image/jpeg")
+        self.set_header("Cache-Control", "no-store")
+        self.write(jpeg)
+
+
+class AudioHandler(RequestHandler):
+    """Get (GET) or change (POST) the mute and volume state of an AudioControl.
+
+    POST takes a JSON object like {"microphone": {"mute": false, "volume": 1.0}}
+    and returns the new state. Nothing is changed unless every entry is valid.
+    """
+
+    SETTINGS = ("mute", "volume")
+
+    def initialize(self, audio_control):
+        self.audio_control = audio_control
+
+    def get(self):
+        self.set_header("Cache-Control", "no-store")
+        self.write(self.audio_control.get_stats())
+
+    def post(self):
+        try:
+            changes = json.loads(self.request.body or b"{}")
+            if not isinstance(changes, dict):
+                raise ValueError("Expected a JSON object of audio directions")
+            for direction, change in changes.items():
+                if not isinstance(change, dict):
+                    raise ValueError(f"Expected a JSON object for {direction}")
+                unknown = set(change) - set(self.SETTINGS)
+                if unknown:
+                    raise ValueError(f"Unknown audio settings {', '.join(sorted(unknown))}")
+                self.audio_control.validate(
+                    direction, mute=change.get("mute"), volume=change.get("volume")
+                )
+        except ValueError as e:
+            raise HTTPError(400, reason=str(e))
+
+        for direction, change in changes.items():
+            self.audio_control.set(
+                direction, mute=change.get("mute"), volume=change.get("volume")
+            )
+        self.get()
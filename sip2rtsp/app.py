@@ -2,67 +2,282 @@ import asyncio
 import logging
 import os
 import signal
+import time
 
 from sip2rtsp.version import VERSION
 from sip2rtsp.gi import GstRtspServer, GstRtsp
+from sip2rtsp import jack
 from sip2rtsp.baresip_ctrl import BaresipControl
+from sip2rtsp.api import AudioHandler, SnapshotHandler, StatsHandler
+from sip2rtsp.audio_control import MICROPHONE, AudioControl
+from sip2rtsp.calls import CallTracker
+from sip2rtsp.config import AudioBridgeEnum
+from sip2rtsp.discovery import (
+    auto_launch_string,
+    build_audio_encoder,
+    build_backchannel_launch,
+    build_decoded_source,
+)
+from sip2rtsp.media import create_media_factory, create_stream_factories
+from sip2rtsp.metrics import LatencyHistogram
+from sip2rtsp.rtcp import RtcpTelemetry
+from sip2rtsp.rtsp_stats import RtspStats
+from sip2rtsp.snapshot import Snapshotter
 from sip2rtsp.const import (
 #    BARESIP_CTRL_HOST,
 #    BARESIP_CTRL_PORT,
     BARESIP_CTRL_REQUEST_TIMEOUT,
     EVENT_TYPE,
+    ONVIF_BACKCHANNEL_REQUIRE,
 )
 
 logger = logging.getLogger(__name__)
 
 
+class CallCoordinator:
+    """Coordinates the call operations of one connection.
+
+    Concurrent requests for the same operation share a single in-flight
+    baresip command, a dial waits for a pending hangup, and a hangup cancels a
+    pending dial: before the dial was sent it is simply dropped, otherwise
+    the hangup follows it on the socket and ends the call baresip created.
+    Must only be used from the asyncio loop.
+    """
+
+    def __init__(self, bs_ctrl, calls, remote_uri):
+        self.bs_ctrl = bs_ctrl
+        self.calls = calls
+        self.remote_uri = remote_uri
+        self.inflight = {}
+        self.dial_sent = False
+
+    async def _singleflight(self, name, operation):
+        task = self.inflight.get(name)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(operation())
+            self.inflight[name] = task
+            task.add_done_callback(lambda _: self.inflight.pop(name, None))
+        else:
+            logger.debug(f"Joining in-flight {name}")
+        try:
+            # Shielded, so one waiter giving up does not cancel it for the others
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.cancelled() and not asyncio.current_task().cancelling():
+                return None
+            raise
+
+    async def answer_or_dial(self):
+        hangup = self.inflight.get("hangup")
+        if hangup:
+            await asyncio.wait([hangup])
+
+        if self.calls.incoming:
+            return await self._singleflight("accept", self._accept)
+        if "dial" in self.inflight or not self.calls.active:
+            return await self._singleflight("dial", self._dial)
+        return None
+
+    async def hangup(self, reason):
+        dial = self.inflight.get("dial")
+        if dial:
+            logger.info(f"{reason}: Cancelling pending dial...")
+            dial.cancel()
+            await asyncio.wait([dial])
+        return await self._singleflight("hangup", lambda: self._hangup(reason))
+
+    async def _accept(self):
+        logger.info("ONVIF backchannel requested. Answering incoming call...")
+        self.calls.mark_accepting()
+        result = await self.bs_ctrl.accept()
+        logger.info("Answering done...")
+        return result
+
+    def _mark_dial_sent(self):
+        self.dial_sent = True
+
+    async def _dial(self):
+        logger.info("ONVIF backchannel requested. Dialing...")
+        # Mark the call before awaiting, so SETUPs for the other streams
+        # see it and do not dial a second time
+        self.calls.mark_dialing(self.remote_uri)
+        self.dial_sent = False
+        try:
+            result = await self.bs_ctrl.dial(self.remote_uri, self._mark_dial_sent)
+        except asyncio.CancelledError:
+            if not self.dial_sent:
+                self.calls.clear_dialing()
+            raise
+        if result is None:
+            self.calls.clear_dialing()
+        logger.info("Dialing done...")
+        return result
+
+    async def _hangup(self, reason):
+        if not self.calls.active:
+            return None
+        logger.info(f"{reason}: Hanging up...")
+        result = await self.bs_ctrl.hangup()
+        if result is not None:
+            # A dial that baresip has not reported yet ended with this hangup
+            self.calls.clear_dialing()
+        logger.info(f"{reason}: Hanging up done...")
+        return result
+
+
 class Sip2RtspApp:
-    def __init__(self, aioloop, loop, config, environment_vars) -> None:
-        self.ringCallback = None
-        self.pendingIncomingCall = False
+    def __init__(
+        self, aioloop, glib_context, config, environment_vars, router=None, source=None
+    ) -> None:
+        self.ringSubscription = None
+        self.calls = CallTracker()
+        # RTSP client -> (start time, expiry timer) of speculative dials
+        self.early_dials = {}
+        self.early_dial_saved = LatencyHistogram()
+        # RTSP clients that set up the backchannel and share the call
+        self.backchannel_clients = set()
 
         self.aioloop = aioloop
-        self.loop = loop
+        # Dispatched by aioloop (see GLibSelector). RTSP clients are served by the
+        # server's thread pool, so their request handlers must only hand over
+        # to aioloop, media preparation never blocks it
+        self.glib_context = glib_context
+        self.tasks = set()
         self.config = config
         self.environment_vars = environment_vars
 
-        self.server = GstRtspServer.RTSPOnvifServer.new()
-        self.factory = GstRtspServer.RTSPOnvifMediaFactory.new()
-        self.factory.set_media_gtype(GstRtspServer.RTSPOnvifMedia)
-
-        self.factory.set_backchannel_launch(
-            self.config.rtsp_server.backchannel_launch_string
-        )
-        self.factory.set_launch(self.config.rtsp_server.launch_string)
-
-        self.factory.set_shared(False)
-        self.factory.set_latency(self.config.rtsp_server.latency)
-        self.factory.set_enable_rtcp(self.config.rtsp_server.enable_rtcp)
-        # self.factory.set_backchannel_bandwidth(2000)
-        # self.factory.set_protocols(GstRtsp.RTSPLowerTrans.TCP)
-        # self.factory.set_profiles(GstRtsp.RTSPProfile.AVP)
-
-        # Connect gstreamer signals
-        self.server.connect("client-connected", self.client_connected)
-        self.server.get_mount_points().add_factory(
-            self.config.rtsp_server.mount_point, self.factory
-        )
-        self.server.set_service(str(self.config.rtsp_server.port))
-
-        # Attach gstreamer RTSP server to our GLib event loop
-        self.server.attach(self.loop.get_context())
+        # With a router, the RTSP server is shared by all connections, which
+        # routes the client requests for our mount points to us
+        self.router = router
+        self.server = router.server if router else GstRtspServer.RTSPOnvifServer.new()
+        # SourceInfo of rtsp_server.source_uri, discovered by the caller off
+        # the loop (see discover_source())
+        self.source = source
+        self.factories, self.shared_source = self.create_factories()
+        self.rtsp_stats = RtspStats()
+        self.rtsp_stats_task = None
+        self.watchdog_task = None
+        self.audio_control = AudioControl(self.config.rtsp_server.push_to_talk)
+        if self.shared_source:
+            self.audio_control.add_pipeline(self.shared_source.pipeline)
+
+        self.jack_bridge = config.sip.audio_bridge == AudioBridgeEnum.jack
+        for mount_point, factory in self.factories.items():
+            if self.jack_bridge and not config.rtsp_server.backchannel_launch_string:
+                factory.set_backchannel_launch(build_backchannel_launch(config.sip))
+            self.server.get_mount_points().add_factory(mount_point, factory)
+            self.rtsp_stats.attach(factory, mount_point)
+            self.audio_control.attach(factory)
+
+        if router:
+            router.add(self)
+        else:
+            # Connect gstreamer signals
+            self.server.connect("client-connected", self.client_connected)
+            self.server.set_service(str(self.config.rtsp_server.port))
+            # Attach gstreamer RTSP server to our GLib main context
+            self.server.attach(self.glib_context)
+
+        self.snapshotter = None
+        snapshot_config = self.config.rtsp_server.snapshot
+        if snapshot_config.enabled:
+            self.snapshotter = Snapshotter(
+                self.shared_source.latest_video,
+                snapshot_config.ttl,
+                snapshot_config.width,
+                snapshot_config.height,
+                snapshot_config.quality,
+                snapshot_config.pin_time,
+            )
 
         self.bs_ctrl = BaresipControl(
             config.sip.ctrl_host,
             config.sip.ctrl_port,
             BARESIP_CTRL_REQUEST_TIMEOUT
         )
-        self.bs_ctrl.set_callback(self.event_handler)
+        self.bs_ctrl.events.subscribe(self.event_handler, name="app")
+        self.bs_ctrl.set_reconnect_callback(self.reconcile_calls)
+        self.coordinator = CallCoordinator(
+            self.bs_ctrl, self.calls, self.config.sip.remote_uri
+        )
+
+        self.rtcp = RtcpTelemetry()
+        if self.config.sip.rtp_stats:
+            self.bs_ctrl.events.subscribe(
+                self.rtcp.handle_event, types=[EVENT_TYPE.CALL_RTCP], name="rtcp"
+            )
+
+    def create_factories(self):
+        """Media factories by mount point, and the SharedSource feeding them if any"""
+        rtsp_config = self.config.rtsp_server
+        if rtsp_config.streams:
+            if rtsp_config.launch_string:
+                source_launch = rtsp_config.launch_string
+            else:
+                source_launch = build_decoded_source(rtsp_config.source_uri)
+            return create_stream_factories(
+                rtsp_config, source_launch, build_audio_encoder(self.config.sip)
+            )
 
+        launch_string = rtsp_config.launch_string
+        if not launch_string and rtsp_config.source_uri:
+            launch_string = auto_launch_string(self.config, self.source)
+        factory, shared_source = create_media_factory(rtsp_config, launch_string)
+        return {rtsp_config.mount_point: factory}, shared_source
 
     def set_RingingCallback(self, callback):
         """Set the callback function to be called when an incoming call event is signalled"""
-        self.ringCallback = callback
+        if self.ringSubscription:
+            self.ringSubscription.cancel()
+
+        async def ringing(data):
+            if self.snapshotter and self.config.rtsp_server.snapshot.prefetch:
+                if self.shared_source.running:
+                    # Everyone fetches a snapshot on the doorbell event, have it ready
+                    await self.snapshotter.prefetch(
+                        data.get("id"), self.config.rtsp_server.snapshot.prefetch_timeout
+                    )
+                else:
+                    # No frame is coming, do not hold back the doorbell event for it
+                    logger.warning("Shared source is not running, no snapshot prefetched")
+            callback(data["peeruri"])
+
+        self.ringSubscription = self.bs_ctrl.events.subscribe(
+            ringing,
+            types=[EVENT_TYPE.CALL_INCOMING],
+            name="ringing",
+        )
+
+    def get_request_handlers(self):
+        """Tornado handlers for the HTTP API served by the ONVIF server"""
+        handlers = [
+            (r"/api/rtcp", StatsHandler, dict(get_stats=self.rtcp.get_stats)),
+            (r"/api/calls", StatsHandler, dict(get_stats=self.get_call_stats)),
+            (r"/api/media", StatsHandler, dict(get_stats=self.get_media_stats)),
+            (r"/api/rtsp", StatsHandler, dict(get_stats=self.rtsp_stats.get_stats)),
+            (r"/api/audio", AudioHandler, dict(audio_control=self.audio_control)),
+        ]
+        if self.snapshotter:
+            handlers.append(
+                (r"/api/snapshot", SnapshotHandler, dict(get_jpeg=self.snapshotter.get_jpeg))
+            )
+        return handlers
+
+    def get_call_stats(self):
+        stats = self.calls.get_stats()
+        stats["early_dial_saved"] = self.early_dial_saved.snapshot()
+        stats["commands"] = self.bs_ctrl.get_command_stats()
+        return stats
+
+    def get_media_stats(self):
+        stats = {
+            "shared_source": self.shared_source.get_stats() if self.shared_source else None
+        }
+        if self.snapshotter:
+            stats["snapshot"] = self.snapshotter.get_stats()
+        if self.shared_source and self.shared_source.watchdog:
+            stats["watchdog"] = self.shared_source.watchdog.get_stats()
+        return stats
 
     def set_environment_vars(self) -> None:
         for key, value in self.environment_vars.items():
@@ -70,54 +285,114 @@ class Sip2RtspApp:
 
     async def start(self) -> None:
         logger.info(f"Starting SIP2RTSP ({VERSION})")
-        logger.info(f"GST RTSP server is listening on {self.server.get_address()}:{self.server.get_service()}")
+        logger.info(
+            f"GST RTSP server is listening on {self.server.get_address()}:{self.server.get_service()}, "
+            f"mount points: {', '.join(self.factories)}"
+        )
         try:
             self.set_environment_vars()
         except Exception as e:
             print(e)
             os.kill(os.getpid(), signal.SIGTERM)
 
+        self.rtsp_stats_task = self.aioloop.create_task(self.rtsp_stats.run())
+        if self.shared_source and self.shared_source.watchdog:
+            self.watchdog_task = self.aioloop.create_task(self.shared_source.watchdog.run())
         await self.bs_ctrl.start()
-        async def dial():
-            if self.pendingIncomingCall:
-                logger.info("ONVIF backchannel requested. Answering incoming call...")
-                await self.bs_ctrl.accept()
-                logger.info("Answering done...")
-            else:
-                logger.info("ONVIF backchannel requested. Dialing...")
-                await self.bs_ctrl.dial(self.config.sip.remote_uri)
-                logger.info("Dialing done...")
-
-        asyncio.run_coroutine_threadsafe(dial(), self.aioloop)
+        self.spawn(self.answer_or_dial())
 
     async def stop(self) -> None:
+        if self.rtsp_stats_task:
+            self.rtsp_stats_task.cancel()
+        if self.watchdog_task:
+            self.watchdog_task.cancel()
         # Try to hang up any active calls gracefully
-        callstat = await self.bs_ctrl.callstat()
-        if callstat:
-            if "(no active calls)" not in callstat:
-                logger.info(f"stop: Hanging up...")
-                await self.bs_ctrl.hangup()
-                logger.info(f"stop: Hanging up done...")
-        else:
-            # If callstat() fails, we assume there is an active call
-            # This might fail too...
-            await self.bs_ctrl.hangup()
+        await self.hangup_active("stop")
         logger.info(f"Stopped SIP2RTSP ({VERSION})")
 
+    def spawn(self, coro):
+        """Run coro as a task of the asyncio loop, e.g. from a GStreamer signal handler.
+
+        The RTSP client signals are emitted on the client threads of the
+        server and streaming signals on the streaming threads, their
+        coroutines are handed over thread-safely. Bus watches and timers
+        run on the asyncio thread and create the task directly.
+        """
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not self.aioloop:
+            return asyncio.run_coroutine_threadsafe(coro, self.aioloop)
+        task = self.aioloop.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def answer_or_dial(self):
+        await self.coordinator.answer_or_dial()
+
+    async def hangup_active(self, reason):
+        await self.coordinator.hangup(reason)
+
+    async def early_dial(self, client):
+        """Dial speculatively when a client announces it wants the backchannel"""
+        if client in self.early_dials or (self.calls.active and not self.calls.incoming):
+            return
+        window = self.config.sip.early_dial_window
+        timer = self.aioloop.call_later(
+            window, lambda: self.spawn(self._expire_early_dial(client))
+        )
+        self.early_dials[client] = (time.monotonic(), timer)
+        logger.info("DESCRIBE requires the ONVIF backchannel. Dialing early...")
+        await self.answer_or_dial()
+
+    async def claim_early_dial(self, client):
+        entry = self.early_dials.pop(client, None)
+        if entry is None:
+            return
+        started, timer = entry
+        timer.cancel()
+        now = time.monotonic()
+        # Audio is available min(dial-to-established, head start) earlier
+        # than if we had waited for the SETUP
+        established = [c.established for c in self.calls.calls.values() if c.established]
+        saved = min(now, min(established)) - started if established else now - started
+        self.early_dial_saved.record(saved)
+        logger.info(f"Early dial saved {saved * 1000:.0f} ms for this session")
+
+    async def _expire_early_dial(self, client):
+        if not self.early_dials.pop(client, None):
+            return
+        if self.early_dials or self.backchannel_clients:
+            # The call is shared, another client set up the backchannel or
+            # dialed early and may still do so
+            logger.info("Early dial expired, the call is in use by another client")
+            return
+        await self.hangup_active(
+            f"No backchannel SETUP within {self.config.sip.early_dial_window}s"
+        )
+
+    def reconcile_calls(self, calls):
+        # Events may have been missed while baresip was restarting, so rebuild
+        # the call model from its listcalls output instead.
+        self.calls.reconcile(calls)
+        logger.info(f"Active calls after reconnect: {len(self.calls.calls)}")
+
     def event_handler(self, data):
         # logger.debug("Event: " + str(data))
+        self.calls.handle_event(data)
         if data["type"] == EVENT_TYPE.CALL_INCOMING:
             logger.info("Incoming call from {peeruri}".format(peeruri=data["peeruri"]))
-            self.pendingIncomingCall = True
-            if self.ringCallback:
-                self.ringCallback(data["peeruri"])
         elif data["type"] == EVENT_TYPE.CALL_CLOSED:
             logger.info("Call closed from {peeruri}".format(peeruri=data["peeruri"]))
-            self.pendingIncomingCall = False
         elif data["type"] == EVENT_TYPE.CALL_ESTABLISHED:
             logger.info(
                 "Call established from {peeruri}".format(peeruri=data["peeruri"])
             )
+            if self.jack_bridge:
+                # baresip opens its JACK ports with the call audio
+                self.spawn(jack.connect_bridge(self.config.sip))
 
     def client_play_request(self, client, context: GstRtspServer.RTSPContext):
         logger.debug(
@@ -130,6 +405,12 @@ class Sip2RtspApp:
         res, value = reqmsg.get_header(GstRtsp.RTSPHeaderField.REQUIRE, 0)
         if res == GstRtsp.RTSPResult.OK:
             logger.debug("PLAY request header: Require: {value}".format(value=value))
+        if context.sessmedia:
+            self.rtsp_stats.bind_client(
+                context.sessmedia.get_media(), client.get_connection().get_ip()
+            )
+        if self.jack_bridge and self.calls.is_established:
+            self.spawn(jack.connect_bridge(self.config.sip))
 
     def client_setup_request(self, client, context: GstRtspServer.RTSPContext):
         control = context.stream.get_control()
@@ -141,30 +422,23 @@ class Sip2RtspApp:
             )
         )
         uri: GstRtsp.RTSPUrl = context.uri
+        if "stream=2" in uri.abspath:
+            self.aioloop.call_soon_threadsafe(self.backchannel_clients.add, client)
+            self.spawn(self.claim_early_dial(client))
 #        uri.dump()
 #        print(dir(uri))
         # res, value = reqmsg.get_header(GstRtsp.RTSPHeaderField.URI, 0)
 #        logger.info(f"Received SETUP request res: {res}, value: {value}")
         #if res == GstRtsp.RTSPResult.OK:
 #            logger.debug("SETUP request header: Require: {value}".format(value=value))
-        async def dial():
-            callstat = await self.bs_ctrl.callstat()
-            if callstat:
-                if "(no active calls)" in callstat:
-                    if self.pendingIncomingCall:
-                        logger.info("ONVIF backchannel requested. Answering incoming call...")
-                        await self.bs_ctrl.accept()
-                        logger.info("Answering done...")
-                    else:
-                        logger.info("ONVIF backchannel requested. Dialing...")
-                        await self.bs_ctrl.dial(self.config.sip.remote_uri)
-                        logger.info("Dialing done...")
-
-        asyncio.run_coroutine_threadsafe(dial(), self.aioloop)
-
+        self.spawn(self.answer_or_dial())
 
         if "stream=2" in uri.abspath:
-            logger.debug("TODO: add muting")
+            # Muting is applied to the backchannel by audio_control, see /api/audio
+            microphone = self.audio_control.channels[MICROPHONE]
+            logger.debug(
+                f"Backchannel {'muted' if microphone.mute else 'unmuted'}, volume {microphone.volume:g}"
+            )
 
     def client_describe_request(self, client, context: GstRtspServer.RTSPContext):
         logger.debug(
@@ -179,6 +453,8 @@ class Sip2RtspApp:
             logger.debug(
                 "DESCRIBE request header: Require: {value}".format(value=value)
             )
+            if self.config.sip.early_dial and ONVIF_BACKCHANNEL_REQUIRE in value:
+                self.spawn(self.early_dial(client))
 
     def client_teardown_request(self, client, context: GstRtspServer.RTSPContext):
         logger.debug(
@@ -188,13 +464,20 @@ class Sip2RtspApp:
         )
         uri: GstRtsp.RTSPUrl = context.uri
         if "stream=2" in uri.abspath:
-                async def hangup():
-                    logger.info("ONVIF backchannel TEARDOWN request. Hanging up...")
-                    await self.bs_ctrl.hangup()
-                    logger.info("Hanging up done...")
-                    self.pendingIncomingCall = False
+            self.spawn(self.backchannel_teardown(client))
 
-                asyncio.run_coroutine_threadsafe(hangup(), self.aioloop)
+    async def backchannel_teardown(self, client):
+        self.backchannel_clients.discard(client)
+        if self.backchannel_clients:
+            logger.info(
+                "ONVIF backchannel TEARDOWN request, the call is in use by another client"
+            )
+            return
+        await self.hangup_active("ONVIF backchannel TEARDOWN request")
+
+    def release_backchannel(self, client):
+        """Forget the backchannel of a client whose connection closed"""
+        self.aioloop.call_soon_threadsafe(self.backchannel_clients.discard, client)
 
     def client_closed(self, client):
         logger.debug(
@@ -206,20 +489,9 @@ class Sip2RtspApp:
         async def hangup():
             logger.info("RTSP client connection connection was closed.")
             # Try to hang up any active calls gracefully
-            callstat = await self.bs_ctrl.callstat()
-            if callstat:
-                if "(no active calls)" not in callstat:
-                    logger.info(f"client_closed: Hanging up...")
-                    await self.bs_ctrl.hangup()
-                    logger.info(f"client_closed: Hanging up done...")
-            else:
-                # If callstat() fails, we assume there is an active call
-                # This might fail too...
-                await self.bs_ctrl.hangup()
-
-            self.pendingIncomingCall = False
+            await self.hangup_active("client_closed")
 
-        asyncio.run_coroutine_threadsafe(hangup(), self.aioloop)
+        self.spawn(hangup())
 
     # def client_send_message(self, client, _whatsthis, message):
     #     logger.debug(
@@ -239,5 +511,6 @@ class Sip2RtspApp:
         client.connect("setup-request", self.client_setup_request)
         client.connect("describe-request", self.client_describe_request)
         client.connect("teardown-request", self.client_teardown_request)
+        client.connect("closed", self.release_backchannel)
         # client.connect("closed", self.client_closed)
         # client.connect("send_message", self.client_send_message)
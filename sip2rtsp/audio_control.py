@@ -0,0 +1,133 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Audio heard by the RTSP clients (from baresip's speaker)
+SPEAKER = "speaker"
+# Audio heard at the doorbell (the ONVIF backchannel to baresip's microphone)
+MICROPHONE = "microphone"
+DIRECTIONS = (SPEAKER, MICROPHONE)
+# Upper bound of the volume element
+MAX_VOLUME = 10.0
+
+
+def valve_name(direction):
+    return f"{direction}_valve"
+
+
+def volume_name(direction):
+    return f"{direction}_volume"
+
+
+def control_elements(direction):
+    """Launch string fragment of the named elements controlled by AudioControl"""
+    return (
+        f"valve name={valve_name(direction)} drop-mode=transform-to-gap "
+        f"! volume name={volume_name(direction)}"
+    )
+
+
+class AudioChannel:
+    def __init__(self, mute=False, volume=1.0):
+        self.mute = mute
+        self.volume = volume
+
+    def get_stats(self):
+        return {"mute": self.mute, "volume": self.volume}
+
+
+class AudioControl:
+    """Runtime mute and volume of the speaker and microphone audio.
+
+    Pipelines carry a valve and a volume element per direction, named by
+    valve_name() and volume_name(). Changes are applied to the elements of
+    every running pipeline by setting their properties, so they take effect
+    with the next buffer, without renegotiation or a pipeline restart. A
+    muted valve turns the audio into gap events, so downstream elements keep
+    running. New medias start with the current state.
+    """
+
+    def __init__(self, push_to_talk=False):
+        # Push-to-talk: the microphone is muted until someone talks
+        self.channels = {
+            SPEAKER: AudioChannel(),
+            MICROPHONE: AudioChannel(mute=push_to_talk),
+        }
+        # Changed from the RTSP media signals, iterated by set()
+        self.lock = threading.Lock()
+        self.pipelines = set()
+        self.changes = 0
+
+    def attach(self, factory):
+        factory.connect("media-configure", self._media_configure)
+
+    def _media_configure(self, _factory, media):
+        element = media.get_element()
+        self.add_pipeline(element)
+        media.connect("unprepared", lambda _media: self.remove_pipeline(element))
+
+    def add_pipeline(self, element):
+        with self.lock:
+            self.pipelines.add(element)
+        for direction in DIRECTIONS:
+            self._apply(element, direction)
+
+    def remove_pipeline(self, element):
+        with self.lock:
+            self.pipelines.discard(element)
+
+    def validate(self, direction, mute=None, volume=None):
+        """Raise ValueError unless set() accepts these arguments"""
+        if direction not in self.channels:
+            raise ValueError(f"Unknown audio direction {direction}")
+        if mute is not None and not isinstance(mute, bool):
+            raise ValueError(f"Mute must be true or false, not {mute!r}")
+        if volume is not None:
+            if isinstance(volume, bool) or not isinstance(volume, (int, float)):
+                raise ValueError(f"Volume must be a number, not {volume!r}")
+            if not 0 <= volume <= MAX_VOLUME:
+                raise ValueError(f"Volume must be between 0 and {MAX_VOLUME}")
+
+    def set(self, direction, mute=None, volume=None):
+        self.validate(direction, mute, volume)
+
+        channel = self.channels[direction]
+        if mute is not None:
+            channel.mute = mute
+        if volume is not None:
+            channel.volume = float(volume)
+        self.changes += 1
+        with self.lock:
+            pipelines = list(self.pipelines)
+        for element in pipelines:
+            self._apply(element, direction)
+        logger.info(
+            f"{direction}: {'muted' if channel.mute else 'unmuted'}, volume {channel.volume:g}"
+        )
+
+    def _apply(self, element, direction):
+        channel = self.channels[direction]
+        valve = element.get_by_name(valve_name(direction))
+        if valve is not None:
+            valve.set_property("drop", channel.mute)
+        volume = element.get_by_name(volume_name(direction))
+        if volume is not None:
+            volume.set_property("volume", channel.volume)
+
+    def get_output_level(self):
+        """Microphone level as ONVIF audio output level, 0-100"""
+        channel = self.channels[MICROPHONE]
+        return 0 if channel.mute else round(min(channel.volume, 1.0) * 100)
+
+    def set_output_level(self, level):
+        """Set the microphone from an ONVIF audio output level, 0 mutes"""
+        level = max(0, min(100, int(level)))
+        self.set(MICROPHONE, mute=level == 0, volume=level / 100 if level else None)
+
+    def get_stats(self):
+        stats = {d: c.get_stats() for d, c in self.channels.items()}
+        with self.lock:
+            stats["pipelines"] = len(self.pipelines)
+        stats["changes"] = self.changes
+        return stats
@@ -1,12 +1,41 @@
 import logging
 import asyncio
 import json
-import uuid
+import itertools
+import random
 import pynetstring
 
+from sip2rtsp.const import (
+    BARESIP_CTRL_MAX_PENDING_REQUESTS,
+    BARESIP_CTRL_RECONNECT_MIN_DELAY,
+    BARESIP_CTRL_RECONNECT_MAX_DELAY,
+)
+from sip2rtsp.events import EventBus
+from sip2rtsp.metrics import LatencyHistogram
+from sip2rtsp.netstring import NetstringDecoder, NetstringError
+
 logger = logging.getLogger(__name__)
 
 
+class BaresipCommandError(Exception):
+    """Baresip answered a command with ok=false"""
+
+
+class CommandStats:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.timeouts = 0
+        self.errors = 0
+        self.cancelled = 0
+
+    def snapshot(self):
+        snapshot = self.latency.snapshot()
+        snapshot.update(
+            timeouts=self.timeouts, errors=self.errors, cancelled=self.cancelled
+        )
+        return snapshot
+
+
 class BaresipProtocol(asyncio.Protocol):
     def __init__(self, baresip_control):
         self.baresip_control = baresip_control
@@ -24,105 +53,189 @@ class BaresipProtocol(asyncio.Protocol):
 
 
 class BaresipControl:
-    def __init__(self, host, port, timeout=5):
+    def __init__(
+        self,
+        host,
+        port,
+        timeout=5,
+        reconnect_min_delay=BARESIP_CTRL_RECONNECT_MIN_DELAY,
+        reconnect_max_delay=BARESIP_CTRL_RECONNECT_MAX_DELAY,
+        max_pending=BARESIP_CTRL_MAX_PENDING_REQUESTS,
+    ):
         self.host = host
         self.port = port
         self.timeout = timeout
+        self.reconnect_min_delay = reconnect_min_delay
+        self.reconnect_max_delay = reconnect_max_delay
         self.transport = None
         self.pending_requests = {}
-        self.callback = None
+        self.request_slots = asyncio.Semaphore(max_pending)
+        self.tokens = itertools.count()
+        self.command_stats = {}
+        self.events = EventBus()
+        self.reconnect_callback = None
+        self.decoder = NetstringDecoder()
+        self.connected = asyncio.Event()
+        self.disconnected = None
+        self.connection_task = None
 
     async def start(self):
-        self.transport, _ = await asyncio.get_running_loop().create_connection(
-            lambda: BaresipProtocol(self), self.host, self.port
+        """Start the connection supervisor and wait for the first connection"""
+        self.connection_task = asyncio.get_running_loop().create_task(
+            self._maintain_connection()
         )
+        await self.connected.wait()
 
     def stop(self):
-        self.transport.close()
+        if self.connection_task:
+            self.connection_task.cancel()
+            self.connection_task = None
+        if self.transport:
+            self.transport.close()
+        self.events.close()
 
     def set_callback(self, callback):
-        """Set the callback function to be called when an event is signalled"""
-        self.callback = callback
+        """Subscribe the callback function to all events, see self.events for more control"""
+        return self.events.subscribe(callback)
 
-    async def callstat(self):
-        """Get current call details"""
-        token = str(uuid.uuid4())
-        command = {"command": "callstat", "params": "", "token": token}
-        future = asyncio.Future()
-        self.pending_requests[token] = future
-        self._send_command(command)
+    def set_reconnect_callback(self, callback):
+        """Set the callback function to be called with the listcalls output after a reconnect"""
+        self.reconnect_callback = callback
+
+    def is_connected(self):
+        return self.connected.is_set()
+
+    async def wait_ready(self, timeout=None):
+        """Wait until the control connection is up, raise ConnectionError on timeout"""
+        if self.connected.is_set():
+            return
         try:
-            result = await asyncio.wait_for(future, timeout=self.timeout)
+            await asyncio.wait_for(self.connected.wait(), timeout=timeout)
         except asyncio.TimeoutError:
-            result = None
-        except Exception as e:
-            logger.warn(f"Error while getting call statistics: {e}")
-            result = None
-        return result
+            raise ConnectionError(
+                f"Baresip control connection to {self.host}:{self.port} is not available"
+            ) from None
+
+    def _reconnect_delay(self, attempt):
+        """Exponential backoff with jitter, so restarts do not synchronize"""
+        delay = min(
+            self.reconnect_max_delay, self.reconnect_min_delay * (2 ** attempt)
+        )
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _maintain_connection(self):
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        reconnecting = False
+        while True:
+            try:
+                self.transport, _ = await loop.create_connection(
+                    lambda: BaresipProtocol(self), self.host, self.port
+                )
+            except OSError as e:
+                delay = self._reconnect_delay(attempt)
+                attempt += 1
+                logger.warning(
+                    f"Connecting to Baresip at {self.host}:{self.port} failed ({e}). "
+                    f"Retrying in {delay:.2f}s..."
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            attempt = 0
+            self.decoder.reset()
+            self.disconnected = loop.create_future()
+            self.connected.set()
+            if reconnecting:
+                loop.create_task(self._reconcile())
+            reconnecting = True
+
+            await self.disconnected
+
+    async def _reconcile(self):
+        """Resynchronize call state that may have changed while disconnected"""
+        calls = await self.listcalls()
+        logger.info(f"Reconnected to Baresip, active calls: {calls}")
+        if calls is not None and self.reconnect_callback:
+            self.reconnect_callback(calls)
+
+    async def command(self, name, params=None, timeout=None, on_sent=None):
+        """Send a command and wait for its response.
+
+        Any number of commands may be outstanding on the connection at once,
+        responses are matched by token. on_sent is called once the command
+        has been written to the socket. Raises asyncio.TimeoutError,
+        ConnectionError or BaresipCommandError on failure.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        token = str(next(self.tokens))
+        command = {"command": name, "token": token}
+        if params is not None:
+            command["params"] = params
+
+        stats = self.command_stats.get(name)
+        if stats is None:
+            stats = self.command_stats[name] = CommandStats()
 
-    async def listcalls(self):
-        """List active calls"""
-        token = str(uuid.uuid4())
-        command = {"command": "listcalls", "params": "", "token": token}
-        future = asyncio.Future()
-        self.pending_requests[token] = future
-        self._send_command(command)
         try:
-            result = await asyncio.wait_for(future, timeout=self.timeout)
+            async with asyncio.timeout_at(deadline), self.request_slots:
+                await self.connected.wait()
+                future = loop.create_future()
+                self.pending_requests[token] = future
+                self._send_command(command)
+                if on_sent:
+                    on_sent()
+                start = loop.time()
+                result = await future
         except asyncio.TimeoutError:
-            result = None
-        except Exception as e:
-            logger.warn(f"Error while listing calls: {e}")
-            result = None
+            stats.timeouts += 1
+            raise
+        except asyncio.CancelledError:
+            stats.cancelled += 1
+            raise
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            self.pending_requests.pop(token, None)
+
+        stats.latency.record(loop.time() - start)
         return result
 
-    async def dial(self, sip_address):
-        """Initiate a call to the specified SIP address"""
-        token = str(uuid.uuid4())
-        command = {"command": "dial", "params": sip_address, "token": token}
-        future = asyncio.Future()
-        self.pending_requests[token] = future
-        self._send_command(command)
+    async def _command_or_none(self, name, params, action, on_sent=None):
         try:
-            result = await asyncio.wait_for(future, timeout=self.timeout)
+            return await self.command(name, params, on_sent=on_sent)
         except asyncio.TimeoutError:
-            result = None
+            logger.warning(f"Timeout while {action}")
         except Exception as e:
-            logger.warn(f"Error while dialing: {e}")
-            result = None
-        return result
+            logger.warning(f"Error while {action}: {e}")
+        return None
+
+    def get_command_stats(self):
+        """Return counters and latency percentiles (in seconds) per command name"""
+        return {name: stats.snapshot() for name, stats in self.command_stats.items()}
+
+    async def callstat(self):
+        """Get current call details"""
+        return await self._command_or_none("callstat", "", "getting call statistics")
+
+    async def listcalls(self):
+        """List active calls"""
+        return await self._command_or_none("listcalls", "", "listing calls")
+
+    async def dial(self, sip_address, on_sent=None):
+        """Initiate a call to the specified SIP address"""
+        return await self._command_or_none("dial", sip_address, "dialing", on_sent)
 
     async def hangup(self):
         """Hang up the current call"""
-        token = str(uuid.uuid4())
-        command = {"command": "hangup", "token": token}
-        future = asyncio.Future()
-        self.pending_requests[token] = future
-        self._send_command(command)
-        try:
-            result = await asyncio.wait_for(future, timeout=self.timeout)
-        except asyncio.TimeoutError:
-            result = None
-        except Exception as e:
-            logger.warn(f"Error while hanging up call: {e}")
-            result = None
-        return result
+        return await self._command_or_none("hangup", None, "hanging up call")
 
     async def accept(self):
         """Accept the incoming call"""
-        token = str(uuid.uuid4())
-        command = {"command": "accept", "token": token}
-        future = asyncio.Future()
-        self.pending_requests[token] = future
-        self._send_command(command)
-        try:
-            result = await asyncio.wait_for(future, timeout=self.timeout)
-        except asyncio.TimeoutError:
-            result = None
-        except Exception as e:
-            logger.warn(f"Error while accepting call: {e}")
-            result = None
-        return result
+        return await self._command_or_none("accept", None, "accepting call")
 
     def _send_command(self, command):
         """Send a command to the Baresip instance"""
@@ -135,21 +248,39 @@ class BaresipControl:
         if "response" in data:
             token = data["token"]
             future = self.pending_requests.pop(token, None)
-            if future:
+            if future and not future.done():
                 if data["ok"]:
                     future.set_result(data["data"])
                 else:
-                    future.set_exception(Exception(data["data"]))
+                    future.set_exception(BaresipCommandError(data["data"]))
         elif "event" in data:
-            if self.callback:
-                del data["event"]
-                self.callback(data)
+            del data["event"]
+            self.events.publish(data)
 
     def handle_data(self, data):
-        s = pynetstring.decode(data.decode())
-        for se in s:
-            response = json.loads(se)
-            self._receive(response)
+        try:
+            messages = self.decoder.feed(data)
+        except NetstringError as e:
+            # The stream is out of sync, nothing buffered can be trusted
+            logger.error(f"Invalid data from Baresip control connection: {e}")
+            self.decoder.reset()
+            return
+        for message in messages:
+            self._receive(message)
 
     def handle_connection_lost(self, exc):
-        pass
+        self.transport = None
+        self.connected.clear()
+        self.decoder.reset()
+
+        # Nobody is going to answer these anymore, so fail them right away
+        pending_requests = self.pending_requests
+        self.pending_requests = {}
+        for future in pending_requests.values():
+            if not future.done():
+                future.set_exception(
+                    ConnectionError("Baresip control connection lost")
+                )
+
+        if self.disconnected and not self.disconnected.done():
+            self.disconnected.set_result(exc)
@@ -0,0 +1,51 @@
+"""Run Sip2RtspApp for benchmarks, against a fake baresip and without devices"""
+import asyncio
+
+from sip2rtsp.gi import GLib
+from sip2rtsp.app import Sip2RtspApp
+from sip2rtsp.config import ConnectionsConfig
+from sip2rtsp.benchmarks.fake_baresip import FakeBaresip
+from sip2rtsp.benchmarks.shared_media import TEST_BACKCHANNEL_LAUNCH_STRING
+
+MOUNT_POINT = "/bench"
+
+
+class AppHarness:
+    """Sip2RtspApp serving rtsp_server options on 127.0.0.1:port/bench.
+
+    Must run on an event loop dispatching the default GLib main context, see
+    glib_loop.run().
+    """
+
+    def __init__(self, port, **rtsp_server):
+        self.port = port
+        self.rtsp_server = dict(
+            backchannel_launch_string=TEST_BACKCHANNEL_LAUNCH_STRING,
+            port=port,
+            mount_point=MOUNT_POINT,
+            **rtsp_server,
+        )
+        self.url = f"rtsp://127.0.0.1:{port}{MOUNT_POINT}"
+        self.fake = None
+        self.app = None
+
+    async def create(self):
+        """Create the app, so handlers can be attached before it starts"""
+        aioloop = asyncio.get_running_loop()
+        self.fake = await FakeBaresip().start()
+        config = ConnectionsConfig.parse_obj(
+            {
+                "rtsp_server": self.rtsp_server,
+                "sip": {"ctrl_host": "127.0.0.1", "ctrl_port": self.fake.port},
+            }
+        )
+        self.app = Sip2RtspApp(aioloop, GLib.MainContext.default(), config, {})
+        return self.app
+
+    async def start(self):
+        await self.app.start()
+
+    async def stop(self):
+        await self.app.stop()
+        self.app.bs_ctrl.stop()
+        await self.fake.stop()
@@ -0,0 +1,131 @@
+"""Loopback latency of the audio bridge between GStreamer and baresip.
+
+Plays clicks into one end of the bridge and times their arrival at the
+other end, the way audio travels from baresip's speaker to the RTSP audio
+stream. Compared are the PulseAudio path (null sink, its monitor remapped
+to a source) and JACK shared memory ports, both at 8 kHz mono with 10 ms
+buffers. The resolution is one buffer. PulseAudio and a JACK server (see
+sip2rtsp.jack.start_jackd) must be running.
+
+    python3 -m sip2rtsp.benchmarks.audio_bridge [--clicks 50]
+"""
+import argparse
+import array
+import asyncio
+import threading
+import time
+
+from sip2rtsp.gi import Gst
+from sip2rtsp.metrics import LatencyHistogram
+from sip2rtsp.pactl import create_pa_devices
+
+RATE = 8000
+BUFFER_SAMPLES = 80
+BUFFER_TIME = BUFFER_SAMPLES / RATE
+CLICK_LEVEL = 16000
+THRESHOLD = CLICK_LEVEL // 2
+CAPS = f"audio/x-raw,format=S16LE,channels=1,rate={RATE},layout=interleaved"
+PA_SINK = "BenchBridgeSpeaker"
+
+PATHS = {
+    "pulse": (
+        f'pulsesink device="{PA_SINK}" buffer-time=20000 latency-time=10000',
+        f'pulsesrc device="{PA_SINK}Input" buffer-time=20000 latency-time=10000',
+    ),
+    "jack": (
+        'jackaudiosink client-name=bench-out connect=auto port-pattern="bench-in:.*" '
+        "buffer-time=20000 latency-time=10000",
+        "jackaudiosrc client-name=bench-in connect=none buffer-time=20000 latency-time=10000",
+    ),
+}
+
+
+def measure(path, clicks, interval):
+    sink, source = PATHS[path]
+    latency = LatencyHistogram()
+    sent = []
+    lock = threading.Lock()
+
+    # Receiver first, so the JACK sender finds its ports
+    receiver = Gst.parse_launch(
+        f"{source} ! audioconvert ! audioresample ! {CAPS} "
+        "! appsink name=sink sync=false emit-signals=true"
+    )
+
+    def new_sample(appsink):
+        sample = appsink.emit("pull-sample")
+        received_at = time.perf_counter()
+        buffer = sample.get_buffer()
+        ok, info = buffer.map(Gst.MapFlags.READ)
+        if not ok:
+            return Gst.FlowReturn.OK
+        try:
+            samples = array.array("h", bytes(info.data))
+        finally:
+            buffer.unmap(info)
+        if max(samples, default=0) > THRESHOLD:
+            with lock:
+                if sent:
+                    latency.record(received_at - sent.pop(0))
+        return Gst.FlowReturn.OK
+
+    receiver.get_by_name("sink").connect("new-sample", new_sample)
+    receiver.set_state(Gst.State.PLAYING)
+    receiver.get_state(5 * Gst.SECOND)
+
+    # block=true paces the pushes at the rate the sink consumes them
+    sender = Gst.parse_launch(
+        f"appsrc name=src is-live=true format=time do-timestamp=true block=true "
+        f"max-bytes={2 * BUFFER_SAMPLES * 2} caps={CAPS} ! {sink}"
+    )
+    src = sender.get_by_name("src")
+    sender.set_state(Gst.State.PLAYING)
+
+    silence = Gst.Buffer.new_wrapped(bytes(2 * BUFFER_SAMPLES))
+    click = Gst.Buffer.new_wrapped(array.array("h", [CLICK_LEVEL] * BUFFER_SAMPLES).tobytes())
+    period = max(1, round(interval / BUFFER_TIME))
+    # Let both ends settle before the first click
+    for _ in range(round(0.5 / BUFFER_TIME)):
+        src.emit("push-buffer", silence.copy())
+    for n in range(clicks * period):
+        if n % period == 0:
+            with lock:
+                sent.append(time.perf_counter())
+            src.emit("push-buffer", click.copy())
+        else:
+            src.emit("push-buffer", silence.copy())
+    time.sleep(0.5)
+
+    sender.set_state(Gst.State.NULL)
+    receiver.set_state(Gst.State.NULL)
+    return latency.snapshot(), len(sent)
+
+
+def ms(seconds):
+    return seconds * 1e3 if seconds is not None else float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clicks", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=0.25, help="seconds between clicks")
+    parser.add_argument("--paths", nargs="+", default=list(PATHS), choices=list(PATHS))
+    args = parser.parse_args()
+
+    if "pulse" in args.paths:
+        asyncio.run(
+            create_pa_devices(asyncio.Semaphore(4), sink=PA_SINK, src="BenchBridgeMicrophone")
+        )
+
+    print(f"{'path':<8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'lost':>6}")
+    for path in args.paths:
+        stats, lost = measure(path, args.clicks, args.interval)
+        p = {k: ms(v) for k, v in stats["percentiles"].items()}
+        print(
+            f"{path:<8} {p['p50']:>8.1f} {p['p90']:>8.1f} {p['p99']:>8.1f} "
+            f"{ms(stats['max']):>8.1f} {lost:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
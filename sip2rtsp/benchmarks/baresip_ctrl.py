@@ -0,0 +1,134 @@
+"""Protocol-layer benchmark for BaresipControl against the fake baresip.
+
+Measures command round-trip latency (sequential and pipelined) and
+event-to-callback latency for several fault injection scenarios. With
+dropped connections, the reconnects, the commands failed by them and
+whether the call state rebuilt from listcalls still clears on hangup are
+reported as well.
+
+    python3 -m sip2rtsp.benchmarks.baresip_ctrl [--commands N] [--events N]
+"""
+import argparse
+import asyncio
+import time
+
+from sip2rtsp.baresip_ctrl import BaresipControl
+from sip2rtsp.benchmarks.fake_baresip import FakeBaresip
+from sip2rtsp.calls import CallTracker
+from sip2rtsp.const import EVENT_TYPE
+from sip2rtsp.events import OverflowPolicy
+from sip2rtsp.metrics import LatencyHistogram
+
+SCENARIOS = {
+    "clean": {},
+    "latency-1ms": {"latency": 0.001},
+    "split-7B": {"split": 7},
+    # Odd, so the connection is not dropped right before the event flood
+    "drop-333": {"drop_after": 333},
+}
+CALL_EVENTS = [
+    EVENT_TYPE.CALL_INCOMING,
+    EVENT_TYPE.CALL_RINGING,
+    EVENT_TYPE.CALL_ESTABLISHED,
+    EVENT_TYPE.CALL_CLOSED,
+]
+
+
+def format_ms(snapshot):
+    p = snapshot["percentiles"]
+    return "  ".join(
+        f"{name}={value * 1000:7.3f}ms" for name, value in p.items() if value is not None
+    )
+
+
+async def run_scenario(name, options, commands, events, concurrency):
+    fake = await FakeBaresip(**options).start()
+    ctrl = BaresipControl("127.0.0.1", fake.port, timeout=5, max_pending=concurrency)
+    await ctrl.start()
+
+    # An established call, rebuilt from listcalls after every reconnect
+    calls = CallTracker()
+    ctrl.events.subscribe(calls.handle_event, types=CALL_EVENTS, name="calls")
+    reconnects = 0
+
+    def on_reconnect(listcalls):
+        nonlocal reconnects
+        reconnects += 1
+        calls.reconcile(listcalls)
+
+    ctrl.set_reconnect_callback(on_reconnect)
+    fake.ring()
+    await calls.wait_for(lambda: calls.incoming, timeout=5)
+    await ctrl.accept()
+
+    failed = 0
+    for _ in range(commands):
+        if await ctrl.callstat() is None:
+            failed += 1
+    sequential = ctrl.get_command_stats()["callstat"]
+
+    ctrl.command_stats.clear()
+    start = time.perf_counter()
+    results = await asyncio.gather(*[ctrl.callstat() for _ in range(commands)])
+    failed += sum(1 for result in results if result is None)
+    pipelined_rate = commands / (time.perf_counter() - start)
+    pipelined = ctrl.get_command_stats()["callstat"]
+
+    event_latency = LatencyHistogram()
+    received = asyncio.Event()
+
+    def on_event(data):
+        event_latency.record(time.perf_counter() - data["sent_at"])
+        if event_latency.total >= events:
+            received.set()
+
+    # Count every event, the default CALL_RTCP coalescing would hide the tail
+    ctrl.events.subscribe(
+        on_event,
+        types=[EVENT_TYPE.CALL_RTCP],
+        maxsize=events,
+        type_policies={EVENT_TYPE.CALL_RTCP: OverflowPolicy.BUFFER},
+    )
+    await ctrl.wait_ready(timeout=5)
+    fake.flood(events)
+    try:
+        await asyncio.wait_for(received.wait(), timeout=30)
+    except asyncio.TimeoutError:
+        pass
+
+    print(f"== {name}")
+    print(f"  sequential callstat  {format_ms(sequential)}")
+    print(f"  pipelined callstat   {format_ms(pipelined)}  ({pipelined_rate:.0f} cmd/s)")
+    print(
+        f"  event to callback    {format_ms(event_latency.snapshot())}  "
+        f"({event_latency.total}/{events} events)"
+    )
+
+    await ctrl.wait_ready(timeout=5)
+    await ctrl.hangup()
+    idle = await calls.idle(timeout=5)
+    print(
+        f"  reconnects           {reconnects}  ({failed} commands failed, "
+        f"call {'cleared' if idle else 'NOT cleared'} on hangup)"
+    )
+
+    ctrl.stop()
+    await fake.stop()
+
+
+async def run(args):
+    for name, options in SCENARIOS.items():
+        await run_scenario(name, options, args.commands, args.events, args.concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--commands", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""Stand-in for baresip's ctrl_tcp module.
+
+Speaks the netstring/JSON protocol of ctrl_tcp, keeps a minimal call model
+and emits the matching CALL_* events, so BaresipControl and the app can be
+exercised without baresip and PulseAudio. Faults can be injected: response
+latency, frames split into small TCP writes, dropped connections and event
+floods.
+
+    python3 -m sip2rtsp.benchmarks.fake_baresip --port 4444 --latency 0.01
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import time
+
+import pynetstring
+
+from sip2rtsp.const import EVENT_TYPE
+from sip2rtsp.netstring import NetstringDecoder, NetstringError
+
+logger = logging.getLogger(__name__)
+
+ACCOUNT_AOR = "sip:user1@office"
+
+
+class FakeCall:
+    def __init__(self, call_id, peeruri, direction, state):
+        self.id = call_id
+        self.peeruri = peeruri
+        self.direction = direction
+        self.state = state
+
+
+class FakeBaresip:
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency=0.0,
+        split=None,
+        split_delay=0.0,
+        ringing_delay=0.0,
+        answer_delay=0.0,
+        drop_after=None,
+    ):
+        self.host = host
+        self.port = port
+        # Delay before each response is sent
+        self.latency = latency
+        # Write frames in chunks of at most this many bytes
+        self.split = split
+        self.split_delay = split_delay
+        # Delays of the CALL_RINGING/CALL_ESTABLISHED events after a dial
+        self.ringing_delay = ringing_delay
+        self.answer_delay = answer_delay
+        # Close the connection after this many commands
+        self.drop_after = drop_after
+
+        self.server = None
+        self.writers = set()
+        self.write_locks = {}
+        self.calls = {}
+        self.call_ids = itertools.count(1)
+        self.commands = 0
+        self.tasks = set()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"Fake baresip ctrl_tcp listening on {self.host}:{self.port}")
+        return self
+
+    async def stop(self):
+        self.drop()
+        for task in list(self.tasks):
+            task.cancel()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def drop(self):
+        """Close all client connections"""
+        for writer in list(self.writers):
+            writer.close()
+        self.writers.clear()
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _handle(self, reader, writer):
+        self.writers.add(writer)
+        decoder = NetstringDecoder()
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                for message in decoder.feed(data):
+                    self.commands += 1
+                    self._spawn(self._respond(writer, message))
+                    if self.drop_after and self.commands % self.drop_after == 0:
+                        logger.info(f"Dropping connection after {self.commands} commands")
+                        writer.close()
+                        return
+        except (ConnectionError, NetstringError) as e:
+            logger.info(f"Client connection failed: {e}")
+        except asyncio.CancelledError:
+            # The event loop is shutting down while the client is connected
+            pass
+        finally:
+            self.writers.discard(writer)
+            self.write_locks.pop(writer, None)
+
+    async def _respond(self, writer, message):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        ok, data = self._execute(message.get("command"), message.get("params"))
+        await self._write(
+            writer,
+            {"response": True, "ok": ok, "data": data, "token": message.get("token")},
+        )
+
+    async def _write(self, writer, message):
+        frame = pynetstring.encode(json.dumps(message).encode())
+        if writer.is_closing():
+            return
+        if not self.split:
+            writer.write(frame)
+            return
+        # Chunks of different frames must not interleave
+        lock = self.write_locks.setdefault(writer, asyncio.Lock())
+        async with lock:
+            for offset in range(0, len(frame), self.split):
+                writer.write(frame[offset : offset + self.split])
+                await writer.drain()
+                if self.split_delay:
+                    await asyncio.sleep(self.split_delay)
+
+    def _execute(self, command, params):
+        if command == "callstat":
+            if not self.calls:
+                return True, "\n(no active calls)\n"
+            call = next(iter(self.calls.values()))
+            return True, f"\n{call.state} {call.peeruri}\n"
+        if command == "listcalls":
+            lines = [f"\n--- List of active calls ({len(self.calls)}): ---"]
+            for line, call in enumerate(self.calls.values(), start=1):
+                # As printed by baresip 3.x
+                lines.append(
+                    f"  [line {line}, id {call.id}]  0:00:00  {call.state:<11}  {call.peeruri}"
+                )
+            return True, "\n".join(lines) + "\n"
+        if command == "dial":
+            call = FakeCall(f"{next(self.call_ids):016x}", params, "outgoing", "OUTGOING")
+            self.calls[call.id] = call
+            self._spawn(self._progress_outgoing(call))
+            return True, ""
+        if command == "accept":
+            call = next(
+                (c for c in self.calls.values() if c.state == "INCOMING"), None
+            )
+            if call is None:
+                return False, "no pending call"
+            self._set_state(call, "ESTABLISHED", EVENT_TYPE.CALL_ESTABLISHED)
+            return True, ""
+        if command == "hangup":
+            for call in list(self.calls.values()):
+                self._close(call)
+            return True, ""
+        return False, f"unknown command {command}"
+
+    async def _progress_outgoing(self, call):
+        await asyncio.sleep(self.ringing_delay)
+        if call.id in self.calls:
+            self._set_state(call, "RINGING", EVENT_TYPE.CALL_RINGING)
+        await asyncio.sleep(self.answer_delay)
+        if call.id in self.calls:
+            self._set_state(call, "ESTABLISHED", EVENT_TYPE.CALL_ESTABLISHED)
+
+    def _set_state(self, call, state, event_type):
+        call.state = state
+        self.emit(event_type, call)
+
+    def _close(self, call):
+        self.calls.pop(call.id, None)
+        self.emit(EVENT_TYPE.CALL_CLOSED, call, "Connection reset by user")
+
+    def ring(self, peeruri="sip:11@10.10.10.80"):
+        """Simulate an incoming call"""
+        call = FakeCall(f"{next(self.call_ids):016x}", peeruri, "incoming", "INCOMING")
+        self.calls[call.id] = call
+        self.emit(EVENT_TYPE.CALL_INCOMING, call)
+        return call
+
+    def emit(self, event_type, call, param="", **extra):
+        """Send an event to all clients, stamped with its send time (perf_counter)"""
+        event = {
+            "event": True,
+            "type": event_type.value,
+            "class": "call",
+            "accountaor": ACCOUNT_AOR,
+            "direction": call.direction,
+            "peeruri": call.peeruri,
+            "id": call.id,
+            "param": param,
+            "sent_at": time.perf_counter(),
+        }
+        event.update(extra)
+        for writer in list(self.writers):
+            self._spawn(self._write(writer, event))
+
+    def flood(self, count, call=None):
+        """Send count CALL_RTCP events back to back"""
+        call = call or FakeCall("flood", "sip:11@10.10.10.80", "outgoing", "ESTABLISHED")
+        for i in range(count):
+            self.emit(
+                EVENT_TYPE.CALL_RTCP,
+                call,
+                "audio",
+                rtcp_stats={
+                    "tx": {"sent": i * 50, "lost": 0, "jit": 1500},
+                    "rx": {"sent": i * 50, "lost": 0, "jit": 2500},
+                    "rtt": 12000,
+                },
+            )
+
+
+async def serve(args):
+    fake = FakeBaresip(
+        args.host,
+        args.port,
+        latency=args.latency,
+        split=args.split,
+        ringing_delay=args.ringing_delay,
+        answer_delay=args.answer_delay,
+        drop_after=args.drop_after,
+    )
+    await fake.start()
+    while True:
+        await asyncio.sleep(args.ring_interval or 3600)
+        if args.ring_interval:
+            fake.ring()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4444)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--split", type=int, default=None)
+    parser.add_argument("--ringing-delay", type=float, default=0.5)
+    parser.add_argument("--answer-delay", type=float, default=2.0)
+    parser.add_argument("--drop-after", type=int, default=None)
+    parser.add_argument("--ring-interval", type=float, default=None, help="simulate an incoming call every N seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Time from RTSP connect to the first decoded video frame, cold vs warm source.
+
+Serves a test pattern with a long GOP through the ONVIF media factory in
+three modes: per-client media, a warm shared source without GOP cache
+(forced keyframe only), and a warm shared source replaying its GOP cache.
+A client connects repeatedly and the time until its decoder outputs the
+first frame is reported.
+
+    python3 -m sip2rtsp.benchmarks.first_frame [--runs 10] [--gop 70]
+"""
+import argparse
+import statistics
+import threading
+import time
+
+from sip2rtsp.gi import GLib, Gst, GstRtspServer
+from sip2rtsp.config import RtspServerConfig
+from sip2rtsp.media import create_media_factory
+from sip2rtsp.benchmarks.shared_media import TEST_BACKCHANNEL_LAUNCH_STRING
+
+MODES = {
+    "per-client": dict(shared_source=False),
+    "warm, keyframe only": dict(warm=True, gop_cache_size=0),
+    "warm, GOP cache": dict(warm=True, gop_cache_size=4096),
+}
+
+
+def test_launch_string(gop):
+    return (
+        "videotestsrc is-live=true pattern=ball ! video/x-raw,width=1280,height=720,framerate=15/1 "
+        f"! x264enc speed-preset=superfast tune=zerolatency bitrate=2000 key-int-max={gop} "
+        "! rtph264pay config-interval=1 name=pay0 pt=96"
+    )
+
+
+def first_frame(url, timeout):
+    """Seconds until the first decoded frame of url, None on timeout"""
+    pipeline = Gst.parse_launch(
+        f"rtspsrc location={url} latency=0 ! decodebin ! fakesink name=sink signal-handoffs=true sync=false"
+    )
+    decoded = threading.Event()
+    pipeline.get_by_name("sink").connect("handoff", lambda *_: decoded.set())
+    start = time.monotonic()
+    pipeline.set_state(Gst.State.PLAYING)
+    ok = decoded.wait(timeout)
+    elapsed = time.monotonic() - start
+    pipeline.set_state(Gst.State.NULL)
+    return elapsed if ok else None
+
+
+def measure(mode, port, gop, runs, timeout):
+    config = RtspServerConfig(
+        launch_string=test_launch_string(gop),
+        backchannel_launch_string=TEST_BACKCHANNEL_LAUNCH_STRING,
+        port=port,
+        mount_point="/bench",
+        latency=0,
+        **MODES[mode],
+    )
+    server = GstRtspServer.RTSPOnvifServer.new()
+    factory, shared_source = create_media_factory(config)
+    server.get_mount_points().add_factory(config.mount_point, factory)
+    server.set_service(str(port))
+    loop = GLib.MainLoop()
+    source_id = server.attach(None)
+    thread = threading.Thread(target=loop.run, daemon=True)
+    thread.start()
+
+    url = f"rtsp://127.0.0.1:{port}{config.mount_point}"
+    results = []
+    for run in range(runs):
+        # Connect at different points of the GOP
+        time.sleep(0.5 + (run % 5) * gop / 15 / 5)
+        results.append(first_frame(url, timeout))
+
+    if shared_source:
+        shared_source.stop()
+    GLib.source_remove(source_id)
+    loop.quit()
+    thread.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--gop", type=int, default=70, help="key-int-max of the test encoder")
+    parser.add_argument("--port", type=int, default=18654)
+    parser.add_argument("--timeout", type=float, default=15)
+    args = parser.parse_args()
+
+    print(f"{'mode':<22} {'p50 ms':>8} {'max ms':>8} {'timeouts':>9}")
+    for mode in MODES:
+        results = measure(mode, args.port, args.gop, args.runs, args.timeout)
+        times = [r * 1000 for r in results if r is not None]
+        p50 = statistics.median(times) if times else float("nan")
+        worst = max(times) if times else float("nan")
+        print(f"{mode:<22} {p50:>8.0f} {worst:>8.0f} {results.count(None):>9}")
+        args.port += 1
+
+
+if __name__ == "__main__":
+    main()
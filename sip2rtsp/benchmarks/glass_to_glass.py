@@ -0,0 +1,309 @@
+"""Glass-to-glass video latency of Sip2RtspApp, per server/client configuration.
+
+Runs the app (with a fake baresip) serving frames from an appsrc. The
+monotonic clock time of each frame's push is drawn into the frame as a
+grid of black and white blocks. A local rtspsrc client decodes the stream
+and reads the time back from every frame, which gives the per-frame
+latency from the source, through encoding, the RTSP server, the network
+stack, the jitterbuffer and decoding, to the decoded frame. Every
+configuration (shared source or not, TCP or UDP, rtsp_server.latency,
+which is also the client jitterbuffer latency) runs in its own process.
+Needs no display or devices, so it can run on a headless CI machine.
+
+    python3 -m sip2rtsp.benchmarks.glass_to_glass [--latencies 0,50,200] [--duration 10] [--json]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import subprocess
+import sys
+import threading
+import time
+
+from sip2rtsp.gi import Gst, GstVideo
+from sip2rtsp.metrics import LatencyHistogram
+from sip2rtsp import glib_loop
+from sip2rtsp.benchmarks.app_harness import AppHarness
+
+WIDTH = 640
+HEIGHT = 360
+FPS = 30
+# The stamp: 64 bits (microseconds) as 16x16 blocks, 16 per row
+BLOCK = 16
+BITS = 64
+BLOCKS_PER_ROW = 16
+LUMA_BLACK = 16
+LUMA_WHITE = 235
+# Stamps decoding to a latency outside of this are corrupt
+MAX_LATENCY = 10
+PERCENTILES = (50, 95, 99)
+RESULT_PREFIX = "RESULT "
+
+STAMP_LAUNCH_STRING = (
+    f"appsrc name=stamp is-live=true do-timestamp=true format=time "
+    f"caps=video/x-raw,format=I420,width={WIDTH},height={HEIGHT},framerate={FPS}/1 "
+    "! queue ! x264enc speed-preset=ultrafast tune=zerolatency bitrate=2000 key-int-max=30 "
+    "! rtph264pay config-interval=1 name=pay0 pt=96"
+)
+
+
+def now_us():
+    # CLOCK_MONOTONIC, the same in every process of the machine
+    return time.monotonic_ns() // 1000
+
+
+def stamp_frame(template, value):
+    """I420 frame with value drawn into its luma plane"""
+    frame = bytearray(template)
+    white = bytes([LUMA_WHITE]) * BLOCK
+    for bit in range(BITS):
+        if value >> bit & 1:
+            x = (bit % BLOCKS_PER_ROW) * BLOCK
+            y = (bit // BLOCKS_PER_ROW) * BLOCK
+            for row in range(y, y + BLOCK):
+                frame[row * WIDTH + x : row * WIDTH + x + BLOCK] = white
+    return bytes(frame)
+
+
+def read_stamp(data, stride):
+    """Value drawn by stamp_frame, read at the block centers"""
+    value = 0
+    threshold = (LUMA_BLACK + LUMA_WHITE) // 2
+    for bit in range(BITS):
+        x = (bit % BLOCKS_PER_ROW) * BLOCK + BLOCK // 2
+        y = (bit // BLOCKS_PER_ROW) * BLOCK + BLOCK // 2
+        if data[y * stride + x] > threshold:
+            value |= 1 << bit
+    return value
+
+
+class StampSource:
+    """Feeds stamped frames at FPS to the appsrc of every running media"""
+
+    def __init__(self):
+        self.appsrcs = set()
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        luma = bytes([LUMA_BLACK]) * (WIDTH * HEIGHT)
+        chroma = bytes([128]) * (WIDTH * HEIGHT // 2)
+        self.template = luma + chroma
+
+    def attach(self, app):
+        for factory in app.factories.values():
+            factory.connect("media-configure", self._media_configure)
+        if app.shared_source:
+            self.add(app.shared_source.pipeline.get_by_name("stamp"))
+
+    def _media_configure(self, _factory, media):
+        appsrc = media.get_element().get_by_name("stamp")
+        if appsrc is not None:
+            self.add(appsrc)
+            media.connect("unprepared", lambda _media: self.remove(appsrc))
+
+    def add(self, appsrc):
+        with self.lock:
+            self.appsrcs.add(appsrc)
+
+    def remove(self, appsrc):
+        with self.lock:
+            self.appsrcs.discard(appsrc)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+
+    def _run(self):
+        deadline = time.monotonic()
+        while self.running:
+            deadline += 1 / FPS
+            with self.lock:
+                appsrcs = list(self.appsrcs)
+            for appsrc in appsrcs:
+                frame = stamp_frame(self.template, now_us())
+                # FLUSHING until the media is playing, that is fine
+                appsrc.emit("push-buffer", Gst.Buffer.new_wrapped(frame))
+            time.sleep(max(0.0, deadline - time.monotonic()))
+
+
+class Client:
+    """rtspsrc client reading the stamps of the decoded frames"""
+
+    def __init__(self, url, protocols, latency):
+        self.pipeline = Gst.parse_launch(
+            f"rtspsrc location={url} protocols={protocols} latency={latency} "
+            "! decodebin ! videoconvert ! video/x-raw,format=I420 "
+            "! appsink name=sink sync=false emit-signals=true max-buffers=2 drop=true"
+        )
+        self.pipeline.get_by_name("sink").connect("new-sample", self._new_sample)
+        self.latency = LatencyHistogram()
+        self.lock = threading.Lock()
+        self.started = None
+        self.first_frame = None
+        self.corrupt = 0
+
+    def start(self):
+        self.started = time.monotonic()
+        self.pipeline.set_state(Gst.State.PLAYING)
+
+    def stop(self):
+        self.pipeline.set_state(Gst.State.NULL)
+
+    def _new_sample(self, appsink):
+        sample = appsink.emit("pull-sample")
+        received = now_us()
+        if self.first_frame is None:
+            self.first_frame = time.monotonic() - self.started
+        info = GstVideo.VideoInfo.new_from_caps(sample.get_caps())
+        buffer = sample.get_buffer()
+        ok, mapinfo = buffer.map(Gst.MapFlags.READ)
+        if not ok:
+            return Gst.FlowReturn.OK
+        try:
+            stamp = read_stamp(mapinfo.data, info.stride[0])
+        finally:
+            buffer.unmap(mapinfo)
+        latency = (received - stamp) / 1e6
+        with self.lock:
+            if 0 <= latency < MAX_LATENCY:
+                self.latency.record(latency)
+            else:
+                self.corrupt += 1
+        return Gst.FlowReturn.OK
+
+    def reset(self):
+        with self.lock:
+            self.latency = LatencyHistogram()
+            self.corrupt = 0
+
+    def get_stats(self):
+        with self.lock:
+            stats = self.latency.snapshot(PERCENTILES)
+            stats["corrupt"] = self.corrupt
+        stats["first_frame"] = self.first_frame
+        return stats
+
+
+def configurations(args):
+    for shared, protocols, latency in itertools.product(
+        args.shared, args.transports, args.latencies
+    ):
+        yield {"shared": shared, "protocols": protocols, "latency": latency}
+
+
+def config_name(configuration):
+    return (
+        f"{'shared' if configuration['shared'] else 'per-client'}/"
+        f"{configuration['protocols']}/{configuration['latency']}ms"
+    )
+
+
+async def measure(configuration, port, warmup, duration):
+    harness = AppHarness(
+        port,
+        launch_string=STAMP_LAUNCH_STRING,
+        latency=configuration["latency"],
+        shared_source=configuration["shared"],
+    )
+    app = await harness.create()
+    source = StampSource()
+    source.attach(app)
+    source.start()
+    await harness.start()
+
+    client = Client(harness.url, configuration["protocols"], configuration["latency"])
+    client.start()
+    await asyncio.sleep(warmup)
+    client.reset()
+    await asyncio.sleep(duration)
+    stats = client.get_stats()
+
+    client.stop()
+    source.stop()
+    await harness.stop()
+    return stats
+
+
+def run_child(configuration, port, warmup, duration):
+    stats = glib_loop.run(measure(configuration, port, warmup, duration))
+    print(RESULT_PREFIX + json.dumps(dict(configuration, **stats)), flush=True)
+
+
+def ms(seconds):
+    return seconds * 1e3 if seconds is not None else float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latencies", default="0,50,200", help="rtsp_server.latency values in ms")
+    parser.add_argument("--transports", default="tcp,udp")
+    parser.add_argument("--shared", default="false,true", help="shared_source values")
+    parser.add_argument("--port", type=int, default=18754)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        logging.basicConfig(level=logging.WARNING)
+        run_child(json.loads(args.run), args.port, args.warmup, args.duration)
+        return
+
+    args.latencies = [int(v) for v in args.latencies.split(",")]
+    args.transports = args.transports.split(",")
+    args.shared = [v.strip().lower() == "true" for v in args.shared.split(",")]
+
+    results = []
+    if not args.json:
+        print(
+            f"{'configuration':<22} {'frames':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+            f"{'max ms':>8} {'first frame ms':>15}"
+        )
+    for configuration in configurations(args):
+        child = subprocess.run(
+            [
+                sys.executable, "-m", __spec__.name,
+                "--run", json.dumps(configuration),
+                "--port", str(args.port),
+                "--warmup", str(args.warmup),
+                "--duration", str(args.duration),
+            ],
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        args.port += 1
+        lines = [l for l in child.stdout.splitlines() if l.startswith(RESULT_PREFIX)]
+        if child.returncode or not lines:
+            result = dict(configuration, error=f"exit code {child.returncode}")
+        else:
+            result = json.loads(lines[-1][len(RESULT_PREFIX):])
+        results.append(result)
+
+        if args.json:
+            continue
+        if "error" in result:
+            print(f"{config_name(configuration):<22} failed: {result['error']}")
+            continue
+        p = result["percentiles"]
+        print(
+            f"{config_name(configuration):<22} {result['count']:>7} {ms(p['p50']):>8.1f} "
+            f"{ms(p['p95']):>8.1f} {ms(p['p99']):>8.1f} {ms(result['max']):>8.1f} "
+            f"{ms(result['first_frame']):>15.0f}"
+        )
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    sys.exit(1 if any("error" in r for r in results) else 0)
+
+
+if __name__ == "__main__":
+    main()
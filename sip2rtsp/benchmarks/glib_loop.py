@@ -0,0 +1,135 @@
+"""Latency from an RTSP request to the asyncio handler of the app running.
+
+A producer thread sends OPTIONS requests to a GstRtspServer over TCP, and
+the request signal of the RTSPClient, emitted on a client thread of the
+server, hands the work to a coroutine with run_coroutine_threadsafe, as the
+RTSP signal handlers of the app do. Compared are the old setup, a GLib
+main loop thread, and the setup of the app: an asyncio loop dispatching the
+GLib context (GLibSelector). Thread count, idle CPU usage and, for the
+selector, idle wakeups are reported as well.
+
+    python3 -m sip2rtsp.benchmarks.glib_loop [--events 2000] [--interval 0.002]
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import threading
+import time
+
+from sip2rtsp.gi import GLib, GstRtsp, GstRtspServer
+from sip2rtsp import glib_loop
+from sip2rtsp.metrics import LatencyHistogram
+
+
+def produce(port, events, interval, seed, sent):
+    """Send OPTIONS requests one at a time, recording their send time by CSeq"""
+    rng = random.Random(seed)
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        for cseq in range(1, events + 1):
+            time.sleep(rng.uniform(0, 2 * interval))
+            sent[cseq] = time.perf_counter()
+            sock.sendall(
+                f"OPTIONS rtsp://127.0.0.1:{port}/bench RTSP/1.0\r\nCSeq: {cseq}\r\n\r\n".encode()
+            )
+            response = b""
+            while b"\r\n\r\n" not in response:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    return
+                response += chunk
+
+
+async def measure(mode, events, interval, idle, seed, port):
+    aioloop = asyncio.get_running_loop()
+    latency = LatencyHistogram()
+    done = asyncio.Event()
+    received = 0
+    sent = {}
+
+    async def handler(sent_at):
+        nonlocal received
+        latency.record(time.perf_counter() - sent_at)
+        received += 1
+        if received == events:
+            done.set()
+
+    def options_request(_client, context):
+        res, cseq = context.request.get_header(GstRtsp.RTSPHeaderField.CSEQ, 0)
+        if res != GstRtsp.RTSPResult.OK:
+            return
+        asyncio.run_coroutine_threadsafe(handler(sent[int(cseq)]), aioloop)
+
+    def client_connected(_server, client):
+        client.connect("options-request", options_request)
+
+    server = GstRtspServer.RTSPServer.new()
+    server.set_service(str(port))
+    server.connect("client-connected", client_connected)
+    if mode == "thread":
+        main_loop = GLib.MainLoop()
+        glib_thread = threading.Thread(target=main_loop.run)
+        glib_thread.start()
+    source_id = server.attach(None)
+
+    # Idle CPU cost of the integration
+    await asyncio.sleep(0.2)
+    selector = aioloop._selector if mode == "selector" else None
+    iterations = selector.get_stats()["iterations"] if selector else None
+    cpu = time.process_time()
+    await asyncio.sleep(idle)
+    idle_cpu = 100 * (time.process_time() - cpu) / idle
+    if selector:
+        wakeups = (selector.get_stats()["iterations"] - iterations) / idle
+    else:
+        wakeups = None
+    threads = threading.active_count()
+
+    producer = threading.Thread(target=produce, args=(port, events, interval, seed, sent))
+    producer.start()
+    await done.wait()
+    producer.join()
+
+    GLib.source_remove(source_id)
+    if mode == "thread":
+        main_loop.quit()
+        glib_thread.join()
+    return latency.snapshot(), threads, idle_cpu, wakeups
+
+
+def run(args):
+    print(
+        f"{'mode':<8} {'p50 us':>8} {'p90 us':>8} {'p99 us':>8} {'max us':>8} {'threads':>8} "
+        f"{'idle cpu %':>11} {'wakeups/s':>10}"
+    )
+    for mode in ("thread", "selector"):
+        main = measure(mode, args.events, args.interval, args.idle, args.seed, args.port)
+        if mode == "thread":
+            stats, threads, idle_cpu, wakeups = asyncio.run(main)
+        else:
+            stats, threads, idle_cpu, wakeups = glib_loop.run(main)
+        args.port += 1
+        p = stats["percentiles"]
+        wakeups = f"{wakeups:.1f}" if wakeups is not None else "n/a"
+        print(
+            f"{mode:<8} {p['p50'] * 1e6:>8.0f} {p['p90'] * 1e6:>8.0f} {p['p99'] * 1e6:>8.0f} "
+            f"{stats['max'] * 1e6:>8.0f} {threads:>8} {idle_cpu:>11.2f} {wakeups:>10}"
+        )
+    print("(threads counted with the producer thread not yet started, client pool threads "
+          f"only exist while serving, {os.cpu_count()} CPUs)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--interval", type=float, default=0.002, help="mean seconds between events")
+    parser.add_argument("--idle", type=float, default=2.0, help="seconds to measure idle CPU")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=18654)
+    args = parser.parse_args()
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""Viewer capacity of Sip2RtspApp: ramp concurrent RTSP clients until frames drop.
+
+Runs the app (with a fake baresip) serving a test pattern and, for every
+step, starts N rtspsrc clients in a separate process, so their cost is not
+counted. The clients depayload but do not decode. Per step, the app
+process CPU usage, RSS and thread count, and per client the received
+frame rate and frame gaps (inter-frame times over --gap) are recorded. A
+step holds when every client receives at least --min-fps-ratio of the
+source frame rate without gaps; the capacity is the largest such N.
+Results are printed as JSON (--json) to compare capacity curves across
+commits and configurations.
+
+    python3 -m sip2rtsp.benchmarks.load_test [--steps 1,2,4,8,16,32] [--shared] [--json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from sip2rtsp.gi import Gst
+from sip2rtsp import glib_loop
+from sip2rtsp.benchmarks.app_harness import AppHarness
+from sip2rtsp.benchmarks.shared_media import rss_mb
+
+FPS = 15
+LOAD_LAUNCH_STRING = (
+    f"videotestsrc is-live=true pattern=ball ! video/x-raw,width=1280,height=720,framerate={FPS}/1 "
+    "! x264enc speed-preset=superfast tune=zerolatency bitrate=2000 key-int-max=30 "
+    "! rtph264pay config-interval=1 name=pay0 pt=96 "
+    "audiotestsrc is-live=true ! audio/x-raw,rate=8000,channels=1 ! opusenc ! rtpopuspay name=pay1"
+)
+
+
+class LoadClient:
+    """One RTSP viewer, recording the arrival time of every video frame"""
+
+    def __init__(self, url, protocols):
+        self.pipeline = Gst.parse_launch(
+            f"rtspsrc location={url} protocols={protocols} latency=0 name=src "
+            "src. ! rtph264depay ! h264parse ! video/x-h264,alignment=au "
+            "! fakesink name=video sync=false signal-handoffs=true"
+        )
+        self.pipeline.get_by_name("video").connect("handoff", self._handoff)
+        self.frames = []
+
+    def _handoff(self, _sink, _buffer, _pad):
+        self.frames.append(time.monotonic())
+
+    def start(self):
+        self.pipeline.set_state(Gst.State.PLAYING)
+
+    def stop(self):
+        self.pipeline.set_state(Gst.State.NULL)
+
+    def get_stats(self, since, until, gap):
+        frames = [t for t in self.frames if since <= t <= until]
+        gaps = [b - a for a, b in zip(frames, frames[1:]) if b - a > gap]
+        return {
+            "fps": len(frames) / (until - since),
+            "gaps": len(gaps),
+            "max_gap": max(gaps, default=0.0),
+        }
+
+
+def run_clients(url, count, protocols, measure, gap):
+    """Client process: count viewers, prints their stats of the last measure
+    seconds when stdin closes"""
+    clients = [LoadClient(url, protocols) for _ in range(count)]
+    for client in clients:
+        client.start()
+    sys.stdin.read()
+    until = time.monotonic()
+    for client in clients:
+        client.stop()
+    stats = [c.get_stats(until - measure, until, gap) for c in clients]
+    print(json.dumps(stats), flush=True)
+
+
+def thread_count():
+    """Threads of the process, including GStreamer's"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("Threads:"):
+                return int(line.split()[1])
+    return 0
+
+
+async def run_step(url, count, args):
+    clients = subprocess.Popen(
+        [
+            sys.executable, "-m", __spec__.name,
+            "--client", url, "--count", str(count),
+            "--protocols", args.protocols,
+            "--measure", str(args.measure), "--gap", str(args.gap),
+        ],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    await asyncio.sleep(args.warmup)
+    cpu = time.process_time()
+    wall = time.monotonic()
+    await asyncio.sleep(args.measure)
+    cpu_pct = 100 * (time.process_time() - cpu) / (time.monotonic() - wall)
+    rss, threads = rss_mb(), thread_count()
+
+    out, _ = await asyncio.get_running_loop().run_in_executor(None, clients.communicate, "")
+    viewers = json.loads(out.strip().splitlines()[-1]) if clients.returncode == 0 else []
+    fps = [v["fps"] for v in viewers]
+    ok = len(viewers) == count and all(
+        v["fps"] >= args.min_fps_ratio * FPS and not v["gaps"] for v in viewers
+    )
+    # Let the server tear the sessions down before the next step
+    await asyncio.sleep(1)
+    return {
+        "clients": count,
+        "cpu_pct": round(cpu_pct, 1),
+        "rss_mb": round(rss, 1),
+        "threads": threads,
+        "fps_min": round(min(fps), 2) if fps else None,
+        "fps_mean": round(sum(fps) / len(fps), 2) if fps else None,
+        "gaps": sum(v["gaps"] for v in viewers),
+        "max_gap": round(max((v["max_gap"] for v in viewers), default=0.0), 3),
+        "ok": ok,
+        "viewers": viewers,
+    }
+
+
+async def run(args):
+    harness = AppHarness(
+        args.port, launch_string=LOAD_LAUNCH_STRING, latency=0, shared_source=args.shared
+    )
+    await harness.create()
+    await harness.start()
+    await asyncio.sleep(1)
+    baseline = {"rss_mb": round(rss_mb(), 1), "threads": thread_count()}
+
+    steps = []
+    for count in args.steps:
+        step = await run_step(harness.url, count, args)
+        steps.append(step)
+        if not args.json:
+            print(
+                f"{count:>8} {step['cpu_pct']:>8.1f} {step['rss_mb']:>8.1f} {step['threads']:>8} "
+                f"{step['fps_min'] or 0:>8.2f} {step['fps_mean'] or 0:>9.2f} {step['gaps']:>6} "
+                f"{'yes' if step['ok'] else 'NO':>4}",
+                flush=True,
+            )
+        if not step["ok"] and args.stop_on_drop:
+            break
+
+    await harness.stop()
+    capacity = 0
+    for step in steps:
+        if not step["ok"]:
+            break
+        capacity = step["clients"]
+    return {
+        "config": {
+            "shared_source": args.shared,
+            "protocols": args.protocols,
+            "fps": FPS,
+            "cpus": os.cpu_count(),
+        },
+        "baseline": baseline,
+        "steps": steps,
+        "capacity": capacity,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--steps", default="1,2,4,8,16,32")
+    parser.add_argument("--shared", action="store_true", help="enable rtsp_server.shared_source")
+    parser.add_argument("--protocols", default="tcp", choices=["tcp", "udp"])
+    parser.add_argument("--port", type=int, default=18854)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--measure", type=float, default=5)
+    parser.add_argument("--gap", type=float, default=3 / FPS, help="seconds between frames counted as a gap")
+    parser.add_argument("--min-fps-ratio", type=float, default=0.95)
+    parser.add_argument("--stop-on-drop", action="store_true", help="stop at the first step that drops frames")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--client", help=argparse.SUPPRESS)
+    parser.add_argument("--count", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.client:
+        run_clients(args.client, args.count, args.protocols, args.measure, args.gap)
+        return
+
+    args.steps = [int(s) for s in args.steps.split(",")]
+    if not args.json:
+        print(f"== {'shared source' if args.shared else 'per-client media'}, {args.protocols}")
+        print(
+            f"{'clients':>8} {'cpu %':>8} {'rss MB':>8} {'threads':>8} {'min fps':>8} "
+            f"{'mean fps':>9} {'gaps':>6} {'ok':>4}"
+        )
+    result = glib_loop.run(run(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"capacity: {result['capacity']} clients")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Throughput benchmark for the Baresip control link netstring decoder.
+
+Replays a burst of baresip ctrl_tcp events split into TCP sized chunks and
+compares the incremental decoder with decoding every chunk on its own.
+
+    python3 -m sip2rtsp.benchmarks.netstring_decoder [--capture FILE]
+
+A capture is the raw byte stream as received from ctrl_tcp, e.g. recorded
+with `nc 127.0.0.1 4444 > burst.bin` during a call with rtp_stats enabled.
+"""
+import argparse
+import json
+import random
+import time
+
+import pynetstring
+
+from sip2rtsp.netstring import NetstringDecoder
+
+RTCP_EVENT = {
+    "event": True,
+    "type": "CALL_RTCP",
+    "class": "call",
+    "accountaor": "sip:user1@office",
+    "direction": "outgoing",
+    "peeruri": "sip:11@10.10.10.80",
+    "id": "6d3b0b3d9a8f1c2e",
+    "param": "audio",
+    "rtcp_stats": {
+        "tx": {"sent": 1234, "lost": 0, "jit": 1500},
+        "rx": {"sent": 1229, "lost": 3, "jit": 2250},
+        "rtt": 12000,
+    },
+}
+
+
+def synthesize_burst(count):
+    stream = bytearray()
+    for i in range(count):
+        event = dict(RTCP_EVENT)
+        event["id"] = f"{i:016x}"
+        stream += pynetstring.encode(json.dumps(event).encode())
+    return bytes(stream)
+
+
+def split_stream(stream, seed, max_chunk):
+    rnd = random.Random(seed)
+    chunks = []
+    offset = 0
+    while offset < len(stream):
+        size = rnd.randint(1, max_chunk)
+        chunks.append(stream[offset:offset + size])
+        offset += size
+    return chunks
+
+
+def run_incremental(chunks):
+    decoder = NetstringDecoder()
+    frames = 0
+    for chunk in chunks:
+        frames += len(decoder.feed(chunk))
+    return frames, 0
+
+
+def run_per_chunk(chunks):
+    frames = 0
+    errors = 0
+    for chunk in chunks:
+        try:
+            for frame in pynetstring.decode(chunk.decode()):
+                json.loads(frame)
+                frames += 1
+        except Exception:
+            errors += 1
+    return frames, errors
+
+
+def measure(name, func, chunks, expected, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        frames, errors = func(chunks)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(
+        f"{name:<12} {frames:>7}/{expected} frames  {errors:>6} errors  "
+        f"{best * 1000:8.2f} ms  {frames / best:12.0f} frames/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--capture", help="raw ctrl_tcp byte stream to replay")
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--max-chunk", type=int, default=1460)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.capture:
+        with open(args.capture, "rb") as f:
+            stream = f.read()
+    else:
+        stream = synthesize_burst(args.events)
+    expected = len(NetstringDecoder().feed(stream))
+    chunks = split_stream(stream, args.seed, args.max_chunk)
+    print(f"{expected} events, {len(stream)} bytes in {len(chunks)} chunks")
+
+    measure("incremental", run_incremental, chunks, expected, args.repeat)
+    measure("per-chunk", run_per_chunk, chunks, expected, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Per-viewer CPU and memory cost of the RTSP server, shared vs per-client media.
+
+Serves a test pattern through the ONVIF media factory and attaches an
+increasing number of RTSP clients (running in a separate process, so their
+cost is not counted). For every step the server process CPU usage and RSS
+are reported.
+
+    python3 -m sip2rtsp.benchmarks.shared_media [--steps 0,1,2,4,8] [--measure 5]
+"""
+import argparse
+import subprocess
+import sys
+import threading
+import time
+
+from sip2rtsp.gi import GLib, Gst, GstRtspServer
+from sip2rtsp.config import RtspServerConfig
+from sip2rtsp.media import create_media_factory
+
+TEST_LAUNCH_STRING = (
+    "videotestsrc is-live=true pattern=ball ! video/x-raw,width=1280,height=720,framerate=15/1 "
+    "! x264enc speed-preset=superfast tune=zerolatency bitrate=2000 key-int-max=30 "
+    "! rtph264pay config-interval=1 name=pay0 pt=96 "
+    "audiotestsrc is-live=true ! audio/x-raw,rate=8000,channels=1 ! opusenc ! rtpopuspay name=pay1"
+)
+TEST_BACKCHANNEL_LAUNCH_STRING = (
+    '( capsfilter caps="application/x-rtp,media=audio,payload=0,clock-rate=8000,encoding-name=PCMU" '
+    "name=depay_backchannel ! fakesink async=false )"
+)
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def run_clients(url, count):
+    """Client process: keep count RTSP sessions open until stdin closes"""
+    loop = GLib.MainLoop()
+    pipelines = []
+    for _ in range(count):
+        pipeline = Gst.Pipeline.new()
+        src = Gst.ElementFactory.make("rtspsrc")
+        src.set_property("location", url)
+        src.set_property("latency", 0)
+        pipeline.add(src)
+
+        def pad_added(_src, pad, pipeline=pipeline):
+            sink = Gst.ElementFactory.make("fakesink")
+            sink.set_property("sync", False)
+            pipeline.add(sink)
+            sink.sync_state_with_parent()
+            pad.link(sink.get_static_pad("sink"))
+
+        src.connect("pad-added", pad_added)
+        pipeline.set_state(Gst.State.PLAYING)
+        pipelines.append(pipeline)
+
+    threading.Thread(target=lambda: (sys.stdin.read(), loop.quit()), daemon=True).start()
+    loop.run()
+    for pipeline in pipelines:
+        pipeline.set_state(Gst.State.NULL)
+
+
+def measure(shared, steps, port, warmup, duration):
+    config = RtspServerConfig(
+        launch_string=TEST_LAUNCH_STRING,
+        backchannel_launch_string=TEST_BACKCHANNEL_LAUNCH_STRING,
+        port=port,
+        mount_point="/bench",
+        latency=0,
+        shared_source=shared,
+    )
+    server = GstRtspServer.RTSPOnvifServer.new()
+    factory, _ = create_media_factory(config)
+    server.get_mount_points().add_factory(config.mount_point, factory)
+    server.set_service(str(port))
+    loop = GLib.MainLoop()
+    source_id = server.attach(None)
+    thread = threading.Thread(target=loop.run, daemon=True)
+    thread.start()
+
+    url = f"rtsp://127.0.0.1:{port}{config.mount_point}"
+    results = []
+    for count in steps:
+        clients = None
+        if count:
+            clients = subprocess.Popen(
+                [sys.executable, "-m", __spec__.name, "--client", url, "--count", str(count)],
+                stdin=subprocess.PIPE,
+            )
+        time.sleep(warmup)
+        cpu = time.process_time()
+        wall = time.monotonic()
+        time.sleep(duration)
+        cpu_pct = 100 * (time.process_time() - cpu) / (time.monotonic() - wall)
+        results.append((count, cpu_pct, rss_mb()))
+        if clients:
+            clients.stdin.close()
+            clients.wait()
+        # Let the server tear the sessions down before the next step
+        time.sleep(1)
+
+    GLib.source_remove(source_id)
+    loop.quit()
+    thread.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--steps", default="0,1,2,4,8")
+    parser.add_argument("--port", type=int, default=18554)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--measure", type=float, default=5)
+    parser.add_argument("--client", help=argparse.SUPPRESS)
+    parser.add_argument("--count", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.client:
+        run_clients(args.client, args.count)
+        return
+
+    steps = [int(s) for s in args.steps.split(",")]
+    for shared in (False, True):
+        results = measure(shared, steps, args.port, args.warmup, args.measure)
+        print(f"== {'shared source' if shared else 'per-client media'}")
+        print(f"{'clients':>8} {'cpu %':>8} {'rss MB':>8} {'cpu %/viewer':>13} {'MB/viewer':>10}")
+        base_cpu, base_rss = results[0][1], results[0][2]
+        for count, cpu_pct, rss in results:
+            per_cpu = (cpu_pct - base_cpu) / count if count else 0
+            per_rss = (rss - base_rss) / count if count else 0
+            print(f"{count:>8} {cpu_pct:>8.1f} {rss:>8.1f} {per_cpu:>13.1f} {per_rss:>10.1f}")
+        args.port += 1
+
+
+if __name__ == "__main__":
+    main()
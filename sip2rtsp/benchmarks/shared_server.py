@@ -0,0 +1,165 @@
+"""Threads and memory of N connections, one RTSP server each vs one shared server.
+
+Every configuration runs in its own process: N Sip2RtspApps (each with a
+fake baresip) serving a test pattern, either each on its own port or all
+on one port with a mount point per connection (shared_rtsp_server). Once
+idle, the process RSS and thread count are recorded, and against the
+process before the apps were created, the cost per connection. Then every
+mount point is sent a DESCRIBE, to check that the requests reach the
+connection serving it.
+
+    python3 -m sip2rtsp.benchmarks.shared_server [--connections 1,10,50] [--json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import subprocess
+import sys
+
+from sip2rtsp.gi import GLib
+from sip2rtsp.app import Sip2RtspApp
+from sip2rtsp.config import ConnectionsConfig
+from sip2rtsp import glib_loop
+from sip2rtsp.rtsp_router import RtspRouter
+from sip2rtsp.benchmarks.fake_baresip import FakeBaresip
+from sip2rtsp.benchmarks.load_test import thread_count
+from sip2rtsp.benchmarks.shared_media import (
+    TEST_BACKCHANNEL_LAUNCH_STRING,
+    TEST_LAUNCH_STRING,
+    rss_mb,
+)
+
+RESULT_PREFIX = "RESULT "
+
+
+async def describe(port, mount_point):
+    """Status code of a DESCRIBE of the mount point"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        f"DESCRIBE rtsp://127.0.0.1:{port}{mount_point} RTSP/1.0\r\n"
+        "CSeq: 1\r\nAccept: application/sdp\r\n\r\n".encode()
+    )
+    await writer.drain()
+    status = await asyncio.wait_for(reader.readline(), 10)
+    writer.close()
+    return int(status.split()[1]) if status.startswith(b"RTSP/1.0") else None
+
+
+async def measure(connections, shared, port, settle):
+    aioloop = asyncio.get_running_loop()
+    glib_context = GLib.MainContext.default()
+    await asyncio.sleep(settle)
+    baseline = {"rss_mb": rss_mb(), "threads": thread_count()}
+
+    router = RtspRouter(glib_context, port) if shared else None
+    fakes = []
+    apps = []
+    urls = []
+    for i in range(connections):
+        fake = await FakeBaresip().start()
+        fakes.append(fake)
+        config = ConnectionsConfig.parse_obj(
+            {
+                "rtsp_server": {
+                    "launch_string": TEST_LAUNCH_STRING,
+                    "backchannel_launch_string": TEST_BACKCHANNEL_LAUNCH_STRING,
+                    "port": port if shared else port + i,
+                    "mount_point": f"/door-{i}",
+                },
+                "sip": {"ctrl_host": "127.0.0.1", "ctrl_port": fake.port},
+            }
+        )
+        app = Sip2RtspApp(aioloop, glib_context, config, {}, router=router)
+        apps.append(app)
+        urls.append((config.rtsp_server.port, config.rtsp_server.mount_point))
+    for app in apps:
+        await app.start()
+
+    await asyncio.sleep(settle)
+    rss, threads = rss_mb(), thread_count()
+
+    statuses = [await describe(p, m) for p, m in urls]
+
+    for app in apps:
+        await app.stop()
+        app.bs_ctrl.stop()
+    for fake in fakes:
+        await fake.stop()
+    return {
+        "connections": connections,
+        "shared": shared,
+        "rss_mb": round(rss, 1),
+        "threads": threads,
+        "rss_mb_per_connection": round((rss - baseline["rss_mb"]) / connections, 2),
+        "threads_per_connection": round((threads - baseline["threads"]) / connections, 2),
+        "ports": len({p for p, _ in urls}),
+        "described": sum(1 for s in statuses if s == 200),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", default="1,10,50")
+    parser.add_argument("--port", type=int, default=18954)
+    parser.add_argument("--settle", type=float, default=1)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        logging.basicConfig(level=logging.WARNING)
+        run = json.loads(args.run)
+        result = glib_loop.run(measure(run["connections"], run["shared"], args.port, args.settle))
+        print(RESULT_PREFIX + json.dumps(result), flush=True)
+        return
+
+    results = []
+    if not args.json:
+        print(
+            f"{'connections':>11} {'server':>10} {'ports':>6} {'threads':>8} {'rss MB':>8} "
+            f"{'threads/conn':>13} {'MB/conn':>8} {'described':>10}"
+        )
+    for connections in [int(c) for c in args.connections.split(",")]:
+        for shared in (False, True):
+            child = subprocess.run(
+                [
+                    sys.executable, "-m", __spec__.name,
+                    "--run", json.dumps({"connections": connections, "shared": shared}),
+                    "--port", str(args.port),
+                    "--settle", str(args.settle),
+                ],
+                stdout=subprocess.PIPE,
+                text=True,
+            )
+            lines = [l for l in child.stdout.splitlines() if l.startswith(RESULT_PREFIX)]
+            if child.returncode or not lines:
+                result = {
+                    "connections": connections,
+                    "shared": shared,
+                    "error": f"exit code {child.returncode}",
+                }
+            else:
+                result = json.loads(lines[-1][len(RESULT_PREFIX):])
+            results.append(result)
+
+            if args.json:
+                continue
+            server = "shared" if shared else "per-conn"
+            if "error" in result:
+                print(f"{connections:>11} {server:>10} failed: {result['error']}")
+                continue
+            print(
+                f"{connections:>11} {server:>10} {result['ports']:>6} {result['threads']:>8} "
+                f"{result['rss_mb']:>8.1f} {result['threads_per_connection']:>13.2f} "
+                f"{result['rss_mb_per_connection']:>8.2f} "
+                f"{result['described']:>5}/{connections}"
+            )
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    sys.exit(1 if any("error" in r for r in results) else 0)
+
+
+if __name__ == "__main__":
+    main()
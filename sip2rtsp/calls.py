@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import re
+import time
+from enum import Enum
+
+from sip2rtsp.const import EVENT_TYPE
+from sip2rtsp.metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+LOCAL_CALL_ID = "local"
+
+
+class CallState(str, Enum):
+    OUTGOING = "OUTGOING"  # dial sent, no event from baresip yet
+    INCOMING = "INCOMING"
+    RINGING = "RINGING"
+    ESTABLISHED = "ESTABLISHED"
+
+
+class Call:
+    def __init__(self, call_id, state, peeruri=None, direction=None):
+        self.id = call_id
+        self.state = state
+        self.peeruri = peeruri
+        self.direction = direction
+        self.created = time.monotonic()
+        self.established = None
+
+
+class CallTracker:
+    """Local model of baresip's calls, fed by CALL_* events.
+
+    Lets the app decide whether to dial, accept or hang up without asking
+    baresip first, and lets callers await state transitions. Must only be
+    used from the asyncio loop that receives the events.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.waiters = []
+        self.dial_started = None
+        self.dial_latency = LatencyHistogram()
+        self.accept_started = None
+        self.accept_latency = LatencyHistogram()
+
+    @property
+    def active(self):
+        return bool(self.calls)
+
+    @property
+    def incoming(self):
+        return any(c.state == CallState.INCOMING for c in self.calls.values())
+
+    @property
+    def is_established(self):
+        return any(c.state == CallState.ESTABLISHED for c in self.calls.values())
+
+    def mark_dialing(self, peeruri):
+        """Record a dial before baresip reports it, so a second SETUP does not dial again"""
+        self.calls[LOCAL_CALL_ID] = Call(
+            LOCAL_CALL_ID, CallState.OUTGOING, peeruri, "outgoing"
+        )
+        self.dial_started = time.monotonic()
+        self._notify()
+
+    def clear_dialing(self):
+        if self.calls.pop(LOCAL_CALL_ID, None):
+            self.dial_started = None
+            self._notify()
+
+    def mark_accepting(self):
+        self.accept_started = time.monotonic()
+
+    def handle_event(self, data):
+        event_type = data.get("type")
+        call_id = data.get("id")
+        if call_id is None:
+            return
+
+        if event_type == EVENT_TYPE.CALL_INCOMING:
+            self._set_state(data, CallState.INCOMING)
+        elif event_type == EVENT_TYPE.CALL_RINGING:
+            self._set_state(data, CallState.RINGING)
+        elif event_type == EVENT_TYPE.CALL_ESTABLISHED:
+            call = self._set_state(data, CallState.ESTABLISHED)
+            call.established = time.monotonic()
+            self._record_setup_latency(call)
+        elif event_type == EVENT_TYPE.CALL_CLOSED:
+            self.calls.pop(call_id, None)
+            if data.get("direction") == "outgoing":
+                self.calls.pop(LOCAL_CALL_ID, None)
+        else:
+            return
+        self._notify()
+
+    def _set_state(self, data, state):
+        call_id = data["id"]
+        call = self.calls.get(call_id)
+        if call is None:
+            if data.get("direction") == "outgoing":
+                # baresip now knows the call we dialed, take over its identity
+                local = self.calls.pop(LOCAL_CALL_ID, None)
+                if local:
+                    local.id = call_id
+                    call = local
+            if call is None:
+                call = Call(call_id, state, data.get("peeruri"), data.get("direction"))
+            self.calls[call_id] = call
+        call.state = state
+        return call
+
+    def _record_setup_latency(self, call):
+        now = time.monotonic()
+        if call.direction == "outgoing" and self.dial_started is not None:
+            latency = now - self.dial_started
+            self.dial_latency.record(latency)
+            self.dial_started = None
+            logger.info(f"Call to {call.peeruri} established {latency * 1000:.0f} ms after dialing")
+        elif call.direction == "incoming" and self.accept_started is not None:
+            latency = now - self.accept_started
+            self.accept_latency.record(latency)
+            self.accept_started = None
+            logger.info(f"Call from {call.peeruri} established {latency * 1000:.0f} ms after accepting")
+
+    def reconcile(self, listcalls):
+        """Replace the model with the calls found in baresip's listcalls output"""
+        self.calls = {}
+        # baresip 3.x prints "[line N, id X]", older versions "[line N]"
+        for match in re.finditer(
+            r"\[line (\d+)(?:,\s*id ([^\]\s]+))?\].*?\b(INCOMING|OUTGOING|RINGING|EARLY|ESTABLISHED)\b\s*(?:\(on hold\))?\s*(\S+)?",
+            listcalls,
+        ):
+            line, call_id, state, peeruri = match.groups()
+            if state == "EARLY":
+                state = CallState.RINGING
+            # Keyed by baresip's call id, so the CALL_* events of the call find it
+            call_id = call_id or f"line{line}"
+            self.calls[call_id] = Call(call_id, CallState(state), peeruri)
+        self._notify()
+
+    def _notify(self):
+        waiters = self.waiters
+        self.waiters = []
+        for predicate, future in waiters:
+            if future.done():
+                continue
+            if predicate():
+                future.set_result(True)
+            else:
+                self.waiters.append((predicate, future))
+
+    async def wait_for(self, predicate, timeout=None):
+        """Wait until predicate() holds, return False on timeout"""
+        if predicate():
+            return True
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((predicate, future))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return False
+
+    async def established(self, timeout=None):
+        return await self.wait_for(lambda: self.is_established, timeout)
+
+    async def idle(self, timeout=None):
+        return await self.wait_for(lambda: not self.active, timeout)
+
+    def get_stats(self):
+        return {
+            "calls": {
+                call.id: {"state": call.state.value, "peeruri": call.peeruri}
+                for call in self.calls.values()
+            },
+            "dial_to_established": self.dial_latency.snapshot(),
+            "accept_to_established": self.accept_latency.snapshot(),
+        }
@@ -91,12 +91,21 @@ class BaresipConfig():
         self.config["v4l2loopback_height"] = config.onvif.camera.height
         self.config["avcodec_passthrough"] = config.sip.video_device
         self.config["ctrl_tcp_listen"] = f"0.0.0.0:{config.sip.ctrl_port}"
+        self.config["rtp_stats"] = "yes" if config.sip.rtp_stats else "no"
+        if config.sip.audio_bridge == AudioBridgeEnum.jack:
+            # Ports are connected by sip2rtsp.jack, not to the physical ports
+            self.config["audio_player"] = "jack,"
+            self.config["audio_source"] = "jack,"
+            self.config["module"] = [
+                "jack.so" if m == "pulse.so" else m for m in self.config["module"]
+            ]
+            self.config["jack_client_name"] = f"baresip-{config.sip.ctrl_port}"
+            self.config["jack_connect_ports"] = "no"
 
     def write_config(self, config_file):
         ret  = Path(config_file).parents[0].mkdir(parents=True, exist_ok=True)
         with open(config_file, 'w+') as f:
             for key, entry in self.config.items():
-                print(type(entry))
                 if isinstance(entry, list):
                     for ent in entry:
                         f.write(f"{key} {ent}\n")
@@ -117,6 +126,11 @@ class LogLevelEnum(str, Enum):
     critical = "critical"
 
 
+class AudioBridgeEnum(str, Enum):
+    pulse = "pulse"
+    jack = "jack"
+
+
 class LoggerConfig(Sip2RtspBaseModel):
     default: LogLevelEnum = Field(
         default=LogLevelEnum.info, title="Default logging level."
@@ -126,6 +140,43 @@ class LoggerConfig(Sip2RtspBaseModel):
     )
 
 
+class StreamConfig(Sip2RtspBaseModel):
+    name: str = Field(title="RTSP stream: name, also used as ONVIF profile token.")
+    mount_point: str = Field(title="RTSP stream: mount point.")
+    width: int = Field(default=1920, title="RTSP stream: width to scale to.")
+    height: int = Field(default=1080, title="RTSP stream: height to scale to.")
+    fps: int = Field(default=15, title="RTSP stream: framerate.")
+    bitrate: int = Field(default=2000, title="RTSP stream: H264 bitrate in kbit/s.")
+
+
+class SnapshotConfig(Sip2RtspBaseModel):
+    enabled: bool = Field(
+        default=False, title="Snapshots: serve JPEG snapshots of the live video (implies shared_source and warm)."
+    )
+    ttl: float = Field(default=2.0, title="Snapshots: seconds to serve a snapshot from memory before encoding a new one.")
+    width: int = Field(default=0, title="Snapshots: width to downscale to, 0 to keep.")
+    height: int = Field(default=0, title="Snapshots: height to downscale to, 0 to keep.")
+    quality: int = Field(default=85, title="Snapshots: JPEG quality.")
+    prefetch: bool = Field(
+        default=True, title="Snapshots: take a snapshot on an incoming call, before the ONVIF doorbell event is sent."
+    )
+    prefetch_timeout: float = Field(
+        default=1.0, title="Snapshots: seconds the doorbell event waits at most for the prefetched snapshot."
+    )
+    pin_time: float = Field(
+        default=10.0, title="Snapshots: seconds the prefetched snapshot is served to every request."
+    )
+
+
+class WatchdogConfig(Sip2RtspBaseModel):
+    enabled: bool = Field(
+        default=False, title="Source watchdog: restart a stalled video source without dropping the RTSP sessions (requires streams)."
+    )
+    stall_timeout: float = Field(default=2.0, title="Source watchdog: seconds without a frame after which the source is restarted.")
+    placeholder: bool = Field(default=True, title="Source watchdog: show a black frame while the source is stalled.")
+    max_backoff: float = Field(default=30.0, title="Source watchdog: maximum seconds between restarts of a source that does not recover.")
+
+
 class RtspServerConfig(Sip2RtspBaseModel):
     launch_string: str = Field(
         default="", title="GStreamer RTSP server: launch string."
@@ -141,6 +192,45 @@ class RtspServerConfig(Sip2RtspBaseModel):
     enable_rtcp: bool = Field(
         default=False, title="GStreamer RTSP server: enable RTCP."
     )
+    shared_source: bool = Field(
+        default=False, title="GStreamer RTSP server: run the launch string once and share its encoded streams between all clients."
+    )
+    warm: bool = Field(
+        default=False, title="GStreamer RTSP server: keep the shared source running without clients (implies shared_source)."
+    )
+    gop_cache_size: int = Field(
+        default=4096, title="GStreamer RTSP server: KB per stream of the shared source's last GOP replayed to new clients, 0 to disable."
+    )
+    source_uri: str = Field(
+        default="", title="GStreamer RTSP server: camera URI to build the launch string from if launch_string is empty."
+    )
+    discovery_ttl: int = Field(
+        default=3600, title="GStreamer RTSP server: seconds to cache the discovered source caps."
+    )
+    push_to_talk: bool = Field(
+        default=False, title="GStreamer RTSP server: keep the backchannel muted until it is unmuted through /api/audio or ONVIF."
+    )
+    snapshot: SnapshotConfig = Field(
+        default_factory=SnapshotConfig, title="GStreamer RTSP server: snapshots of the shared source."
+    )
+    watchdog: WatchdogConfig = Field(
+        default_factory=WatchdogConfig, title="GStreamer RTSP server: watchdog of the video source of the streams."
+    )
+    streams: List[StreamConfig] = Field(
+        default_factory=list, title="GStreamer RTSP server: streams (e.g. main and sub) encoded from one decoded source, each on its own mount point."
+    )
+
+    @validator("streams")
+    def validate_streams(cls, v, values):
+        if v and not (values.get("launch_string") or values.get("source_uri")):
+            raise ValueError("Streams need a source, set launch_string or source_uri")
+        names = [s.name for s in v]
+        if len(set(names)) != len(names):
+            raise ValueError("Stream names must be unique")
+        mount_points = [s.mount_point for s in v]
+        if len(set(mount_points)) != len(mount_points):
+            raise ValueError("Stream mount points must be unique")
+        return v
 
 
 class SipConfig(Sip2RtspBaseModel):
@@ -156,12 +246,24 @@ class SipConfig(Sip2RtspBaseModel):
     audio_source: str = Field(
         default="BaresipMicrophone", title="The shared audio source between gstreamer and baresip"
     )
+    audio_bridge: AudioBridgeEnum = Field(
+        default=AudioBridgeEnum.pulse, title="Audio path between gstreamer and baresip: PulseAudio null sinks or JACK shared memory ports"
+    )
     ctrl_host: str = Field(
         default="0.0.0.0", title="Hostname of baresip service, usually localhost"
     )
     ctrl_port: int = Field(
         default=4444, title="Port of the baresip service, begin at 4444"
     )
+    early_dial: bool = Field(
+        default=False, title="Dial (or answer) on a DESCRIBE requiring the ONVIF backchannel instead of waiting for its SETUP"
+    )
+    early_dial_window: float = Field(
+        default=5.0, title="Seconds to wait for the backchannel SETUP before hanging up an early dial"
+    )
+    rtp_stats: bool = Field(
+        default=False, title="Enable baresip RTP statistics and collect RTCP call quality telemetry"
+    )
 
 class CameraConfig(Sip2RtspBaseModel):
     name: str = Field(
@@ -206,6 +308,52 @@ class ConnectionsConfig(Sip2RtspBaseModel):
         default_factory=OnvifConfig, title="ONVIF configuration."
     )
 
+class SharedRtspServerConfig(Sip2RtspBaseModel):
+    enabled: bool = Field(
+        default=False, title="Shared RTSP server: serve all connections from one RTSP server, each on its own mount points."
+    )
+    port: int = Field(
+        default=8554, title="Shared RTSP server: TCP port to listen on, instead of each connection's rtsp_server.port."
+    )
+
+
+class WorkersConfig(Sip2RtspBaseModel):
+    count: int = Field(
+        default=0, title="Workers: processes to shard the connections across, 0 or 1 to run all connections in this process."
+    )
+    pin_cpus: bool = Field(
+        default=True, title="Workers: pin each worker to one CPU core, round robin."
+    )
+    restart_delay: float = Field(
+        default=1.0, title="Workers: seconds before restarting a crashed worker, doubled while it keeps crashing."
+    )
+    max_restart_delay: float = Field(
+        default=30.0, title="Workers: upper bound of the restart delay."
+    )
+    stop_timeout: float = Field(
+        default=10.0, title="Workers: seconds to wait for a worker to stop before it is killed."
+    )
+    report_interval: float = Field(
+        default=2.0, title="Workers: seconds between the health and metrics reports of a worker."
+    )
+    status_port: int = Field(
+        default=10100, title="Workers: HTTP port of the supervisor's aggregated /api/health and /api/workers."
+    )
+
+    @validator("count")
+    def validate_count(cls, v):
+        if v < 0:
+            raise ValueError("Worker count must not be negative")
+        return v
+
+
+def connection_mount_points(connection_config):
+    rtsp_config = connection_config.rtsp_server
+    if rtsp_config.streams:
+        return [stream.mount_point for stream in rtsp_config.streams]
+    return [rtsp_config.mount_point]
+
+
 class Sip2RtspConfig(Sip2RtspBaseModel):
     environment_vars: Dict[str, str] = Field(
         default_factory=dict, title="sip2rtsp environment variables."
@@ -216,12 +364,36 @@ class Sip2RtspConfig(Sip2RtspBaseModel):
     connections: Dict[str, ConnectionsConfig] = Field(
         default_factory=dict, title="hash of connections"
     )
+    shared_rtsp_server: SharedRtspServerConfig = Field(
+        default_factory=SharedRtspServerConfig, title="One RTSP server for all connections."
+    )
+    workers: WorkersConfig = Field(
+        default_factory=WorkersConfig, title="Worker processes the connections are sharded across."
+    )
 
     @property
     def runtime_config(self) -> Sip2RtspConfig:
         """Merge config with globals."""
         config = self.copy(deep=True)
-        print(config)
+
+        if config.shared_rtsp_server.enabled and config.workers.count > 1:
+            raise ValueError("shared_rtsp_server can not be used with workers")
+
+        if config.shared_rtsp_server.enabled:
+            mount_points = {}
+            for name, connection_config in config.connections.items():
+                rtsp_config = connection_config.rtsp_server
+                rtsp_config.port = config.shared_rtsp_server.port
+                if not rtsp_config.streams and not rtsp_config.mount_point:
+                    rtsp_config.mount_point = f"/{name}"
+                for mount_point in connection_mount_points(connection_config):
+                    if mount_point in mount_points:
+                        raise ValueError(
+                            f"Mount point {mount_point} of connection {name} is already "
+                            f"used by connection {mount_points[mount_point]}"
+                        )
+                    mount_points[mount_point] = name
+
         return config
 
     @classmethod
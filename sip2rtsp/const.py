@@ -3,6 +3,17 @@ from enum import Enum
 BARESIP_CTRL_HOST = "127.0.0.1"
 BARESIP_CTRL_PORT = 4444
 BARESIP_CTRL_REQUEST_TIMEOUT = 5
+BARESIP_CTRL_MAX_PENDING_REQUESTS = 32
+BARESIP_CTRL_RECONNECT_MIN_DELAY = 0.05
+BARESIP_CTRL_RECONNECT_MAX_DELAY = 5
+
+# JACK audio bridge: SIP audio rate and a 10 ms period
+JACK_SAMPLE_RATE = 8000
+JACK_PERIOD = 80
+JACK_STARTUP_TIMEOUT = 5
+
+# pactl and s6-svlink calls in flight at once while provisioning connections
+STARTUP_MAX_PARALLEL_COMMANDS = 4
 
 
 class EVENT_TYPE(str, Enum):
@@ -16,4 +27,6 @@ class EVENT_TYPE(str, Enum):
     CALL_RTPESTAB = "CALL_RTPESTAB"  # RTP established
     REGISTER_OK = "REGISTER_OK"
 
+ONVIF_BACKCHANNEL_REQUIRE = "www.onvif.org/ver20/backchannel"
+
 YAML_EXT = (".yaml", ".yml")
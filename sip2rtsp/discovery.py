@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import time
+from urllib.parse import urlparse
+
+from sip2rtsp import jack
+from sip2rtsp.audio_control import MICROPHONE, SPEAKER, control_elements
+from sip2rtsp.config import AudioBridgeEnum
+from sip2rtsp.gi import GLib, Gst, GstPbutils
+
+logger = logging.getLogger(__name__)
+
+DISCOVERY_TIMEOUT = 10
+# Seconds before a source that failed discovery is probed again
+DISCOVERY_RETRY = 60
+
+# Rough CPU cost in cores per megapixel per second, used to log what a
+# pipeline choice costs. Measured with x264 speed-preset=superfast on a
+# single x86 core, good enough to compare passthrough against transcoding.
+CPU_COST_PASSTHROUGH = 0.01
+CPU_COST_DECODE_PER_MPIXS = {
+    "image/jpeg": 0.006,
+    "video/x-h264": 0.004,
+    "video/x-h265": 0.006,
+}
+CPU_COST_DECODE_DEFAULT = 0.006
+CPU_COST_ENCODE_H264_PER_MPIXS = 0.02
+
+# Codecs that can be served to ONVIF clients without transcoding
+PASSTHROUGH_PAYLOADERS = {
+    "video/x-h264": "h264parse ! rtph264pay config-interval=1 name=pay0 pt=96",
+    "video/x-h265": "h265parse ! rtph265pay config-interval=1 name=pay0 pt=96",
+}
+
+_cache = {}
+
+
+class SourceInfo:
+    def __init__(self, uri, codec, width, height, fps):
+        self.uri = uri
+        self.codec = codec
+        self.width = width
+        self.height = height
+        self.fps = fps
+
+    @property
+    def mpix_per_second(self):
+        return self.width * self.height * self.fps / 1e6
+
+    def __str__(self):
+        return f"{self.codec} {self.width}x{self.height}@{self.fps:g}"
+
+
+class DiscoveryError(Exception):
+    pass
+
+
+def discover(uri, ttl, timeout=DISCOVERY_TIMEOUT):
+    """Probe uri with GstPbutils.Discoverer, results are cached for ttl seconds.
+
+    Blocks for up to timeout seconds, see discover_source() for the asyncio
+    loop. Raises DiscoveryError if the source cannot be probed, failures are
+    cached for DISCOVERY_RETRY seconds.
+    """
+    cached = _cache.get(uri)
+    if cached:
+        age = time.monotonic() - cached[0]
+        if isinstance(cached[1], DiscoveryError):
+            if age < DISCOVERY_RETRY:
+                raise cached[1]
+        elif age < ttl:
+            return cached[1]
+
+    logger.info(f"Discovering source {uri}...")
+    try:
+        discoverer = GstPbutils.Discoverer.new(timeout * Gst.SECOND)
+        info = discoverer.discover_uri(uri)
+        videos = info.get_video_streams()
+        if not videos:
+            raise DiscoveryError(f"No video stream found in {uri}")
+    except GLib.Error as e:
+        error = DiscoveryError(f"Discovery of {uri} failed: {e.message}")
+        _cache[uri] = (time.monotonic(), error)
+        raise error from e
+    except DiscoveryError as e:
+        _cache[uri] = (time.monotonic(), e)
+        raise
+
+    video = videos[0]
+    num, denom = video.get_framerate_num(), video.get_framerate_denom()
+    source = SourceInfo(
+        uri,
+        video.get_caps().get_structure(0).get_name(),
+        video.get_width(),
+        video.get_height(),
+        num / denom if num and denom else 0,
+    )
+    logger.info(f"Discovered {source} in {uri}")
+    _cache[uri] = (time.monotonic(), source)
+    return source
+
+
+async def discover_source(rtsp_config):
+    """Discover rtsp_server.source_uri in a worker thread, so the asyncio loop
+    is not blocked. Returns the SourceInfo for auto_launch_string(), None if
+    the source cannot be probed."""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(
+            None, discover, rtsp_config.source_uri, rtsp_config.discovery_ttl
+        )
+    except DiscoveryError as e:
+        logger.warning(str(e))
+        return None
+
+
+def source_element(uri):
+    scheme = urlparse(uri).scheme
+    if scheme in ("rtsp", "rtsps"):
+        return f"rtspsrc location={uri} protocols=tcp latency=0"
+    if scheme in ("http", "https"):
+        return f"souphttpsrc location={uri} is-live=true do-timestamp=true timeout=5"
+    return f"urisourcebin uri={uri}"
+
+
+def transcode_cost(source, camera):
+    decode = CPU_COST_DECODE_PER_MPIXS.get(source.codec, CPU_COST_DECODE_DEFAULT)
+    encode_mpixs = camera.width * camera.height * camera.fps / 1e6
+    return source.mpix_per_second * decode + encode_mpixs * CPU_COST_ENCODE_H264_PER_MPIXS
+
+
+def build_video_launch(source, camera):
+    """Cheapest launch string that serves the source as the H.264/H.265 stream ONVIF clients expect"""
+    src = source_element(source.uri)
+    transcode = transcode_cost(source, camera)
+    payloader = PASSTHROUGH_PAYLOADERS.get(source.codec)
+    if payloader:
+        logger.info(
+            f"Source is {source}, using passthrough pipeline "
+            f"(estimated {CPU_COST_PASSTHROUGH:.2f} CPU cores, transcoding would cost ~{transcode:.2f})"
+        )
+        return f"{src} ! parsebin ! {payloader}"
+
+    logger.info(
+        f"Source is {source}, which cannot be passed through. Transcoding to H.264 "
+        f"{camera.width}x{camera.height}@{camera.fps} (estimated {transcode:.2f} CPU cores)"
+    )
+    return build_transcode_launch(source.uri, camera)
+
+
+def build_transcode_launch(uri, camera):
+    """Launch string decoding any source and encoding it to H.264 as configured for the camera"""
+    return (
+        f"{source_element(uri)} ! decodebin ! videoconvert ! videoscale ! videorate "
+        f"! video/x-raw,format=I420,width={camera.width},height={camera.height},framerate={camera.fps}/1 "
+        f"! x264enc speed-preset=superfast tune=zerolatency bitrate={camera.bitrate} key-int-max={camera.fps * 2} "
+        f"! h264parse ! rtph264pay config-interval=1 name=pay0 pt=96"
+    )
+
+
+def build_decoded_source(uri):
+    """Launch string producing the raw video of uri"""
+    return f"{source_element(uri)} ! decodebin"
+
+
+def build_audio_encoder(sip_config):
+    """Launch string producing the baresip speaker audio, Opus encoded"""
+    if sip_config.audio_bridge == AudioBridgeEnum.jack:
+        source = jack.speaker_source(sip_config)
+    else:
+        source = f'pulsesrc device="{sip_config.audio_device}"'
+    return (
+        f"{source} do-timestamp=true ! queue "
+        f"! audioconvert ! {control_elements(SPEAKER)} "
+        f"! audioresample ! audio/x-raw,format=S16LE,channels=1,rate=8000 "
+        f"! opusenc"
+    )
+
+
+def build_backchannel_launch(sip_config):
+    """Backchannel launch string feeding PCMU from the client to the baresip microphone over JACK"""
+    return (
+        '( capsfilter caps="application/x-rtp,media=audio,payload=0,clock-rate=8000,encoding-name=PCMU" '
+        "name=depay_backchannel ! rtppcmudepay ! mulawdec ! audioconvert "
+        f"! {control_elements(MICROPHONE)} ! audioresample "
+        f"! audio/x-raw,format=F32LE,channels=1,rate=8000 ! {jack.microphone_sink(sip_config)} )"
+    )
+
+
+def build_audio_launch(sip_config):
+    return build_audio_encoder(sip_config) + " ! rtpopuspay name=pay1"
+
+
+def auto_launch_string(config, source):
+    """Launch string for rtsp_server.source_uri of a connection config.
+
+    source is its SourceInfo, see discover_source(). Never probes the
+    source itself, as it is called on the asyncio loop.
+    """
+    rtsp_config = config.rtsp_server
+    if source is None:
+        # Offline or slow camera: transcoding copes with whatever it sends later
+        logger.warning(f"Source {rtsp_config.source_uri} was not discovered, falling back to transcoding")
+        video_launch = build_transcode_launch(rtsp_config.source_uri, config.onvif.camera)
+    else:
+        video_launch = build_video_launch(source, config.onvif.camera)
+    return video_launch + " " + build_audio_launch(config.sip)
@@ -0,0 +1,208 @@
+import asyncio
+import inspect
+import logging
+from collections import deque
+from enum import Enum
+
+from sip2rtsp.const import EVENT_TYPE
+
+logger = logging.getLogger(__name__)
+
+EVENT_QUEUE_SIZE = 256
+# A BUFFER queue holds at most this many times its size
+EVENT_BUFFER_FACTOR = 16
+
+
+class OverflowPolicy(str, Enum):
+    # A full queue keeps growing up to EVENT_BUFFER_FACTOR times its size,
+    # then drops the oldest events. The baresip socket is never paused for a
+    # slow subscriber, command responses share the socket.
+    BUFFER = "buffer"
+    # Keep only the latest queued event per (type, call id)
+    COALESCE = "coalesce"
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+
+
+DEFAULT_TYPE_POLICIES = {
+    EVENT_TYPE.CALL_RTCP: OverflowPolicy.COALESCE,
+}
+
+
+def event_type(data):
+    """Return the EVENT_TYPE of an event, or the raw type string if unknown"""
+    try:
+        return EVENT_TYPE(data.get("type"))
+    except ValueError:
+        return data.get("type")
+
+
+class Subscription:
+    def __init__(self, bus, handler, types, maxsize, policy, type_policies, name):
+        self.bus = bus
+        self.handler = handler
+        self.types = frozenset(types) if types else None
+        self.maxsize = maxsize
+        self.limit = maxsize * EVENT_BUFFER_FACTOR
+        self.policy = policy
+        self.type_policies = dict(DEFAULT_TYPE_POLICIES)
+        self.type_policies.update(type_policies or {})
+        self.name = name or getattr(handler, "__qualname__", repr(handler))
+
+        self.queue = deque()
+        self.coalesced = {}
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced_count = 0
+        self.max_depth = 0
+        # Queue overflowed (grew beyond maxsize or dropped events), until
+        # drained to half of maxsize
+        self.behind = False
+
+    def wants(self, etype):
+        return self.types is None or etype in self.types
+
+    @property
+    def congested(self):
+        return len(self.queue) >= self.maxsize
+
+    def put(self, etype, data):
+        policy = self.type_policies.get(etype, self.policy)
+        if policy == OverflowPolicy.COALESCE:
+            key = (etype, data.get("id"))
+            if key in self.coalesced:
+                self.coalesced[key] = data
+                self.coalesced_count += 1
+                return
+            if self.congested:
+                self._overflow("dropping its events")
+                self.dropped += 1
+                return
+            self.coalesced[key] = data
+            self.queue.append(key)
+        elif self.congested and policy == OverflowPolicy.DROP_NEWEST:
+            self._overflow("dropping its events")
+            self.dropped += 1
+            return
+        else:
+            if policy == OverflowPolicy.BUFFER:
+                if self.congested:
+                    self._overflow("buffering its events")
+                if len(self.queue) >= self.limit:
+                    self._drop_oldest()
+            elif self.congested:
+                self._overflow("dropping its events")
+                self._drop_oldest()
+            self.queue.append((None, data))
+
+        self.max_depth = max(self.max_depth, len(self.queue))
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._run())
+        self.wakeup.set()
+
+    def _overflow(self, action):
+        if not self.behind:
+            logger.warning(f"Event subscriber {self.name} is falling behind, {action}")
+            self.behind = True
+
+    def _drop_oldest(self):
+        item = self.queue.popleft()
+        if item[0] is not None:
+            del self.coalesced[item]
+        self.dropped += 1
+
+    def _get(self):
+        item = self.queue.popleft()
+        if item[0] is None:
+            return item[1]
+        return self.coalesced.pop(item)
+
+    async def _run(self):
+        while True:
+            while not self.queue:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            data = self._get()
+            try:
+                result = self.handler(data)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                logger.exception(f"Event subscriber {self.name} failed")
+            self.delivered += 1
+            self.bus._drained(self)
+
+    def cancel(self):
+        self.bus.unsubscribe(self)
+
+    def get_stats(self):
+        return {
+            "depth": len(self.queue),
+            "max_depth": self.max_depth,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced_count,
+            "behind": self.behind,
+        }
+
+
+class EventBus:
+    """Fan out baresip events to independent asyncio subscribers.
+
+    Every subscriber has its own bounded queue and worker task, so a slow
+    subscriber neither blocks the others nor the socket reader. What happens
+    when a queue is full is decided per event type, see OverflowPolicy, by
+    default the oldest queued event is dropped.
+    """
+
+    def __init__(self):
+        self.subscriptions = []
+
+    def subscribe(
+        self,
+        handler,
+        types=None,
+        maxsize=EVENT_QUEUE_SIZE,
+        policy=OverflowPolicy.DROP_OLDEST,
+        type_policies=None,
+        name=None,
+    ):
+        """Call handler (function or coroutine function) with each event of the given types"""
+        subscription = Subscription(
+            self, handler, types, maxsize, policy, type_policies, name
+        )
+        self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        if subscription in self.subscriptions:
+            self.subscriptions.remove(subscription)
+        if subscription.task:
+            subscription.task.cancel()
+            subscription.task = None
+        self._drained(subscription)
+
+    def close(self):
+        """Stop the worker tasks of all subscribers, queued events are discarded"""
+        for subscription in self.subscriptions:
+            if subscription.task:
+                subscription.task.cancel()
+                subscription.task = None
+            subscription.queue.clear()
+            subscription.coalesced.clear()
+
+    def publish(self, data):
+        etype = event_type(data)
+        for subscription in self.subscriptions:
+            if subscription.wants(etype):
+                subscription.put(etype, data)
+
+    def _drained(self, subscription):
+        if subscription.behind and len(subscription.queue) <= subscription.maxsize // 2:
+            logger.info(f"Event subscriber {subscription.name} caught up")
+            subscription.behind = False
+
+    def get_stats(self):
+        return {s.name: s.get_stats() for s in self.subscriptions}
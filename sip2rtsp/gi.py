@@ -26,11 +26,13 @@ else:
     gi.require_version("GstPbutils", "1.0")
     gi.require_version('GstRtsp', '1.0')
     gi.require_version('GstRtspServer', '1.0')
-        
+    gi.require_version("GstVideo", "1.0")
+
     from gi.repository import GstApp
     from gi.repository import GstPbutils
     from gi.repository import GstRtsp
     from gi.repository import GstRtspServer
+    from gi.repository import GstVideo
 
 GLib.set_prgname("sip2rtsp")
 GLib.set_application_name("sip2rtsp")
@@ -53,5 +55,6 @@ __all__ = [
     "GstRtspServer",
     "GstApp",
     "GstPbutils",
+    "GstVideo",
     "gi",
 ]
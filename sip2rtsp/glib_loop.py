@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import selectors
+
+from sip2rtsp.gi import GLib
+
+logger = logging.getLogger(__name__)
+
+# GLib conditions reported to asyncio as readable or writable, errors and
+# hangups are both, as with the selectors of the standard library
+READ_CONDITIONS = GLib.IOCondition.IN | GLib.IOCondition.HUP | GLib.IOCondition.ERR
+WRITE_CONDITIONS = GLib.IOCondition.OUT | GLib.IOCondition.HUP | GLib.IOCondition.ERR
+
+
+class _SelectorSource(GLib.Source):
+    """GLib source polling the file descriptors of the asyncio loop.
+
+    It is dispatched when one of them is ready or the timeout of the
+    current select() expired (its ready time), and collects the ready ones.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # fd -> tag of add_unix_fd()
+        self.tags = {}
+        self.ready = []
+
+    def prepare(self):
+        return False, -1
+
+    def check(self):
+        return False
+
+    def dispatch(self, callback, args):
+        for fd, tag in self.tags.items():
+            condition = self.query_unix_fd(tag)
+            events = 0
+            if condition & READ_CONDITIONS:
+                events |= selectors.EVENT_READ
+            if condition & WRITE_CONDITIONS:
+                events |= selectors.EVENT_WRITE
+            if events:
+                self.ready.append((fd, events))
+        return GLib.SOURCE_CONTINUE
+
+    def register(self, fd, events):
+        condition = GLib.IOCondition.HUP | GLib.IOCondition.ERR
+        if events & selectors.EVENT_READ:
+            condition |= GLib.IOCondition.IN
+        if events & selectors.EVENT_WRITE:
+            condition |= GLib.IOCondition.OUT
+        self.tags[fd] = self.add_unix_fd(fd, condition)
+
+    def unregister(self, fd):
+        self.remove_unix_fd(self.tags.pop(fd))
+
+
+class GLibSelector(selectors._BaseSelectorImpl):
+    """Selector of an asyncio loop that waits in a GLib main context.
+
+    select() runs one blocking iteration of the context, with the file
+    descriptors of the loop added to it as a GLib source. It returns as soon
+    as either a GLib source (the listening socket of the RTSP server,
+    GStreamer bus watches) was dispatched or an asyncio file descriptor is
+    ready, so neither side adds latency to the other and an idle process
+    sleeps in poll(). GLib callbacks run on the asyncio thread and can
+    schedule coroutines directly. The context is owned by the loop's thread
+    until the selector is closed.
+    """
+
+    def __init__(self, context=None):
+        super().__init__()
+        self.context = context or GLib.MainContext.default()
+        if not self.context.acquire():
+            raise RuntimeError("GLib main context is owned by another thread")
+        self.source = _SelectorSource()
+        self.source.attach(self.context)
+        self.iterations = 0
+
+    def register(self, fileobj, events, data=None):
+        key = super().register(fileobj, events, data)
+        self.source.register(key.fd, events)
+        return key
+
+    def unregister(self, fileobj):
+        key = super().unregister(fileobj)
+        self.source.unregister(key.fd)
+        return key
+
+    def select(self, timeout=None):
+        self.source.ready.clear()
+        if timeout is None:
+            self.source.set_ready_time(-1)
+        else:
+            # Dispatches the source, ending the iteration, when it expires
+            self.source.set_ready_time(
+                GLib.get_monotonic_time() + max(0, int(timeout * 1e6))
+            )
+        self.context.iteration(timeout is None or timeout > 0)
+        self.iterations += 1
+
+        ready = []
+        for fd, events in self.source.ready:
+            key = self._fd_to_key.get(fd)
+            if key and events & key.events:
+                ready.append((key, events & key.events))
+        return ready
+
+    def close(self):
+        if self.source is not None:
+            self.source.destroy()
+            self.source = None
+            self.context.release()
+        super().close()
+
+    def get_stats(self):
+        return {"iterations": self.iterations}
+
+
+def new_event_loop(context=None):
+    """asyncio event loop that also dispatches the GLib main context"""
+    return asyncio.SelectorEventLoop(GLibSelector(context))
+
+
+def run(main, context=None):
+    """asyncio.run() on an event loop dispatching the GLib main context"""
+    with asyncio.Runner(loop_factory=lambda: new_event_loop(context)) as runner:
+        return runner.run(main)
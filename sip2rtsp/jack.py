@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import time
+
+from sip2rtsp.const import JACK_PERIOD, JACK_SAMPLE_RATE, JACK_STARTUP_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Audio bridge between GStreamer and baresip through a JACK server. JACK
+# clients exchange audio through shared-memory port buffers in the server's
+# process cycle, so the audio takes no hop through PulseAudio. Every
+# connection uses three JACK clients:
+#   baresip-<ctrl_port>  baresip's jack module, output = speaker, input = microphone
+#   <audio_device>       GStreamer jackaudiosrc reading the speaker
+#   <audio_source>       GStreamer jackaudiosink writing the backchannel to the microphone
+
+
+def baresip_client(sip_config):
+    return f"baresip-{sip_config.ctrl_port}"
+
+
+def speaker_client(sip_config):
+    return sip_config.audio_device
+
+
+def microphone_client(sip_config):
+    return sip_config.audio_source
+
+
+def port_pattern(client):
+    """JACK port regex matching the ports of exactly this client, so that e.g.
+    baresip-4444 does not also match baresip-44445"""
+    return f"^{client}:.*"
+
+
+def speaker_source(sip_config):
+    """GStreamer source element reading baresip's speaker output"""
+    return (
+        f"jackaudiosrc client-name={speaker_client(sip_config)} connect=auto "
+        f'port-pattern="{port_pattern(baresip_client(sip_config))}" '
+        f"buffer-time={JACK_PERIOD * 2 * 1000000 // JACK_SAMPLE_RATE} "
+        f"latency-time={JACK_PERIOD * 1000000 // JACK_SAMPLE_RATE}"
+    )
+
+
+def microphone_sink(sip_config):
+    """GStreamer sink element writing to baresip's microphone input"""
+    return (
+        f"jackaudiosink client-name={microphone_client(sip_config)} connect=auto "
+        f'port-pattern="{port_pattern(baresip_client(sip_config))}" '
+        f"buffer-time={JACK_PERIOD * 2 * 1000000 // JACK_SAMPLE_RATE} "
+        f"latency-time={JACK_PERIOD * 1000000 // JACK_SAMPLE_RATE} async=false"
+    )
+
+
+async def jack_running():
+    process = await asyncio.create_subprocess_exec(
+        "jack_lsp", stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+    )
+    return await process.wait() == 0
+
+
+async def start_jackd():
+    """Start a JACK server with the dummy driver at the SIP audio rate, if none is running"""
+    if await jack_running():
+        logger.info("JACK server already running")
+        return None
+
+    cmd = [
+        "jackd", "--no-realtime", "-d", "dummy",
+        "-r", str(JACK_SAMPLE_RATE), "-p", str(JACK_PERIOD),
+    ]
+    logger.info(" ".join(cmd))
+    process = await asyncio.create_subprocess_exec(*cmd)
+    deadline = time.monotonic() + JACK_STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if await jack_running():
+            return process
+        await asyncio.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f"JACK server did not start within {JACK_STARTUP_TIMEOUT}s")
+
+
+async def list_ports():
+    """JACK ports as a dict name -> True for outputs, False for inputs"""
+    process = await asyncio.create_subprocess_exec(
+        "jack_lsp", "-p", stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+    )
+    out, _ = await process.communicate()
+    ports = {}
+    port = None
+    for line in out.decode().splitlines():
+        if not line.startswith(("\t", " ")):
+            port = line.strip()
+        elif port and "properties:" in line:
+            ports[port] = "output" in line.split("properties:", 1)[1]
+    return ports
+
+
+async def connect_bridge(sip_config):
+    """Connect baresip's ports to the GStreamer clients of a connection.
+
+    The GStreamer elements connect themselves when baresip's ports already
+    exist. baresip only opens its ports when call audio starts, so this
+    covers GStreamer pipelines that were started before.
+    """
+    ports = await list_ports()
+    baresip = baresip_client(sip_config)
+    pairs = []
+    for port, output in ports.items():
+        client = port.split(":", 1)[0]
+        if client != baresip:
+            continue
+        peer = speaker_client(sip_config) if output else microphone_client(sip_config)
+        peers = [p for p, o in ports.items() if p.split(":", 1)[0] == peer and o != output]
+        for other in peers:
+            pairs.append((port, other) if output else (other, port))
+
+    for source, destination in pairs:
+        # Fails harmlessly if already connected
+        process = await asyncio.create_subprocess_exec(
+            "jack_connect", source, destination,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+        )
+        await process.wait()
+    if pairs:
+        logger.debug(f"JACK bridge connected: {pairs}")
+    return pairs
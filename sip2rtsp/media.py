@@ -0,0 +1,484 @@
+import logging
+import threading
+import time
+
+from sip2rtsp.gi import Gst, GstRtspServer, GstVideo
+from sip2rtsp.metrics import LatencyHistogram
+from sip2rtsp.watchdog import SourceWatchdog, build_watched_source
+
+logger = logging.getLogger(__name__)
+
+# Payloader properties carried over to the per-client payloaders of a shared source
+PAYLOADER_PROPERTIES = ("pt", "config-interval", "mtu")
+# appsink holding the latest raw frame of a shared source, if any
+SNAPSHOT_SINK = "snapshot"
+# Queued bytes per client appsrc, beyond which the oldest buffers of a slow
+# client are dropped
+CLIENT_QUEUE_BYTES = 2 * 1024 * 1024
+
+
+def _new_factory(rtsp_config, launch_string):
+    factory = GstRtspServer.RTSPOnvifMediaFactory.new()
+    factory.set_media_gtype(GstRtspServer.RTSPOnvifMedia)
+    factory.set_backchannel_launch(rtsp_config.backchannel_launch_string)
+    factory.set_launch(launch_string)
+    factory.set_shared(False)
+    factory.set_latency(rtsp_config.latency)
+    factory.set_enable_rtcp(rtsp_config.enable_rtcp)
+    # factory.set_backchannel_bandwidth(2000)
+    # factory.set_protocols(GstRtsp.RTSPLowerTrans.TCP)
+    # factory.set_profiles(GstRtsp.RTSPProfile.AVP)
+    return factory
+
+
+def create_media_factory(rtsp_config, launch_string=None):
+    """Create the ONVIF media factory for a rtsp_server config.
+
+    launch_string overrides the launch string of the config, e.g. one built
+    by source discovery.
+
+    Returns the factory and the SharedSource feeding it, if shared_source (or
+    warm or snapshot) is enabled. The factory itself is never shared, every client gets
+    its own media and therefore its own backchannel.
+    """
+    launch_string = launch_string or rtsp_config.launch_string
+    if not (
+        rtsp_config.shared_source or rtsp_config.warm or rtsp_config.snapshot.enabled
+    ):
+        return _new_factory(rtsp_config, launch_string), None
+
+    shared_source = _new_shared_source(rtsp_config, launch_string)
+    factory = _new_factory(rtsp_config, shared_source.client_launch_string())
+    factory.connect("media-configure", shared_source.media_configure)
+    return factory, shared_source
+
+
+def create_stream_factories(rtsp_config, source_launch, audio_launch):
+    """Create one factory per configured stream, all fed by a single SharedSource.
+
+    source_launch must produce raw video, it is decoded once and scaled and
+    encoded per stream. audio_launch must produce encoded audio, it is shared
+    as is. Returns a dict mount point -> factory and the SharedSource.
+    """
+    streams = rtsp_config.streams
+    watchdog = None
+    if rtsp_config.watchdog.enabled:
+        # The source is decoded in a pipeline of its own, to the size and rate
+        # of the largest stream, and can be restarted on its own
+        source_caps = (
+            f"video/x-raw,format=I420,width={max(s.width for s in streams)},"
+            f"height={max(s.height for s in streams)},framerate={max(s.fps for s in streams)}/1"
+        )
+        watchdog = SourceWatchdog(
+            source_launch,
+            source_caps,
+            rtsp_config.watchdog.stall_timeout,
+            rtsp_config.watchdog.max_backoff,
+        )
+        source_launch = build_watched_source(source_caps, rtsp_config.watchdog.placeholder)
+    shared_source = _new_shared_source(
+        rtsp_config,
+        build_streams_launch(
+            source_launch, audio_launch, streams, rtsp_config.snapshot.enabled
+        ),
+        [stream.name for stream in streams],
+        watchdog,
+    )
+    factories = {}
+    for stream in streams:
+        factory = _new_factory(
+            rtsp_config, shared_source.client_launch_string(stream.name)
+        )
+        factory.connect("media-configure", shared_source.media_configure, stream.name)
+        factories[stream.mount_point] = factory
+    return factories, shared_source
+
+
+def _new_shared_source(rtsp_config, launch_string, streams=("",), watchdog=None):
+    shared_source = SharedSource(
+        launch_string,
+        streams,
+        gop_cache_size=rtsp_config.gop_cache_size * 1024,
+        # Snapshots need a frame whether or not anyone is watching
+        warm=rtsp_config.warm or rtsp_config.snapshot.enabled,
+        watchdog=watchdog,
+    )
+    if shared_source.warm:
+        shared_source.start()
+    return shared_source
+
+
+def build_streams_launch(source_launch, audio_launch, streams, snapshot=False):
+    """Launch string teeing one raw video source into an encoder per stream.
+
+    The payloaders of a stream are named <name>_pay0 (video) and <name>_pay1 (audio).
+    With snapshot, the latest raw frame is kept by an appsink named snapshot.
+    """
+    parts = [
+        f"{source_launch} ! videoconvert ! tee name=video",
+        f"{audio_launch} ! tee name=audio",
+    ]
+    if snapshot:
+        parts.append(
+            "video. ! queue leaky=downstream max-size-buffers=1 "
+            f"! appsink name={SNAPSHOT_SINK} max-buffers=1 drop=true sync=false"
+        )
+    for stream in streams:
+        parts.append(
+            f"video. ! queue leaky=downstream max-size-buffers=2 ! videoscale ! videorate "
+            f"! video/x-raw,format=I420,width={stream.width},height={stream.height},framerate={stream.fps}/1 "
+            f"! x264enc speed-preset=superfast tune=zerolatency bitrate={stream.bitrate} key-int-max={stream.fps * 2} "
+            f"! h264parse ! rtph264pay config-interval=1 name={stream.name}_pay0 pt=96"
+        )
+        parts.append(f"audio. ! queue ! rtpopuspay name={stream.name}_pay1")
+    return " ".join(parts)
+
+
+class SharedMedia:
+    """A client's media, fed by one SharedClient per branch"""
+
+    def __init__(self, media):
+        self.media = media
+        self.branches = []
+        # Offset from shared pipeline timestamps to the client's running time,
+        # set when the first keyframe was pushed and shared by all branches,
+        # so audio and video stay in sync
+        self.offset = None
+        self.attached = time.monotonic()
+
+
+class SharedClient:
+    def __init__(self, shared_media, appsrc):
+        self.shared_media = shared_media
+        self.media = shared_media.media
+        self.appsrc = appsrc
+        # The first sample (or cached GOP) was pushed
+        self.started = False
+
+
+class SharedBranch:
+    def __init__(self, stream, index, appsink, payloader_launch):
+        self.stream = stream
+        self.index = index
+        self.appsink = appsink
+        self.payloader_launch = payloader_launch
+        self.clients = []
+        self.buffers = 0
+        # Whether the branch carries video, known from its first sample
+        self.video = None
+        # Samples since the last keyframe, replayed to new clients
+        self.gop = []
+        self.gop_bytes = 0
+        self.gop_overflows = 0
+
+
+class SharedSource:
+    """Runs the forward media of a launch string once for all RTSP clients.
+
+    Every payloader pay<N> of the launch string is replaced by an appsink.
+    Each client's media gets an appsrc src<N> feeding its own copy of that
+    payloader instead, so capture, decoding and encoding happen once no
+    matter how many clients watch, and only payloading is per client.
+
+    A launch string can carry several streams (e.g. main and sub), their
+    payloaders are then named <stream>_pay<N> and every stream is served
+    by its own factory, see client_launch_string().
+
+    With gop_cache_size (bytes per branch) the samples since the last
+    keyframe are kept and replayed to a new client, which therefore starts
+    decoding right away instead of waiting for the next keyframe. A warm
+    source keeps running without clients, so the camera connection and the
+    encoder are already up when a client connects.
+    """
+
+    def __init__(
+        self,
+        launch_string,
+        streams=("",),
+        name="shared-source",
+        gop_cache_size=0,
+        warm=False,
+        watchdog=None,
+    ):
+        self.pipeline = Gst.parse_launch(launch_string)
+        self.pipeline.set_name(name)
+        # Runs the video source separately while the pipeline is running
+        self.watchdog = watchdog
+        if watchdog:
+            watchdog.attach(self.pipeline)
+        self.lock = threading.Lock()
+        self.branches = []
+        self.running = False
+        self.gop_cache_size = gop_cache_size
+        self.warm = warm
+        self.replays = 0
+        self.first_frame = LatencyHistogram()
+
+        for stream in streams:
+            prefix = f"{stream}_" if stream else ""
+            index = 0
+            while True:
+                payloader = self.pipeline.get_by_name(f"{prefix}pay{index}")
+                if payloader is None:
+                    break
+                self.branches.append(
+                    self._replace_payloader(stream, index, prefix, payloader)
+                )
+                index += 1
+            if index == 0:
+                raise ValueError(
+                    f"Shared source launch string has no payloaders named {prefix}pay0, {prefix}pay1, ..."
+                )
+
+        self.snapshot_sink = self.pipeline.get_by_name(SNAPSHOT_SINK)
+
+        bus = self.pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message::error", self._on_error)
+
+    def client_launch_string(self, stream=""):
+        """Launch string of the per-client media of a stream"""
+        return " ".join(
+            f"appsrc name=src{b.index} is-live=true format=time "
+            f"max-bytes={CLIENT_QUEUE_BYTES} leaky-type=downstream ! {b.payloader_launch}"
+            for b in self.branches
+            if b.stream == stream
+        )
+
+    def _replace_payloader(self, stream, index, prefix, payloader):
+        properties = []
+        for prop in PAYLOADER_PROPERTIES:
+            if payloader.find_property(prop) is not None:
+                value = payloader.get_property(prop)
+                if isinstance(value, bool):
+                    value = "true" if value else "false"
+                else:
+                    value = int(value)
+                properties.append(f"{prop}={value}")
+        payloader_launch = " ".join(
+            [payloader.get_factory().get_name(), f"name=pay{index}"] + properties
+        )
+
+        sinkpad = payloader.get_static_pad("sink")
+        upstream = sinkpad.get_peer()
+        parent = payloader.get_parent()
+        upstream.unlink(sinkpad)
+        parent.remove(payloader)
+
+        appsink = Gst.ElementFactory.make("appsink", f"{prefix}share{index}")
+        appsink.set_property("emit-signals", True)
+        appsink.set_property("sync", False)
+        parent.add(appsink)
+        upstream.link(appsink.get_static_pad("sink"))
+
+        branch = SharedBranch(stream, index, appsink, payloader_launch)
+        appsink.connect("new-sample", self._on_new_sample, branch)
+        return branch
+
+    def media_configure(self, _factory, media, stream=""):
+        element = media.get_element()
+        shared_media = SharedMedia(media)
+        with self.lock:
+            for branch in self.branches:
+                if branch.stream != stream:
+                    continue
+                appsrc = element.get_by_name(f"src{branch.index}")
+                if appsrc is not None:
+                    shared_media.branches.append(branch)
+                    branch.clients.append(SharedClient(shared_media, appsrc))
+            clients = self.client_count()
+        media.connect("unprepared", self._media_unprepared)
+        logger.info(f"Client attached to shared source {stream or 'stream'}, {clients} clients")
+
+        if not self.running:
+            self.start()
+        if not all(branch.gop for branch in self.branches if branch.stream == stream):
+            self.request_key_unit()
+
+    def _media_unprepared(self, media):
+        with self.lock:
+            for branch in self.branches:
+                branch.clients = [c for c in branch.clients if c.media is not media]
+            clients = self.client_count()
+        logger.info(f"Client detached from shared source, {clients} clients")
+        if clients == 0 and not self.warm:
+            self.stop()
+
+    def client_count(self):
+        return len({c.media for b in self.branches for c in b.clients})
+
+    def start(self):
+        logger.info("Starting shared source pipeline")
+        self.running = True
+        self.pipeline.set_state(Gst.State.PLAYING)
+        if self.watchdog:
+            self.watchdog.start()
+
+    def stop(self):
+        logger.info("Stopping shared source pipeline")
+        self.running = False
+        if self.watchdog:
+            self.watchdog.stop()
+        self.pipeline.set_state(Gst.State.NULL)
+        with self.lock:
+            for branch in self.branches:
+                branch.gop = []
+                branch.gop_bytes = 0
+
+    def request_key_unit(self):
+        """Ask the encoders for a keyframe so a new client does not wait a whole GOP"""
+        for branch in self.branches:
+            branch.appsink.send_event(
+                GstVideo.video_event_new_upstream_force_key_unit(
+                    Gst.CLOCK_TIME_NONE, True, 0
+                )
+            )
+
+    def latest_video(self):
+        """Samples to get the current video frame from: the latest raw frame,
+        or else the cached GOP of the first video branch. Empty if none."""
+        if self.snapshot_sink is not None:
+            sample = self.snapshot_sink.get_property("last-sample")
+            return [sample] if sample is not None else []
+        with self.lock:
+            for branch in self.branches:
+                if branch.gop and _is_video(branch.gop[0]):
+                    return list(branch.gop)
+        return []
+
+    def _on_new_sample(self, appsink, branch):
+        sample = appsink.emit("pull-sample")
+        if sample is None:
+            return Gst.FlowReturn.EOS
+        branch.buffers += 1
+        if branch.video is None:
+            branch.video = _is_video(sample)
+        with self.lock:
+            if self.gop_cache_size:
+                self._cache(branch, sample)
+            clients = list(branch.clients)
+            # Only copy the cache if a client still waits for its first frame
+            gop = (
+                list(branch.gop)
+                if branch.gop and any(not c.started for c in clients)
+                else None
+            )
+        for client in clients:
+            self._push(branch, client, sample, gop)
+        return Gst.FlowReturn.OK
+
+    def _cache(self, branch, sample):
+        buffer = sample.get_buffer()
+        size = buffer.get_size()
+        if not buffer.has_flags(Gst.BufferFlags.DELTA_UNIT):
+            branch.gop = [sample]
+            branch.gop_bytes = size
+        elif branch.gop and branch.gop_bytes + size <= self.gop_cache_size:
+            branch.gop.append(sample)
+            branch.gop_bytes += size
+        elif branch.gop:
+            # GOP too large, new clients wait for the next keyframe instead
+            branch.gop = []
+            branch.gop_bytes = 0
+            branch.gop_overflows += 1
+
+    def _push(self, branch, client, sample, gop=None):
+        if not client.started:
+            # Start every branch of a client on a keyframe (or the cached GOP
+            # leading up to this sample)
+            if gop:
+                samples = gop
+            elif sample.get_buffer().has_flags(Gst.BufferFlags.DELTA_UNIT):
+                return
+            else:
+                samples = [sample]
+            shared_media = client.shared_media
+            if shared_media.offset is None:
+                # The video branch rebases the timestamps of the whole media
+                # to its own pipeline's running time, the others wait for it
+                if not _leads(branch, shared_media):
+                    return
+                running_time = client.appsrc.get_current_running_time()
+                if running_time == Gst.CLOCK_TIME_NONE:
+                    return
+                ts = _timestamp(sample.get_buffer())
+                if ts == Gst.CLOCK_TIME_NONE:
+                    return
+                # The newest sample keeps its place in time, cached ones are sent
+                # as a burst ahead of it
+                shared_media.offset = running_time - ts
+                # Recorded from the streaming threads of all branches
+                with self.lock:
+                    if len(samples) > 1:
+                        self.replays += 1
+                    self.first_frame.record(time.monotonic() - shared_media.attached)
+            client.started = True
+            for cached in samples:
+                self._emit(client, cached)
+            return
+
+        self._emit(client, sample)
+
+    def _emit(self, client, sample):
+        offset = client.shared_media.offset
+        buffer = sample.get_buffer().copy()
+        if buffer.pts != Gst.CLOCK_TIME_NONE:
+            buffer.pts = max(0, buffer.pts + offset)
+        if buffer.dts != Gst.CLOCK_TIME_NONE:
+            buffer.dts = max(0, buffer.dts + offset)
+        client.appsrc.emit(
+            "push-sample", Gst.Sample.new(buffer, sample.get_caps(), None, None)
+        )
+
+    def _on_error(self, _bus, message):
+        err, debug = message.parse_error()
+        logger.error(f"Shared source pipeline error: {err.message} ({debug})")
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "running": self.running,
+                "warm": self.warm,
+                "clients": self.client_count(),
+                "gop_replays": self.replays,
+                "first_frame": self.first_frame.snapshot(),
+                "gop_cache": {
+                    self._branch_key(b): {
+                        "frames": len(b.gop),
+                        "bytes": b.gop_bytes,
+                        "overflows": b.gop_overflows,
+                    }
+                    for b in self.branches
+                },
+                "buffers": {self._branch_key(b): b.buffers for b in self.branches},
+            }
+
+    @staticmethod
+    def _branch_key(branch):
+        return f"{branch.stream}_{branch.index}" if branch.stream else branch.index
+
+
+def _is_video(sample):
+    caps = sample.get_caps()
+    if caps is None or caps.is_empty():
+        return False
+    structure = caps.get_structure(0)
+    name = structure.get_name()
+    if name == "application/x-rtp":
+        return structure.get_string("media") == "video"
+    return name.startswith("video/") or name.startswith("image/")
+
+
+def _leads(branch, shared_media):
+    """Whether branch sets the offset of the media: its video branch, or
+    the first branch of a media without video"""
+    if branch.video:
+        return True
+    if any(b.video is not False for b in shared_media.branches):
+        # A video branch, or one not known yet
+        return False
+    return branch is shared_media.branches[0]
+
+
+def _timestamp(buffer):
+    return buffer.dts if buffer.dts != Gst.CLOCK_TIME_NONE else buffer.pts
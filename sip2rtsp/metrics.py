@@ -0,0 +1,108 @@
+import math
+import time
+from array import array
+from contextlib import contextmanager
+
+LATENCY_PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram:
+    """Log-linear latency histogram in the style of HdrHistogram.
+
+    Values are recorded in seconds and stored as integer microseconds in
+    buckets whose width doubles every power of two, each split into
+    2**(sub_bucket_bits - 1) linear sub-buckets. With the default of 7 bits
+    the relative error of any reported value stays below 1.6%, while the whole
+    range up to highest_trackable costs about 1500 counters.
+    """
+
+    def __init__(self, highest_trackable=60.0, sub_bucket_bits=7):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.sub_bucket_half = self.sub_bucket_count >> 1
+        self.highest_trackable = int(highest_trackable * 1e6)
+        self.counts = array("Q", [0] * (self._index(self.highest_trackable) + 1))
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        if value < self.sub_bucket_count:
+            return value
+        magnitude = value.bit_length() - self.sub_bucket_bits
+        sub_bucket = value >> magnitude
+        return (
+            self.sub_bucket_count
+            + (magnitude - 1) * self.sub_bucket_half
+            + sub_bucket
+            - self.sub_bucket_half
+        )
+
+    def _highest_equivalent(self, index):
+        if index < self.sub_bucket_count:
+            return index
+        offset = index - self.sub_bucket_count
+        magnitude = offset // self.sub_bucket_half + 1
+        sub_bucket = offset % self.sub_bucket_half + self.sub_bucket_half
+        return ((sub_bucket + 1) << magnitude) - 1
+
+    def record(self, seconds):
+        value = min(max(int(seconds * 1e6), 0), self.highest_trackable)
+        self.counts[self._index(value)] += 1
+        self.total += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def percentile(self, percentile):
+        """Return the latency in seconds below which percentile% of values fall"""
+        if not self.total:
+            return None
+        rank = max(1, math.ceil(self.total * percentile / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._highest_equivalent(index), self.max) / 1e6
+        return self.max / 1e6
+
+    def snapshot(self, percentiles=LATENCY_PERCENTILES):
+        return {
+            "count": self.total,
+            "min": self.min / 1e6 if self.total else None,
+            "max": self.max / 1e6 if self.total else None,
+            "mean": self.sum / self.total / 1e6 if self.total else None,
+            "percentiles": {f"p{p:g}": self.percentile(p) for p in percentiles},
+        }
+
+
+class StageTimer:
+    """Wall time of the named stages of a sequence, such as startup"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.monotonic() - start
+
+    def total(self):
+        return time.monotonic() - self.started
+
+    def __str__(self):
+        stages = ", ".join(f"{name} {t * 1e3:.0f} ms" for name, t in self.stages.items())
+        return f"{self.total() * 1e3:.0f} ms ({stages})"
@@ -0,0 +1,79 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# baresip's ctrl_tcp never sends frames anywhere near this size. Anything
+# bigger means we lost framing and should resynchronise instead of buffering.
+NETSTRING_MAX_LENGTH = 1024 * 1024
+
+
+class NetstringError(Exception):
+    pass
+
+
+class NetstringDecoder:
+    """Incremental netstring decoder for a byte stream.
+
+    TCP gives no guarantee that a netstring arrives in one piece, so every
+    chunk passed to feed() is appended to an internal buffer and only complete
+    frames are consumed. Partial frames stay buffered until the next call.
+    Frame payloads are sliced out of the buffer through a memoryview and
+    JSON-decoded directly from it.
+    """
+
+    def __init__(self, maxlen=NETSTRING_MAX_LENGTH):
+        self.maxlen = maxlen
+        self.maxdigits = len(str(maxlen))
+        self.buffer = bytearray()
+
+    def reset(self):
+        self.buffer.clear()
+
+    def pending(self):
+        """Number of buffered bytes belonging to incomplete frames"""
+        return len(self.buffer)
+
+    def feed(self, data):
+        """Append data and return the JSON objects of all complete frames"""
+        self.buffer += data
+        messages = []
+        offset = 0
+        size = len(self.buffer)
+        with memoryview(self.buffer) as view:
+            while offset < size:
+                colon = self.buffer.find(b":", offset, offset + self.maxdigits + 1)
+                if colon < 0:
+                    if size - offset > self.maxdigits:
+                        raise NetstringError(
+                            f"No length prefix found in {bytes(view[offset:offset + 16])!r}"
+                        )
+                    break
+
+                prefix = self.buffer[offset:colon]
+                if not prefix.isdigit():
+                    raise NetstringError(f"Invalid length prefix {bytes(prefix)!r}")
+                length = int(prefix)
+                if length > self.maxlen:
+                    raise NetstringError(
+                        f"Frame length {length} exceeds maximum of {self.maxlen}"
+                    )
+
+                start = colon + 1
+                end = start + length
+                if end >= size:
+                    # Payload or trailing comma not received yet
+                    break
+                if self.buffer[end] != ord(","):
+                    raise NetstringError(f"Missing terminator after {length} byte frame")
+
+                # Framing is intact, so a bad payload only costs this frame
+                try:
+                    messages.append(json.loads(str(view[start:end], "utf-8")))
+                except ValueError as e:
+                    logger.warning(f"Dropping undecodable frame: {e}")
+                offset = end + 1
+
+        if offset:
+            del self.buffer[:offset]
+        return messages
@@ -1,24 +1,25 @@
-from subprocess import call
+import asyncio
 
-def create_pa_devices(sink="BaresipSpeaker", src="BaresipMicrophone"):
-    load_sink = ["pactl", "load-module", "module-null-sink", f"sink_name={sink}", "format=s16le",
-          "channels=1", "rate=8000", f"sink_properties=\"device.description=\'Baresip Speaker {sink}\'\""]
-    print(" ".join(load_sink))
-    err = call(load_sink)
-    print(err)
-    load_sink_input = ["pactl", "load-module", "module-remap-source", f"source_name={sink}Input", f"master={sink}.monitor",
-          "format=s16le", "channels=1", "rate=8000", "channel_map=mono"]
-    print(" ".join(load_sink_input))
-    call(load_sink_input)
-    print(err)
-    load_src = ["pactl", "load-module", "module-null-sink", f"sink_name={src}", "format=s16le", "channels=1",
-          "rate=8000", f"sink_properties=\"device.description='Baresip Microphone {src}'\""]
-    print(" ".join(load_src))
-    call(load_src)
-    print(err)
-    load_src_input = ["pactl", "load-module", "module-remap-source", f"source_name={src}Input", f"master={src}.monitor",
-          "format=s16le", "channels=1", "rate=8000", "channel_map=mono"]
-    print(" ".join(load_src_input))
-    call(load_src_input)
-    print(err)
-#    raise Exception
+from sip2rtsp.util import run_command
+
+PA_FORMAT = ["format=s16le", "channels=1", "rate=8000"]
+
+
+async def create_pa_device(limiter, name, description):
+    """Load the null sink name and the source nameInput remapping its monitor"""
+    await run_command(
+        limiter, "pactl", "load-module", "module-null-sink", f"sink_name={name}", *PA_FORMAT,
+        f"sink_properties=\"device.description='{description}'\"",
+    )
+    # The remap source needs the monitor of the sink loaded above
+    await run_command(
+        limiter, "pactl", "load-module", "module-remap-source", f"source_name={name}Input",
+        f"master={name}.monitor", *PA_FORMAT, "channel_map=mono",
+    )
+
+
+async def create_pa_devices(limiter, sink="BaresipSpeaker", src="BaresipMicrophone"):
+    await asyncio.gather(
+        create_pa_device(limiter, sink, f"Baresip Speaker {sink}"),
+        create_pa_device(limiter, src, f"Baresip Microphone {src}"),
+    )
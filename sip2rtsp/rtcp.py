@@ -0,0 +1,131 @@
+import logging
+import time
+from array import array
+from collections import OrderedDict
+
+from sip2rtsp.const import EVENT_TYPE
+
+logger = logging.getLogger(__name__)
+
+RTCP_HISTORY_SIZE = 256
+RTCP_MAX_CALLS = 8
+RTCP_PERCENTILES = (50, 90, 99)
+
+
+class RingBuffer:
+    """Fixed-size ring of floats backed by an array, oldest values are overwritten"""
+
+    def __init__(self, size):
+        self.data = array("d", bytes(8 * size))
+        self.size = size
+        self.index = 0
+        self.count = 0
+
+    def append(self, value):
+        self.data[self.index] = value
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def values(self):
+        if self.count < self.size:
+            return self.data[: self.count]
+        return self.data[self.index :] + self.data[: self.index]
+
+    def summary(self, percentiles=RTCP_PERCENTILES):
+        if not self.count:
+            return None
+        values = sorted(self.values())
+        summary = {"last": self.data[self.index - 1], "min": values[0], "max": values[-1]}
+        for p in percentiles:
+            summary[f"p{p}"] = values[min(len(values) - 1, int(len(values) * p / 100))]
+        return summary
+
+
+class RtcpStream:
+    """RTCP history of one media stream (audio/video) of a call"""
+
+    METRICS = (
+        "rx_jitter_ms",
+        "tx_jitter_ms",
+        "rx_loss_pct",
+        "tx_loss_pct",
+        "rtt_ms",
+        "rx_packets",
+        "tx_packets",
+    )
+
+    def __init__(self, peeruri, history):
+        self.peeruri = peeruri
+        self.rings = {metric: RingBuffer(history) for metric in self.METRICS}
+        self.last = None
+        self.updated = None
+
+    def add(self, stats):
+        tx = stats.get("tx", {})
+        rx = stats.get("rx", {})
+        # baresip reports cumulative packet counters and jitter/RTT in microseconds
+        sample = (
+            tx.get("sent", 0),
+            tx.get("lost", 0),
+            rx.get("sent", 0),
+            rx.get("lost", 0),
+        )
+        last = self.last or (0, 0, 0, 0)
+        if any(new < old for new, old in zip(sample, last)):
+            # Counters went backwards, the stream was restarted
+            last = (0, 0, 0, 0)
+        self.last = sample
+        self.updated = time.time()
+
+        self.rings["rx_jitter_ms"].append(rx.get("jit", 0) / 1000)
+        self.rings["tx_jitter_ms"].append(tx.get("jit", 0) / 1000)
+        self.rings["rtt_ms"].append(stats.get("rtt", 0) / 1000)
+        self.rings["tx_packets"].append(sample[0] - last[0])
+        self.rings["rx_packets"].append(sample[2] - last[2])
+        self.rings["tx_loss_pct"].append(_loss_pct(sample[0] - last[0], sample[1] - last[1]))
+        self.rings["rx_loss_pct"].append(_loss_pct(sample[2] - last[2], sample[3] - last[3]))
+
+    def get_stats(self):
+        return {
+            "peeruri": self.peeruri,
+            "updated": self.updated,
+            "samples": self.rings["rtt_ms"].count,
+            "tx_packets_total": self.last[0],
+            "tx_lost_total": self.last[1],
+            "rx_packets_total": self.last[2],
+            "rx_lost_total": self.last[3],
+            "metrics": {name: ring.summary() for name, ring in self.rings.items()},
+        }
+
+
+def _loss_pct(packets, lost):
+    total = packets + lost
+    return 100.0 * lost / total if total > 0 else 0.0
+
+
+class RtcpTelemetry:
+    """Keeps RTCP statistics from CALL_RTCP events for the most recent calls"""
+
+    def __init__(self, history=RTCP_HISTORY_SIZE, max_calls=RTCP_MAX_CALLS):
+        self.history = history
+        self.max_calls = max_calls
+        self.streams = OrderedDict()
+
+    def handle_event(self, data):
+        if data.get("type") != EVENT_TYPE.CALL_RTCP or "rtcp_stats" not in data:
+            return
+        key = (data.get("id"), data.get("param") or "audio")
+        stream = self.streams.get(key)
+        if stream is None:
+            stream = self.streams[key] = RtcpStream(data.get("peeruri"), self.history)
+            while len(self.streams) > self.max_calls:
+                self.streams.popitem(last=False)
+        else:
+            self.streams.move_to_end(key)
+        stream.add(data["rtcp_stats"])
+
+    def get_stats(self):
+        stats = {}
+        for (call_id, media), stream in self.streams.items():
+            stats.setdefault(call_id, {})[media] = stream.get_stats()
+        return stats
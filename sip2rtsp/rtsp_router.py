@@ -0,0 +1,71 @@
+import logging
+
+from sip2rtsp.gi import GstRtspServer
+
+logger = logging.getLogger(__name__)
+
+# RTSPClient signals handled by Sip2RtspApp, by handler name
+CLIENT_REQUEST_HANDLERS = {
+    "describe-request": "client_describe_request",
+    "setup-request": "client_setup_request",
+    "play-request": "client_play_request",
+    "teardown-request": "client_teardown_request",
+}
+
+
+def mount_point_matches(mount_point, path):
+    """Whether the request path is the mount point or one of its streams"""
+    return path == mount_point or path.startswith(mount_point.rstrip("/") + "/")
+
+
+class RtspRouter:
+    """One RTSP server on one port for the mount points of many connections.
+
+    Each Sip2RtspApp adds its media factories to the shared server (see
+    add()). A client may request the mount points of several connections
+    over one RTSP connection, so each of its requests is dispatched to the
+    app serving the requested path rather than to the app it connected to.
+    """
+
+    def __init__(self, glib_context, port):
+        self.server = GstRtspServer.RTSPOnvifServer.new()
+        self.server.set_service(str(port))
+        self.server.connect("client-connected", self.client_connected)
+        # Mount point -> Sip2RtspApp
+        self.apps = {}
+        self.server.attach(glib_context)
+
+    def add(self, app):
+        for mount_point in app.factories:
+            if mount_point in self.apps:
+                raise ValueError(f"Mount point {mount_point} is already served")
+            self.apps[mount_point] = app
+
+    def route(self, path):
+        """App serving path, the one with the longest matching mount point"""
+        matches = [m for m in self.apps if mount_point_matches(m, path)]
+        if not matches:
+            return None
+        return self.apps[max(matches, key=len)]
+
+    def client_connected(self, server, client):
+        logger.info(
+            "RTSP client connected from {remoteip}".format(
+                remoteip=client.get_connection().get_ip()
+            )
+        )
+        for signal, handler in CLIENT_REQUEST_HANDLERS.items():
+            client.connect(signal, self.dispatch, handler)
+        client.connect("closed", self.client_closed)
+
+    def client_closed(self, client):
+        for app in set(self.apps.values()):
+            app.release_backchannel(client)
+
+    def dispatch(self, client, context: GstRtspServer.RTSPContext, handler):
+        path = context.uri.abspath if context.uri else ""
+        app = self.route(path)
+        if app is None:
+            logger.debug(f"No connection serves {path}")
+            return
+        getattr(app, handler)(client, context)
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import threading
+import time
+
+from sip2rtsp.gi import Gst
+
+logger = logging.getLogger(__name__)
+
+RTSP_STATS_INTERVAL = 5
+
+
+class StreamCounters:
+    """Counters of one payloader, written by its pad probe on the streaming thread"""
+
+    __slots__ = ("bytes", "packets")
+
+    def __init__(self):
+        self.bytes = 0
+        self.packets = 0
+
+
+class StreamStats:
+    def __init__(self, index, stream, counters):
+        self.index = index
+        self.stream = stream
+        self.counters = counters
+        self.last_bytes = 0
+        self.last_time = time.monotonic()
+        self.bitrate = 0.0
+        self.sent = None
+        self.loss_fraction = None
+        self.lost = None
+        self.jitter_ms = None
+        self.rtt_ms = None
+
+    def update(self, now):
+        counted = self.counters.bytes
+        elapsed = now - self.last_time
+        if elapsed > 0:
+            self.bitrate = 8 * (counted - self.last_bytes) / elapsed
+        self.last_bytes = counted
+        self.last_time = now
+        self._update_rtcp()
+
+    def _update_rtcp(self):
+        session = self.stream.get_rtpsession()
+        if session is None:
+            return
+        stats = session.get_property("stats")
+        sources = stats.get_value("source-stats") if stats else None
+        for source in sources or []:
+            if source.get_value("internal"):
+                if source.get_value("is-sender"):
+                    self.sent = source.get_value("packets-sent")
+            elif source.get_value("have-rb"):
+                # Report block about our stream from the client
+                clock_rate = source.get_value("clock-rate") or 0
+                self.loss_fraction = source.get_value("rb-fractionlost") / 256
+                self.lost = source.get_value("rb-packetslost")
+                if clock_rate > 0:
+                    self.jitter_ms = 1000 * source.get_value("rb-jitter") / clock_rate
+                # Round trip in NTP short format, 1/65536 s
+                self.rtt_ms = 1000 * source.get_value("rb-round-trip") / 65536
+
+    def get_stats(self):
+        packets = self.counters.packets
+        return {
+            "bytes": self.counters.bytes,
+            "packets": packets,
+            "bitrate": round(self.bitrate),
+            # Payloaded, but not sent by the RTP session
+            "dropped": max(0, packets - self.sent) if self.sent is not None else None,
+            "rtcp_loss_fraction": self.loss_fraction,
+            "rtcp_lost": self.lost,
+            "rtcp_jitter_ms": self.jitter_ms,
+            "rtcp_rtt_ms": self.rtt_ms,
+        }
+
+
+class MediaStats:
+    def __init__(self, mount_point, media):
+        self.mount_point = mount_point
+        self.media = media
+        self.client = None
+        self.created = time.monotonic()
+        self.streams = []
+
+    def get_stats(self):
+        return {
+            "mount_point": self.mount_point,
+            "client": self.client,
+            "age": time.monotonic() - self.created,
+            "streams": {s.index: s.get_stats() for s in self.streams},
+        }
+
+
+class RtspStats:
+    """Per-session and per-mount RTSP streaming counters.
+
+    Pad probes on the payloaders of every client's media only count bytes
+    and packets. Bitrates and the RTCP receiver report values of the RTP
+    sessions are computed periodically on the asyncio loop by run().
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.medias = {}
+        self.closed = {}
+
+    def attach(self, factory, mount_point):
+        factory.connect("media-configure", self._media_configure, mount_point)
+
+    def _media_configure(self, _factory, media, mount_point):
+        media_stats = MediaStats(mount_point, media)
+        element = media.get_element()
+        for index in range(media.n_streams()):
+            payloader = element.get_by_name(f"pay{index}")
+            if payloader is None:
+                continue
+            counters = StreamCounters()
+            payloader.get_static_pad("src").add_probe(
+                Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST,
+                _count,
+                counters,
+            )
+            media_stats.streams.append(
+                StreamStats(index, media.get_stream(index), counters)
+            )
+        media.connect("unprepared", self._media_unprepared)
+        with self.lock:
+            self.medias[media] = media_stats
+
+    def _media_unprepared(self, media):
+        with self.lock:
+            media_stats = self.medias.pop(media, None)
+            if media_stats:
+                totals = self.closed.setdefault(
+                    media_stats.mount_point, {"sessions": 0, "bytes": 0, "packets": 0}
+                )
+                totals["sessions"] += 1
+                for stream in media_stats.streams:
+                    totals["bytes"] += stream.counters.bytes
+                    totals["packets"] += stream.counters.packets
+
+    def bind_client(self, media, client):
+        """Label the session of media with the client's address"""
+        with self.lock:
+            media_stats = self.medias.get(media)
+        if media_stats:
+            media_stats.client = client
+
+    def update(self):
+        now = time.monotonic()
+        with self.lock:
+            medias = list(self.medias.values())
+        for media_stats in medias:
+            for stream in media_stats.streams:
+                try:
+                    stream.update(now)
+                except Exception as e:
+                    logger.debug(f"Failed to update RTSP stream stats: {e}")
+
+    async def run(self, interval=RTSP_STATS_INTERVAL):
+        while True:
+            self.update()
+            await asyncio.sleep(interval)
+
+    def get_stats(self):
+        with self.lock:
+            medias = list(self.medias.values())
+            closed = {k: dict(v) for k, v in self.closed.items()}
+        sessions = [m.get_stats() for m in medias]
+
+        mounts = {}
+        for session in sessions:
+            mount = mounts.setdefault(
+                session["mount_point"], {"viewers": 0, "bitrate": 0}
+            )
+            mount["viewers"] += 1
+            mount["bitrate"] += sum(s["bitrate"] for s in session["streams"].values())
+        for mount_point, totals in closed.items():
+            mounts.setdefault(mount_point, {"viewers": 0, "bitrate": 0})["closed"] = totals
+        return {"mounts": mounts, "sessions": sessions}
+
+
+def _count(_pad, info, counters):
+    if info.type & Gst.PadProbeType.BUFFER_LIST:
+        buffers = info.get_buffer_list()
+        counters.packets += buffers.length()
+        counters.bytes += buffers.calculate_size()
+    else:
+        counters.packets += 1
+        counters.bytes += info.get_buffer().get_size()
+    return Gst.PadProbeReturn.OK
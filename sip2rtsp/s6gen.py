@@ -1,8 +1,9 @@
-
 from pathlib import Path
-from subprocess import call
+
+from sip2rtsp.util import run_command
 
 SERVICE_DIR="/var/services"
+SCANDIR="/run/service"
 
 RUN_CONTENTS="""#!/command/with-contenv bash
 # shellcheck shell=bash
@@ -69,7 +70,6 @@ class S6Generator():
                 )
             )
         Path(self.dir+"/run").chmod(0o700)
-        print(self.dir+"/run", Path(self.dir+"/run").stat().st_mode)
         with open(self.dir+"/finish", "w+") as file:
             file.write(
                 FINISH_CONTENTS.format(
@@ -86,7 +86,6 @@ class S6Generator():
         for dependency in (self.dependencies or []):
             open(self.dir+"/dependencies.d/"+dependency, "x")
 
-    def start_supervisor(self):
-        ret = call(f"find / | grep s6-svlink", shell=True)
-        print(ret)
-        ret = call(f"s6-svlink /run/service {self.dir}", shell=True)
+    async def start_supervisor(self, limiter):
+        """Link the service into the s6 scan directory, which starts it"""
+        return await run_command(limiter, "s6-svlink", SCANDIR, self.dir)
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from sip2rtsp.gi import Gst
+from sip2rtsp.metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# Upper bound for decoding/encoding one snapshot
+SNAPSHOT_TIMEOUT = 5
+# Number of prefetched snapshots kept by key
+SNAPSHOT_PINNED_MAX = 8
+
+
+class Snapshotter:
+    """JPEG snapshots of the current frame of a SharedSource.
+
+    Nothing is decoded or encoded until a snapshot is requested. The JPEG is
+    then kept for ttl seconds, so repeated polls are served from memory and
+    concurrent requests share one encode.
+
+    prefetch() takes a fresh snapshot ahead of expected requests (e.g. when
+    the doorbell rings) and pins it under a key. For pin_time seconds it is
+    served instead of newer frames, and it stays retrievable by its key.
+    """
+
+    def __init__(
+        self, get_frames, ttl=2.0, width=0, height=0, quality=85, pin_time=10.0
+    ):
+        # Returns the samples to decode the current frame from, see
+        # SharedSource.latest_video()
+        self.get_frames = get_frames
+        self.ttl = ttl
+        self.quality = quality
+
+        caps = "video/x-raw,format=I420"
+        if width:
+            caps += f",width={width}"
+        if height:
+            caps += f",height={height}"
+        self.encode_launch = f"videoconvert ! videoscale ! {caps} ! jpegenc quality={quality}"
+
+        self.jpeg = None
+        self.jpeg_time = 0.0
+        self.pending = None
+        self.requests = 0
+        self.hits = 0
+        # Updated by render() in an executor thread
+        self.stats_lock = threading.Lock()
+        self.failures = 0
+        self.render_time = LatencyHistogram()
+
+        self.pin_time = pin_time
+        # key -> (pin time, JPEG)
+        self.pinned = OrderedDict()
+        self.prefetches = set()
+        self.prefetch_latency = LatencyHistogram()
+
+    async def get_jpeg(self, key=None):
+        """Current snapshot as JPEG bytes, None if no frame is available.
+
+        With key, the snapshot pinned under that key, None if unknown.
+        """
+        self.requests += 1
+        if key is not None:
+            entry = self.pinned.get(key)
+            if entry:
+                self.hits += 1
+            return entry[1] if entry else None
+
+        now = time.monotonic()
+        if self.pinned:
+            pinned_at, jpeg = next(reversed(self.pinned.values()))
+            if now - pinned_at < self.pin_time:
+                self.hits += 1
+                return jpeg
+        if self.jpeg is not None and now - self.jpeg_time < self.ttl:
+            self.hits += 1
+            return self.jpeg
+        return await self._render_shared()
+
+    async def prefetch(self, key, timeout):
+        """Take a fresh snapshot and pin it under key.
+
+        Waits at most timeout seconds, the snapshot is still completed and
+        pinned in the background if that is not enough.
+        """
+        start = time.monotonic()
+        task = asyncio.get_running_loop().create_task(self._prefetch(key, start))
+        self.prefetches.add(task)
+        task.add_done_callback(self.prefetches.discard)
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Snapshot prefetch for {key} takes longer than {timeout}s")
+
+    async def _prefetch(self, key, start):
+        # Does not join a render that started before the ring
+        if self.pending is not None:
+            await asyncio.wait([self.pending])
+        jpeg = await self._render_shared()
+        if jpeg is None:
+            logger.warning(f"Snapshot prefetch for {key} failed, no video frame available")
+            return
+        self.prefetch_latency.record(time.monotonic() - start)
+        self.pinned[key] = (time.monotonic(), jpeg)
+        self.pinned.move_to_end(key)
+        while len(self.pinned) > SNAPSHOT_PINNED_MAX:
+            self.pinned.popitem(last=False)
+        logger.info(f"Snapshot for {key} prefetched in {time.monotonic() - start:.3f}s")
+
+    async def _render_shared(self):
+        if self.pending is None:
+            self.pending = asyncio.get_running_loop().run_in_executor(
+                None, self.render
+            )
+            self.pending.add_done_callback(self._rendered)
+        # Shielded, so one client going away does not fail the others
+        return await asyncio.shield(self.pending)
+
+    def _rendered(self, future):
+        self.pending = None
+        if not future.cancelled() and future.exception() is None:
+            jpeg = future.result()
+            if jpeg is not None:
+                self.jpeg = jpeg
+                self.jpeg_time = time.monotonic()
+
+    def render(self):
+        """Decode and encode the current frame, blocking"""
+        start = time.monotonic()
+        samples = self.get_frames()
+        if not samples:
+            logger.debug("No video frame available for a snapshot")
+            return None
+        try:
+            raw = samples[-1]
+            if not raw.get_caps().get_structure(0).get_name().startswith("video/x-raw"):
+                # Encoded GOP, only its last decoded frame is needed
+                raw = run_pipeline("decodebin ! videoconvert", samples)[-1]
+            jpeg = run_pipeline(self.encode_launch, [raw])[-1]
+        except Exception as e:
+            with self.stats_lock:
+                self.failures += 1
+            logger.error(f"Snapshot failed: {e}")
+            return None
+        with self.stats_lock:
+            self.render_time.record(time.monotonic() - start)
+
+        buffer = jpeg.get_buffer()
+        ok, info = buffer.map(Gst.MapFlags.READ)
+        if not ok:
+            with self.stats_lock:
+                self.failures += 1
+            return None
+        try:
+            return bytes(info.data)
+        finally:
+            buffer.unmap(info)
+
+    def get_stats(self):
+        with self.stats_lock:
+            render_time = self.render_time.snapshot()
+            failures = self.failures
+        return {
+            "requests": self.requests,
+            "hits": self.hits,
+            "failures": failures,
+            "age": time.monotonic() - self.jpeg_time if self.jpeg else None,
+            "render_time": render_time,
+            "pinned": list(self.pinned),
+            "ring_to_snapshot": self.prefetch_latency.snapshot(),
+        }
+
+
+def run_pipeline(launch, samples, timeout=SNAPSHOT_TIMEOUT):
+    """Push samples through "appsrc ! <launch> ! appsink" and return its output samples"""
+    pipeline = Gst.parse_launch(
+        f"appsrc name=src format=time ! {launch} ! appsink name=sink sync=false emit-signals=true"
+    )
+    src = pipeline.get_by_name("src")
+    src.set_property("caps", samples[0].get_caps())
+    outputs = []
+    lock = threading.Lock()
+
+    def new_sample(sink):
+        sample = sink.emit("pull-sample")
+        with lock:
+            # Keep the last one only, decoding a GOP yields many frames
+            outputs[:] = [sample]
+        return Gst.FlowReturn.OK
+
+    pipeline.get_by_name("sink").connect("new-sample", new_sample)
+    pipeline.set_state(Gst.State.PLAYING)
+    try:
+        for sample in samples:
+            src.emit("push-buffer", sample.get_buffer())
+        src.emit("end-of-stream")
+        message = pipeline.get_bus().timed_pop_filtered(
+            timeout * Gst.SECOND, Gst.MessageType.EOS | Gst.MessageType.ERROR
+        )
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+
+    if message is None:
+        raise TimeoutError(f"{launch} did not finish within {timeout}s")
+    if message.type == Gst.MessageType.ERROR:
+        err, _debug = message.parse_error()
+        raise RuntimeError(err.message)
+    with lock:
+        if not outputs:
+            raise RuntimeError(f"{launch} produced no output")
+        return outputs
@@ -1,7 +1,12 @@
+import asyncio
+import logging
+
 import yaml
 
 from collections import Counter
 
+logger = logging.getLogger(__name__)
+
 
 def load_config_with_no_duplicates(raw_config) -> dict:
     """Get config ensuring duplicate keys are not allowed."""
@@ -28,3 +33,18 @@ def load_config_with_no_duplicates(raw_config) -> dict:
         yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG, map_constructor
     )
     return yaml.load(raw_config, PreserveDuplicatesLoader)
+
+
+async def run_command(limiter, *args):
+    """Run an external command without blocking, at most as many at once as
+    limiter (a semaphore) allows. Returns its exit code, failures are logged."""
+    async with limiter:
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _, err = await process.communicate()
+    if process.returncode:
+        logger.error(f"{' '.join(args)} failed ({process.returncode}): {err.decode().strip()}")
+    return process.returncode
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import threading
+import time
+
+from sip2rtsp.gi import Gst
+from sip2rtsp.metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# Elements of the shared pipeline fed by a SourceWatchdog
+SOURCE_APPSRC = "source_in"
+SOURCE_QUEUE = "source_queue"
+SOURCE_SELECTOR = "source_selector"
+
+
+def build_watched_source(source_caps, placeholder=True):
+    """Launch string replacing the video source of a shared pipeline.
+
+    Its raw video is pushed in by a SourceWatchdog. With placeholder, an
+    input-selector switches to a black test pattern of the same caps while
+    the source is stalled, so the encoders keep running without
+    renegotiation.
+    """
+    source = (
+        f"appsrc name={SOURCE_APPSRC} is-live=true format=time do-timestamp=true "
+        f'caps="{source_caps}" ! queue name={SOURCE_QUEUE} leaky=downstream max-size-buffers=2'
+    )
+    if not placeholder:
+        return source
+    return (
+        f"{source} ! input-selector name={SOURCE_SELECTOR} sync-mode=clock "
+        f"videotestsrc is-live=true pattern=black ! {source_caps} ! {SOURCE_SELECTOR}."
+    )
+
+
+class SourceWatchdog:
+    """Runs the video source in a pipeline of its own and restarts it when it stalls.
+
+    Raw frames of the source pipeline are pushed into the appsrc of the
+    shared pipeline (see build_watched_source). When no frame arrived for
+    stall_timeout seconds, or the source pipeline failed, it is torn down
+    and built anew while the shared pipeline, and with it every RTSP
+    session, keeps running. Meanwhile the input-selector shows the
+    placeholder, if any. Restarts of a source that does not recover are
+    backed off up to max_backoff seconds.
+    """
+
+    def __init__(self, source_launch, source_caps, stall_timeout=2.0, max_backoff=30.0):
+        self.launch_string = (
+            f"{source_launch} ! videoconvert ! videoscale ! videorate ! {source_caps} "
+            "! appsink name=sink emit-signals=true sync=false max-buffers=2 drop=true"
+        )
+        self.stall_timeout = stall_timeout
+        self.max_backoff = max_backoff
+
+        self.appsrc = None
+        self.selector = None
+        self.live_pad = None
+        self.placeholder_pad = None
+
+        self.pipeline = None
+        self.running = False
+        self.lock = threading.Lock()
+        self.last_buffer = 0.0
+        self.started = 0.0
+        self.failed = False
+        self.stalled_at = None
+        self.restarted_at = None
+        self.attempts = 0
+        self.next_restart = 0.0
+
+        self.stalls = 0
+        self.restarts = 0
+        self.recovery_time = LatencyHistogram()
+
+    def attach(self, pipeline):
+        """Feed the shared pipeline built with build_watched_source()"""
+        self.appsrc = pipeline.get_by_name(SOURCE_APPSRC)
+        self.selector = pipeline.get_by_name(SOURCE_SELECTOR)
+        if self.selector is None:
+            return
+        for pad in self.selector.sinkpads:
+            peer = pad.get_peer()
+            if peer and peer.get_parent_element().get_name() == SOURCE_QUEUE:
+                self.live_pad = pad
+            else:
+                self.placeholder_pad = pad
+        self._select(self.live_pad)
+
+    def start(self):
+        self.running = True
+        self.failed = False
+        self.attempts = 0
+        self.stalled_at = None
+        self._start_pipeline()
+
+    def stop(self):
+        self.running = False
+        self._stop_pipeline()
+
+    def _start_pipeline(self):
+        pipeline = Gst.parse_launch(self.launch_string)
+        pipeline.set_name("watched-source")
+        pipeline.get_by_name("sink").connect("new-sample", self._on_new_sample, pipeline)
+        bus = pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message::error", self._on_error, pipeline)
+        with self.lock:
+            self.pipeline = pipeline
+            # Startup gets the same grace period as a stall
+            self.started = time.monotonic()
+        pipeline.set_state(Gst.State.PLAYING)
+
+    def _stop_pipeline(self):
+        with self.lock:
+            pipeline, self.pipeline = self.pipeline, None
+        if pipeline is None:
+            return
+        pipeline.get_bus().remove_signal_watch()
+        # A stalled rtspsrc or souphttpsrc may block for seconds while shutting
+        # down, do not hold up the replacement
+        threading.Thread(
+            target=pipeline.set_state, args=(Gst.State.NULL,), daemon=True
+        ).start()
+
+    def _on_new_sample(self, appsink, pipeline):
+        sample = appsink.emit("pull-sample")
+        if sample is None:
+            return Gst.FlowReturn.EOS
+        with self.lock:
+            if pipeline is not self.pipeline:
+                return Gst.FlowReturn.FLUSHING
+            self.last_buffer = time.monotonic()
+        # Retimestamped by the appsrc to the shared pipeline's running time
+        buffer = sample.get_buffer().copy()
+        buffer.pts = Gst.CLOCK_TIME_NONE
+        buffer.dts = Gst.CLOCK_TIME_NONE
+        self.appsrc.emit("push-buffer", buffer)
+        return Gst.FlowReturn.OK
+
+    def _on_error(self, _bus, message, pipeline):
+        err, debug = message.parse_error()
+        logger.error(f"Video source error: {err.message} ({debug})")
+        if pipeline is self.pipeline:
+            self.failed = True
+
+    def _select(self, pad):
+        if self.selector is not None and pad is not None:
+            self.selector.set_property("active-pad", pad)
+
+    def check(self):
+        """Restart the source if it stalled, switch back once it recovered"""
+        if not self.running:
+            return
+        now = time.monotonic()
+        with self.lock:
+            last_buffer = self.last_buffer
+
+        if self.stalled_at is not None:
+            if last_buffer > self.restarted_at and not self.failed:
+                self.recovery_time.record(now - self.stalled_at)
+                logger.info(f"Video source recovered after {now - self.stalled_at:.2f}s")
+                self.stalled_at = None
+                self.attempts = 0
+                self._select(self.live_pad)
+                return
+        elif now - max(last_buffer, self.started) < self.stall_timeout and not self.failed:
+            return
+        else:
+            self.stalled_at = now
+            self.stalls += 1
+            if self.failed:
+                logger.warning("Video source failed")
+            else:
+                idle = now - max(last_buffer, self.started)
+                logger.warning(f"Video source stalled, no frame for {idle:.1f}s")
+            self._select(self.placeholder_pad)
+        if now < self.next_restart:
+            return
+
+        self.restarts += 1
+        self.attempts += 1
+        self.next_restart = now + min(
+            self.stall_timeout * 2 ** (self.attempts - 1), self.max_backoff
+        )
+        logger.info(f"Restarting video source (attempt {self.attempts})")
+        self.restarted_at = now
+        self.failed = False
+        self._stop_pipeline()
+        self._start_pipeline()
+
+    async def run(self):
+        # Checked often enough to keep detection and recovery within a
+        # fraction of stall_timeout
+        interval = min(self.stall_timeout / 4, 0.25)
+        while True:
+            self.check()
+            await asyncio.sleep(interval)
+
+    def get_stats(self):
+        with self.lock:
+            last_buffer = self.last_buffer
+        return {
+            "running": self.running,
+            "stalled": self.stalled_at is not None,
+            "frame_age": time.monotonic() - last_buffer if last_buffer else None,
+            "stalls": self.stalls,
+            "restarts": self.restarts,
+            "recovery_time": self.recovery_time.snapshot(),
+        }
@@ -0,0 +1,263 @@
+import asyncio
+import ctypes
+import json
+import logging
+import os
+import signal
+import sys
+import time
+
+from sip2rtsp.api import HealthHandler, StatsHandler
+
+logger = logging.getLogger(__name__)
+
+# Set in the environment of a worker process: its index, connections, CPU
+# and the file descriptor its reports are written to
+WORKER_ENV = "SIP2RTSP_WORKER"
+PR_SET_PDEATHSIG = 1
+# A worker is unhealthy when it missed this many reports
+MISSED_REPORTS = 3
+
+
+def shard(names, count):
+    """Split the connection names round robin into at most count shards"""
+    names = sorted(names)
+    count = max(1, min(count, len(names)))
+    return [names[i::count] for i in range(count)]
+
+
+def process_stats():
+    """RSS (MB), thread count and CPU seconds of this process"""
+    stats = {"rss_mb": 0.0, "threads": 0, "cpu_time": time.process_time()}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                stats["rss_mb"] = int(line.split()[1]) / 1024
+            elif line.startswith("Threads:"):
+                stats["threads"] = int(line.split()[1])
+    return stats
+
+
+def load_worker():
+    """This process' worker settings, None unless started by a WorkerSupervisor"""
+    worker = os.environ.get(WORKER_ENV)
+    return json.loads(worker) if worker else None
+
+
+def init_worker(worker):
+    """Pin the worker to its CPU and have it terminated with the supervisor.
+
+    Called before GStreamer starts any thread, so they all inherit the
+    CPU affinity.
+    """
+    if worker.get("cpu") is not None:
+        os.sched_setaffinity(0, {worker["cpu"]})
+    # SIGTERM, as if sent by the supervisor, should it die without stopping us
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+    if os.getppid() != worker["supervisor"]:
+        # It died before prctl()
+        os.kill(os.getpid(), signal.SIGTERM)
+
+
+class WorkerReporter:
+    """Writes the health and metrics of a worker's connections to the supervisor"""
+
+    def __init__(self, worker, apps, interval):
+        self.index = worker["index"]
+        self.report = os.fdopen(worker["report_fd"], "w", buffering=1)
+        # Connection name -> Sip2RtspApp
+        self.apps = apps
+        self.interval = interval
+
+    def get_report(self):
+        return {
+            "index": self.index,
+            "pid": os.getpid(),
+            "process": process_stats(),
+            "connections": {
+                name: {
+                    "calls": app.get_call_stats(),
+                    "media": app.get_media_stats(),
+                    "rtsp": app.rtsp_stats.get_stats(),
+                    "rtcp": app.rtcp.get_stats(),
+                }
+                for name, app in self.apps.items()
+            },
+        }
+
+    async def run(self):
+        while True:
+            self.report.write(json.dumps(self.get_report(), default=str) + "\n")
+            await asyncio.sleep(self.interval)
+
+
+class Worker:
+    """One worker process of the supervisor, restarted when it exits"""
+
+    def __init__(self, index, connections, cpu, config):
+        self.index = index
+        self.connections = connections
+        self.cpu = cpu
+        self.config = config
+        self.process = None
+        self.started = None
+        self.stopping = False
+        self.restarts = 0
+        self.last_exit = None
+        self.report = None
+        self.reported = None
+
+    async def start(self):
+        read_fd, write_fd = os.pipe()
+        env = dict(os.environ)
+        env[WORKER_ENV] = json.dumps(
+            {
+                "index": self.index,
+                "connections": self.connections,
+                "cpu": self.cpu,
+                "report_fd": write_fd,
+                "supervisor": os.getpid(),
+            }
+        )
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                sys.executable, "-m", "sip2rtsp", env=env, pass_fds=(write_fd,)
+            )
+        finally:
+            os.close(write_fd)
+        self.started = time.monotonic()
+        self.report = None
+        self.reported = None
+        logger.info(
+            f"Started worker {self.index} (pid {self.process.pid}, "
+            f"cpu {self.cpu if self.cpu is not None else 'any'}): {', '.join(self.connections)}"
+        )
+        return asyncio.get_running_loop().create_task(self.read_reports(read_fd))
+
+    async def read_reports(self, read_fd):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(read_fd, "rb")
+        )
+        try:
+            while line := await reader.readline():
+                try:
+                    self.report = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Invalid report of worker {self.index}")
+                    continue
+                self.reported = time.monotonic()
+        finally:
+            transport.close()
+
+    async def run(self):
+        """Run the worker until stop(), restarting it with backoff when it exits"""
+        delay = self.config.restart_delay
+        while not self.stopping:
+            reports = await self.start()
+            returncode = await self.process.wait()
+            await reports
+            if self.stopping:
+                break
+            self.last_exit = returncode
+            self.restarts += 1
+            if time.monotonic() - self.started > self.config.max_restart_delay:
+                # It ran fine for a while, this is not a crash loop
+                delay = self.config.restart_delay
+            logger.error(
+                f"Worker {self.index} exited with {returncode}, restarting in {delay:.1f}s"
+            )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.config.max_restart_delay)
+
+    async def stop(self, sig=signal.SIGTERM):
+        self.stopping = True
+        if self.process is None or self.process.returncode is not None:
+            return
+        self.process.send_signal(sig)
+        try:
+            await asyncio.wait_for(self.process.wait(), self.config.stop_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Worker {self.index} did not stop, killing it")
+            self.process.kill()
+            await self.process.wait()
+
+    @property
+    def healthy(self):
+        if self.process is None or self.process.returncode is not None:
+            return False
+        max_age = MISSED_REPORTS * self.config.report_interval
+        if self.reported is None:
+            # Still starting up
+            return time.monotonic() - self.started < max_age
+        return time.monotonic() - self.reported < max_age
+
+    def get_stats(self):
+        running = self.process is not None and self.process.returncode is None
+        stats = {
+            "index": self.index,
+            "pid": self.process.pid if running else None,
+            "cpu": self.cpu,
+            "connections": self.connections,
+            "running": running,
+            "healthy": self.healthy,
+            "uptime": time.monotonic() - self.started if running else None,
+            "restarts": self.restarts,
+            "last_exit": self.last_exit,
+            "report_age": time.monotonic() - self.reported if self.reported else None,
+        }
+        if self.report:
+            stats["process"] = self.report["process"]
+        return stats
+
+
+class WorkerSupervisor:
+    """Shards the connections across worker processes and supervises them.
+
+    Each worker runs a subset of the connections, with its own asyncio loop,
+    GIL and GLib context, so a busy connection only slows down the others
+    of its shard. Workers are pinned to CPU cores round robin, restarted when
+    they exit, and stopped with the supervisor. Their periodic reports are
+    aggregated in /api/health and /api/workers.
+    """
+
+    def __init__(self, config):
+        self.config = config.workers
+        cpus = sorted(os.sched_getaffinity(0)) if self.config.pin_cpus else None
+        self.workers = [
+            Worker(index, connections, cpus[index % len(cpus)] if cpus else None, self.config)
+            for index, connections in enumerate(
+                shard(config.connections.keys(), self.config.count)
+            )
+        ]
+        self.tasks = []
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self.tasks = [loop.create_task(worker.run()) for worker in self.workers]
+
+    async def stop(self, sig=signal.SIGTERM):
+        await asyncio.gather(*(worker.stop(sig) for worker in self.workers))
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def get_health(self):
+        workers = {str(w.index): w.healthy for w in self.workers}
+        return {"healthy": all(workers.values()), "workers": workers}
+
+    def get_stats(self):
+        connections = {}
+        for worker in self.workers:
+            if worker.report:
+                connections.update(worker.report["connections"])
+        return {
+            "workers": [worker.get_stats() for worker in self.workers],
+            "connections": connections,
+        }
+
+    def get_request_handlers(self):
+        return [
+            (r"/api/health", HealthHandler, dict(get_health=self.get_health)),
+            (r"/api/workers", StatsHandler, dict(get_stats=self.get_stats)),
+        ]
@@ -0,0 +1,62 @@
+import json
+import unittest
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.web import Application
+
+from sip2rtsp.api import AudioHandler
+from sip2rtsp.audio_control import MICROPHONE, SPEAKER, AudioControl
+
+
+class AudioHandlerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.audio_control = AudioControl()
+        app = Application(
+            [(r"/api/audio", AudioHandler, dict(audio_control=self.audio_control))]
+        )
+        sock, port = bind_unused_port()
+        self.server = HTTPServer(app)
+        self.server.add_sockets([sock])
+        self.url = f"http://127.0.0.1:{port}/api/audio"
+
+    async def asyncTearDown(self):
+        self.server.stop()
+
+    async def post(self, changes):
+        return await AsyncHTTPClient().fetch(
+            self.url, method="POST", body=json.dumps(changes), raise_error=False
+        )
+
+    async def test_change(self):
+        response = await self.post({MICROPHONE: {"mute": True}, SPEAKER: {"volume": 0.5}})
+        self.assertEqual(response.code, 200)
+        state = json.loads(response.body)
+        self.assertEqual(state[MICROPHONE], {"mute": True, "volume": 1.0})
+        self.assertEqual(state[SPEAKER], {"mute": False, "volume": 0.5})
+
+    async def test_invalid_changes_are_rejected(self):
+        for changes in (
+            {MICROPHONE: {"mute": "false"}},
+            {MICROPHONE: {"volume": "0.5"}},
+            {MICROPHONE: {"volume": True}},
+            {MICROPHONE: {"volume": 11}},
+            {MICROPHONE: {"level": 50}},
+            {MICROPHONE: True},
+            {"doorbell": {"mute": True}},
+            [MICROPHONE],
+        ):
+            with self.subTest(changes=changes):
+                self.assertEqual((await self.post(changes)).code, 400)
+        self.assertEqual(self.audio_control.changes, 0)
+
+    async def test_nothing_is_applied_unless_all_entries_are_valid(self):
+        response = await self.post({SPEAKER: {"mute": True}, MICROPHONE: {"mute": "false"}})
+        self.assertEqual(response.code, 400)
+        self.assertFalse(self.audio_control.channels[SPEAKER].mute)
+        self.assertFalse(self.audio_control.channels[MICROPHONE].mute)
+
+
+if __name__ == "__main__":
+    unittest.main()
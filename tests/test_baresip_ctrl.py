@@ -0,0 +1,115 @@
+import asyncio
+import unittest
+
+from sip2rtsp.baresip_ctrl import BaresipControl
+from sip2rtsp.benchmarks.fake_baresip import FakeBaresip
+from sip2rtsp.calls import CallTracker
+from sip2rtsp.const import EVENT_TYPE
+from sip2rtsp.events import OverflowPolicy
+
+TIMEOUT = 5
+
+
+class BaresipControlTest(unittest.IsolatedAsyncioTestCase):
+    async def start(self, **options):
+        self.fake = await FakeBaresip(**options).start()
+        self.ctrl = BaresipControl(
+            "127.0.0.1",
+            self.fake.port,
+            timeout=TIMEOUT,
+            reconnect_min_delay=0.01,
+            reconnect_max_delay=0.05,
+        )
+        await self.ctrl.start()
+        self.calls = CallTracker()
+        self.ctrl.events.subscribe(self.calls.handle_event, name="calls")
+
+    async def asyncTearDown(self):
+        self.ctrl.stop()
+        await self.fake.stop()
+
+    async def test_split_frames(self):
+        await self.start(split=3)
+        self.assertEqual(await self.ctrl.callstat(), "\n(no active calls)\n")
+
+        self.fake.ring()
+        self.assertTrue(await self.calls.wait_for(lambda: self.calls.incoming, TIMEOUT))
+        self.assertEqual(self.ctrl.decoder.pending(), 0)
+
+    async def test_merged_frames(self):
+        await self.start()
+        received = []
+        self.ctrl.events.subscribe(
+            received.append,
+            types=[EVENT_TYPE.CALL_RTCP],
+            type_policies={EVENT_TYPE.CALL_RTCP: OverflowPolicy.BUFFER},
+        )
+        results = await asyncio.gather(*(self.ctrl.callstat() for _ in range(100)))
+        self.assertEqual(set(results), {"\n(no active calls)\n"})
+
+        # Written back to back, so the frames arrive several per read
+        self.fake.flood(100)
+        for _ in range(TIMEOUT * 100):
+            if len(received) == 100:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual([e["rtcp_stats"]["tx"]["sent"] for e in received], list(range(0, 5000, 50)))
+
+    async def test_reconnect_reconciles_calls(self):
+        await self.start()
+        listcalls = asyncio.get_running_loop().create_future()
+        self.ctrl.set_reconnect_callback(listcalls.set_result)
+
+        call = self.fake.ring()
+        self.assertTrue(await self.calls.wait_for(lambda: self.calls.incoming, TIMEOUT))
+        await self.ctrl.accept()
+        self.assertTrue(await self.calls.established(TIMEOUT))
+
+        # Forget the call, as if its events were missed while disconnected
+        self.calls.calls.clear()
+        self.fake.drop()
+        self.calls.reconcile(await asyncio.wait_for(listcalls, TIMEOUT))
+        self.assertEqual(list(self.calls.calls), [call.id])
+        self.assertTrue(self.calls.is_established)
+
+        await self.ctrl.hangup()
+        self.assertTrue(await self.calls.idle(TIMEOUT))
+
+    async def test_dropped_connection_fails_pending_commands(self):
+        await self.start(latency=1)
+        command = asyncio.ensure_future(self.ctrl.command("callstat"))
+        await asyncio.sleep(0.1)
+        self.fake.drop()
+        with self.assertRaises(ConnectionError):
+            await command
+        self.assertEqual(self.ctrl.pending_requests, {})
+
+        await self.ctrl.wait_ready(TIMEOUT)
+        self.fake.latency = 0
+        self.assertEqual(await self.ctrl.callstat(), "\n(no active calls)\n")
+
+    async def test_command_timeout(self):
+        await self.start(latency=0.5)
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.ctrl.command("callstat", timeout=0.05)
+        self.assertEqual(self.ctrl.command_stats["callstat"].timeouts, 1)
+        self.assertEqual(self.ctrl.pending_requests, {})
+
+        # The late response of the timed out command is ignored
+        self.assertEqual(await self.ctrl.callstat(), "\n(no active calls)\n")
+
+    async def test_command_cancellation(self):
+        await self.start(latency=0.5)
+        command = asyncio.ensure_future(self.ctrl.command("callstat"))
+        await asyncio.sleep(0.05)
+        command.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await command
+        self.assertEqual(self.ctrl.command_stats["callstat"].cancelled, 1)
+        self.assertEqual(self.ctrl.pending_requests, {})
+
+        self.assertEqual(await self.ctrl.callstat(), "\n(no active calls)\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
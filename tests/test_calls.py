@@ -0,0 +1,38 @@
+import unittest
+
+from sip2rtsp.calls import CallState, CallTracker
+from sip2rtsp.const import EVENT_TYPE
+
+LISTCALLS = (
+    "\n--- List of active calls (1): ---\n"
+    "  [line 1, id 3e5c8f1e4f0c2a7b]  0:00:05  ESTABLISHED  sip:11@10.10.10.80\n"
+)
+
+
+class CallTrackerReconcileTest(unittest.TestCase):
+    def test_reconciled_call_is_closed_by_its_id(self):
+        calls = CallTracker()
+        calls.reconcile(LISTCALLS)
+        self.assertEqual(list(calls.calls), ["3e5c8f1e4f0c2a7b"])
+        self.assertEqual(calls.calls["3e5c8f1e4f0c2a7b"].state, CallState.ESTABLISHED)
+        self.assertEqual(calls.calls["3e5c8f1e4f0c2a7b"].peeruri, "sip:11@10.10.10.80")
+
+        calls.handle_event(
+            {
+                "type": EVENT_TYPE.CALL_CLOSED,
+                "id": "3e5c8f1e4f0c2a7b",
+                "direction": "outgoing",
+                "peeruri": "sip:11@10.10.10.80",
+            }
+        )
+        self.assertFalse(calls.active)
+
+    def test_reconcile_without_id(self):
+        calls = CallTracker()
+        calls.reconcile("  [line 2]  0:00:01  INCOMING  sip:12@10.10.10.80\n")
+        self.assertEqual(list(calls.calls), ["line2"])
+        self.assertTrue(calls.incoming)
+
+
+if __name__ == "__main__":
+    unittest.main()
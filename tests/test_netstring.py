@@ -0,0 +1,55 @@
+import unittest
+
+from sip2rtsp.netstring import NetstringDecoder, NetstringError
+
+FRAME = b'14:{"event":true},'
+
+
+class NetstringDecoderTest(unittest.TestCase):
+    def test_partial_frames(self):
+        decoder = NetstringDecoder()
+        messages = []
+        for offset in range(len(FRAME)):
+            messages += decoder.feed(FRAME[offset : offset + 1])
+            if offset < len(FRAME) - 1:
+                self.assertEqual(messages, [])
+                self.assertEqual(decoder.pending(), offset + 1)
+        self.assertEqual(messages, [{"event": True}])
+        self.assertEqual(decoder.pending(), 0)
+
+    def test_several_frames_in_one_chunk(self):
+        decoder = NetstringDecoder()
+        data = b'1:1,3:[2],' + FRAME + FRAME[:5]
+        self.assertEqual(decoder.feed(data), [1, [2], {"event": True}])
+        self.assertEqual(decoder.pending(), 5)
+        self.assertEqual(decoder.feed(FRAME[5:] + b"2:"), [{"event": True}])
+        self.assertEqual(decoder.pending(), 2)
+
+    def test_bad_length_prefix(self):
+        for data in (b"1x:a,", b"-1:,", b"abcdefghijklmnop"):
+            with self.subTest(data=data), self.assertRaises(NetstringError):
+                NetstringDecoder().feed(data)
+
+    def test_frame_too_long(self):
+        with self.assertRaises(NetstringError):
+            NetstringDecoder(maxlen=10).feed(b"11:")
+
+    def test_missing_terminator(self):
+        with self.assertRaises(NetstringError):
+            NetstringDecoder().feed(b"1:1;")
+
+    def test_undecodable_frame_is_dropped(self):
+        decoder = NetstringDecoder()
+        self.assertEqual(decoder.feed(b"3:{x}," + FRAME), [{"event": True}])
+
+    def test_resync_after_reset(self):
+        decoder = NetstringDecoder()
+        with self.assertRaises(NetstringError):
+            decoder.feed(b"garbage:" + FRAME)
+        decoder.reset()
+        self.assertEqual(decoder.pending(), 0)
+        self.assertEqual(decoder.feed(FRAME), [{"event": True}])
+
+
+if __name__ == "__main__":
+    unittest.main()